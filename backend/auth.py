@@ -13,6 +13,11 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 security = HTTPBearer()
 
+# Преподаватели и администраторы (telegram_id через запятую): им доступны списки записавшихся
+STAFF_TELEGRAM_IDS = {
+    telegram_id.strip() for telegram_id in os.getenv('STAFF_TELEGRAM_IDS', '').split(',') if telegram_id.strip()
+}
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Создает JWT токен"""
     to_encode = data.copy()
@@ -26,8 +31,12 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
 
 def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """Проверяет JWT токен"""
+    return decode_token(credentials.credentials)
+
+def decode_token(token: str) -> str:
+    """Возвращает telegram_id из JWT токена"""
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         telegram_id: str = payload.get("sub")
         if telegram_id is None:
             raise HTTPException(
@@ -53,6 +62,19 @@ def get_current_user(telegram_id: str = Depends(verify_token)):
         )
     return user
 
+def get_staff_user(current_user = Depends(get_current_user)):
+    """Текущий пользователь, если он преподаватель или администратор"""
+    if current_user.telegram_id not in STAFF_TELEGRAM_IDS:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not enough permissions"
+        )
+    return current_user
+
+def get_user_by_token(token: str):
+    """Пользователь по токену из query-параметра (EventSource не передает заголовок Authorization)"""
+    return get_current_user(decode_token(token))
+
 def create_telegram_token(telegram_id: str) -> str:
     """Создает токен для Telegram пользователя"""
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
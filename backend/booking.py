@@ -0,0 +1,83 @@
+"""
+Запись на урок для маршрутов API
+Общая логика /book для routes_secure (пользователь из токена) и routes_db
+(пользователь по telegram_id): выбор занятия, лист ожидания и ответы по
+статусам BookingRepository.create_booking
+"""
+
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from fastapi import HTTPException, Response
+
+from db.occurrences import OccurrenceError, check_horizon, occurrence_start
+from db.repositories import BookingRepository, LessonRepository
+
+def check_booking_status(status: str):
+    """Ошибка API для статусов create_booking, при которых запись не выдается"""
+    if status == 'full':
+        raise HTTPException(status_code=409, detail="Свободных мест на занятие нет")
+    if status == 'duplicate':
+        raise HTTPException(status_code=409, detail="Вы уже записаны на это занятие")
+    if status == 'key_conflict':
+        raise HTTPException(status_code=422, detail="Idempotency-Key уже использован для другого бронирования")
+
+def book_lesson_for_user(user_id: int, lesson_id: int, booking_date: Optional[str],
+                         idempotency_key: Optional[str], response: Response) -> Dict[str, Any]:
+    """Запись на ближайшее занятие урока или на занятие в указанный день
+
+    Повтор с тем же idempotency_key возвращает ту же запись; если мест
+    нет, пользователь встает в лист ожидания (202).
+    """
+    # Проверяем существование урока
+    lesson = LessonRepository.get_by_id(lesson_id)
+    if not lesson:
+        raise HTTPException(status_code=404, detail="Урок не найден")
+    if not lesson.is_active:
+        raise HTTPException(status_code=400, detail="Урок больше не проводится")
+
+    # Занятие: ближайшее или в указанный день
+    on_date = None
+    if booking_date:
+        try:
+            on_date = datetime.fromisoformat(booking_date.replace('Z', '+00:00')).date()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Неверный формат даты")
+    try:
+        starts_at = occurrence_start(lesson.day_of_week, lesson.start_time, on_date)
+        check_horizon(starts_at)
+    except OccurrenceError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if starts_at <= datetime.now():
+        raise HTTPException(status_code=400, detail="Занятие уже началось")
+
+    status, booking = BookingRepository.create_booking(user_id, lesson_id, starts_at, idempotency_key)
+    if status == 'full':
+        position = BookingRepository.join_waitlist(user_id, lesson_id, starts_at, idempotency_key)
+        if position is not None:
+            response.status_code = 202
+            return {
+                "success": False,
+                "waitlisted": True,
+                "position": position,
+                "message": f"Свободных мест нет: вы в листе ожидания (место {position}). Мы сообщим, когда место освободится",
+                "booking_date": starts_at.isoformat()
+            }
+        # Место освободилось, пока пользователь вставал в очередь, - запись
+        # уже создана из листа ожидания с ключом этого запроса
+        status, booking = BookingRepository.create_booking(user_id, lesson_id, starts_at, idempotency_key)
+    check_booking_status(status)
+
+    return {
+        "success": True,
+        "message": f"Урок '{lesson.title}' забронирован успешно!",
+        "lesson": {
+            "id": lesson.id,
+            "title": lesson.title,
+            "teacher": lesson.teacher.name if lesson.teacher else "Не назначен",
+            "time": f"{lesson.day_of_week}, {lesson.start_time}",
+            "location": lesson.location
+        },
+        "booking_id": booking.id,
+        "booking_date": booking.booking_date.isoformat()
+    }
@@ -0,0 +1,307 @@
+"""
+Кэш с ограничением по времени жизни (TTL) и по количеству записей (LRU)
+Используется для данных CRM/LMS и других часто читаемых данных
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """Кэш с истечением по монотонным часам, LRU-вытеснением и вторичным индексом
+
+    Записи хранятся в двух упорядоченных словарях: один задает порядок
+    использования (для LRU), второй - порядок истечения. Так как TTL
+    одинаковый для всех записей, порядок истечения совпадает с порядком
+    записи, и очистка просматривает только уже устаревшие записи.
+    """
+
+    def __init__(self, ttl: float = 3600, max_entries: int = 10000,
+                 index_by: Optional[Callable[[Any], Hashable]] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        if ttl <= 0:
+            raise ValueError("ttl должен быть больше нуля")
+        if max_entries <= 0:
+            raise ValueError("max_entries должен быть больше нуля")
+
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._index_by = index_by
+        self._clock = clock
+        self._lock = threading.RLock()
+
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()  # порядок LRU
+        self._expires: "OrderedDict[Hashable, float]" = OrderedDict()  # порядок истечения
+        self._index: Dict[Hashable, Dict[Hashable, None]] = {}
+        self._index_keys: Dict[Hashable, Hashable] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        self._expiry_task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return self._is_alive(key, self._clock())
+
+    def _is_alive(self, key: Hashable, now: float) -> bool:
+        expires_at = self._expires.get(key)
+        if expires_at is None:
+            return False
+        if expires_at <= now:
+            self._remove(key)
+            self.expirations += 1
+            return False
+        return True
+
+    def _remove(self, key: Hashable):
+        self._data.pop(key, None)
+        self._expires.pop(key, None)
+        if self._index_by is not None and key in self._index_keys:
+            index_value = self._index_keys.pop(key)
+            bucket = self._index.get(index_value)
+            if bucket is not None:
+                bucket.pop(key, None)
+                if not bucket:
+                    del self._index[index_value]
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Получение значения с обновлением позиции в LRU"""
+        with self._lock:
+            if not self._is_alive(key, self._clock()):
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return self._data[key]
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """Получение значения без обновления LRU и счетчиков"""
+        with self._lock:
+            if not self._is_alive(key, self._clock()):
+                return default
+            return self._data[key]
+
+    def set(self, key: Hashable, value: Any):
+        """Добавление или замена значения"""
+        with self._lock:
+            self._remove(key)
+            self._data[key] = value
+            self._expires[key] = self._clock() + self.ttl
+            if self._index_by is not None:
+                index_value = self._index_by(value)
+                self._index_keys[key] = index_value
+                self._index.setdefault(index_value, {})[key] = None
+
+            while len(self._data) > self.max_entries:
+                oldest_key = next(iter(self._data))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+    def update(self, items: Dict[Hashable, Any]):
+        """Пакетное добавление значений"""
+        with self._lock:
+            for key, value in items.items():
+                self.set(key, value)
+
+    def delete(self, key: Hashable) -> bool:
+        """Удаление значения"""
+        with self._lock:
+            if key not in self._data:
+                return False
+            self._remove(key)
+            return True
+
+    def clear(self):
+        """Полная очистка кэша (счетчики сохраняются)"""
+        with self._lock:
+            self._data.clear()
+            self._expires.clear()
+            self._index.clear()
+            self._index_keys.clear()
+
+    def values(self) -> List[Any]:
+        """Все актуальные значения (без обновления LRU)"""
+        with self._lock:
+            self.clear_expired()
+            return list(self._data.values())
+
+    def items(self) -> Iterator[Tuple[Hashable, Any]]:
+        """Пары ключ-значение актуальных записей (без обновления LRU)"""
+        with self._lock:
+            self.clear_expired()
+            return iter(list(self._data.items()))
+
+    def get_by_index(self, index_value: Hashable) -> List[Any]:
+        """Получение значений по вторичному индексу"""
+        if self._index_by is None:
+            raise ValueError("Кэш создан без вторичного индекса")
+
+        with self._lock:
+            bucket = self._index.get(index_value)
+            if not bucket:
+                self.misses += 1
+                return []
+
+            now = self._clock()
+            result = [
+                self._data[key] for key in list(bucket)
+                if self._is_alive(key, now)
+            ]
+            if result:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return result
+
+    def clear_expired(self) -> int:
+        """Удаление устаревших записей, возвращает количество удаленных"""
+        with self._lock:
+            now = self._clock()
+            removed = 0
+            while self._expires:
+                key, expires_at = next(iter(self._expires.items()))
+                if expires_at > now:
+                    break
+                self._remove(key)
+                removed += 1
+            self.expirations += removed
+            return removed
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика работы кэша"""
+        total = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'max_entries': self.max_entries,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations
+        }
+
+    def start_expiry(self, interval: float = 60):
+        """Запуск фоновой очистки устаревших записей в текущем event loop"""
+        if self._expiry_task is not None and not self._expiry_task.done():
+            return
+        self._expiry_task = asyncio.create_task(self._expiry_loop(interval))
+
+    async def stop_expiry(self):
+        """Остановка фоновой очистки"""
+        if self._expiry_task is None:
+            return
+        self._expiry_task.cancel()
+        try:
+            await self._expiry_task
+        except asyncio.CancelledError:
+            pass
+        self._expiry_task = None
+
+    async def _expiry_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                removed = self.clear_expired()
+                if removed:
+                    logger.debug(f"Удалено устаревших записей из кэша: {removed}")
+            except Exception as e:
+                logger.error(f"Ошибка фоновой очистки кэша: {e}")
+
+
+class SnapshotStore:
+    """Хранилище снимков кэша в локальном файле SQLite
+
+    Каждый раздел (например, 'students') хранится одной строкой со сжатым
+    JSON и временем сохранения, поэтому загрузка при старте - это одно
+    чтение без обращения к внешним системам.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _connect(self) -> sqlite3.Connection:
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=5)
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS cache_snapshots ("
+            "section TEXT PRIMARY KEY, "
+            "saved_at REAL NOT NULL, "
+            "records INTEGER NOT NULL, "
+            "payload BLOB NOT NULL)"
+        )
+        return connection
+
+    def save(self, sections: Dict[str, Tuple[float, List[Any]]]):
+        """Сохранение разделов: {раздел: (время сохранения, записи)}"""
+        rows = [
+            (
+                section,
+                saved_at,
+                len(records),
+                zlib.compress(json.dumps(records, ensure_ascii=False, default=str).encode('utf-8'))
+            )
+            for section, (saved_at, records) in sections.items()
+        ]
+        connection = self._connect()
+        try:
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO cache_snapshots (section, saved_at, records, payload) "
+                    "VALUES (?, ?, ?, ?)",
+                    rows
+                )
+        finally:
+            connection.close()
+
+    def saved_at(self) -> Dict[str, float]:
+        """Время сохранения разделов без чтения самих данных"""
+        if not os.path.exists(self.path):
+            return {}
+
+        connection = self._connect()
+        try:
+            return dict(connection.execute("SELECT section, saved_at FROM cache_snapshots").fetchall())
+        finally:
+            connection.close()
+
+    def load(self, sections: Optional[List[str]] = None) -> Dict[str, Tuple[float, List[Any]]]:
+        """Загрузка разделов (по умолчанию всех): {раздел: (время сохранения, записи)}"""
+        if not os.path.exists(self.path):
+            return {}
+
+        query = "SELECT section, saved_at, payload FROM cache_snapshots"
+        params: Tuple[str, ...] = ()
+        if sections is not None:
+            if not sections:
+                return {}
+            query += f" WHERE section IN ({', '.join('?' * len(sections))})"
+            params = tuple(sections)
+
+        connection = self._connect()
+        try:
+            rows = connection.execute(query, params).fetchall()
+        finally:
+            connection.close()
+
+        return {
+            section: (saved_at, json.loads(zlib.decompress(payload).decode('utf-8')))
+            for section, saved_at, payload in rows
+        }
@@ -0,0 +1,369 @@
+"""
+Устойчивый HTTP-клиент для CRM/LMS
+Повторы с экспоненциальной задержкой, поддержка Retry-After,
+автоматический выключатель (circuit breaker) и ограничение частоты запросов по хосту
+"""
+
+import asyncio
+import codecs
+import json
+import logging
+import random
+import re
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+from urllib.parse import urlsplit
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+# Статусы, при которых запрос имеет смысл повторить
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+DEFAULT_HTTP_CONFIG = {
+    'max_retries': 3,
+    'backoff_base': 0.5,  # секунды
+    'backoff_max': 30,  # секунды
+    'rate_limit': 10,  # запросов в секунду на хост
+    'rate_burst': 10,
+    'failure_threshold': 5,
+    'reset_timeout': 60  # секунды
+}
+
+
+class CRMRequestError(Exception):
+    """Ошибка запроса к CRM/LMS"""
+
+    def __init__(self, message: str, status: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+
+
+class CircuitOpenError(CRMRequestError):
+    """Выключатель разомкнут, запросы к хосту временно не выполняются"""
+
+    def __init__(self, host: str, retry_after: float):
+        super().__init__(f"CRM/LMS {host} временно недоступен, повтор через {int(retry_after)} с")
+        self.host = host
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """Ограничитель частоты запросов (token bucket)"""
+
+    def __init__(self, rate: float, burst: Optional[int] = None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Ожидание свободного слота для запроса"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class CircuitBreaker:
+    """Автоматический выключатель для хоста CRM/LMS"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 60):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.open_until: Optional[float] = None
+        self._trial_in_progress = False
+
+    def allow_request(self) -> bool:
+        """Можно ли выполнить запрос сейчас"""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and self.retry_after() <= 0:
+            self.state = self.HALF_OPEN
+            self._trial_in_progress = False
+        if self.state == self.HALF_OPEN and not self._trial_in_progress:
+            # В полуоткрытом состоянии пропускаем один пробный запрос
+            self._trial_in_progress = True
+            return True
+        return False
+
+    def retry_after(self) -> float:
+        """Сколько секунд осталось до пробного запроса"""
+        if self.state != self.OPEN or self.open_until is None:
+            return 0.0
+        return max(0.0, self.open_until - time.monotonic())
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.open_until = None
+        self._trial_in_progress = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.open_for(self.reset_timeout)
+
+    def open_for(self, seconds: float):
+        """Разомкнуть выключатель на заданное время (например, по Retry-After)"""
+        self.state = self.OPEN
+        self.open_until = time.monotonic() + seconds
+        self._trial_in_progress = False
+
+    def release_trial(self):
+        """Пробный запрос прерван без результата - следующий может его повторить"""
+        self._trial_in_progress = False
+
+    def get_state(self) -> Dict[str, Any]:
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'retry_after': round(self.retry_after(), 1)
+        }
+
+
+class HostState:
+    """Общее состояние запросов к одному хосту CRM/LMS"""
+
+    def __init__(self, host: str, config: Dict[str, Any]):
+        self.host = host
+        self.breaker = CircuitBreaker(config['failure_threshold'], config['reset_timeout'])
+        self.limiter = RateLimiter(config['rate_limit'], config['rate_burst'])
+        self.requests = 0
+        self.retries = 0
+        self.errors = 0
+        self.bytes_received = 0
+        self.last_error: Optional[str] = None
+        self.last_error_at: Optional[datetime] = None
+
+    def get_state(self) -> Dict[str, Any]:
+        return {
+            'host': self.host,
+            'circuit': self.breaker.get_state(),
+            'rate_limit': self.limiter.rate,
+            'requests': self.requests,
+            'retries': self.retries,
+            'errors': self.errors,
+            'bytes_received': self.bytes_received,
+            'last_error': self.last_error,
+            'last_error_at': self.last_error_at.isoformat() if self.last_error_at else None
+        }
+
+
+# Состояние хранится на уровне процесса, чтобы переживать пересоздание интеграций
+_host_states: Dict[str, HostState] = {}
+
+
+def get_host_state(url: str, config: Optional[Dict[str, Any]] = None) -> HostState:
+    """Получение (или создание) состояния хоста по URL"""
+    host = urlsplit(url).netloc or url
+    if host not in _host_states:
+        _host_states[host] = HostState(host, {**DEFAULT_HTTP_CONFIG, **(config or {})})
+    return _host_states[host]
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Разбор заголовка Retry-After (секунды или HTTP-дата)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+async def iter_json_array(content: aiohttp.StreamReader, key: Optional[str] = None,
+                          chunk_size: int = 64 * 1024,
+                          on_chunk: Optional[Callable[[int], None]] = None) -> AsyncIterator[Any]:
+    """Потоковый разбор JSON-массива по элементам
+
+    Если key не задан, ожидается массив на верхнем уровне ответа, иначе
+    разбирается массив из поля key объекта верхнего уровня. В памяти
+    одновременно находятся только текущий фрагмент ответа и один элемент.
+    on_chunk вызывается с размером каждого полученного фрагмента в байтах.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    start_pattern = re.compile(r'"%s"\s*:\s*\[' % re.escape(key)) if key else None
+    buffer = ''
+    started = False
+    finished = False
+
+    async for chunk in content.iter_chunked(chunk_size):
+        if on_chunk is not None:
+            on_chunk(len(chunk))
+        buffer += utf8.decode(chunk)
+        position = 0
+
+        if not started:
+            if start_pattern is None:
+                stripped = buffer.lstrip()
+                if not stripped:
+                    buffer = ''
+                    continue
+                if stripped[0] != '[':
+                    # Вместо массива пришел объект (например, ошибка Moodle) - дочитываем его целиком
+                    rest = await content.read()
+                    raise CRMRequestError(f"Неожиданный ответ CRM/LMS: {(buffer + utf8.decode(rest, final=True))[:300]}")
+                position = len(buffer) - len(stripped) + 1
+            else:
+                match = start_pattern.search(buffer)
+                if match is None:
+                    # Сохраняем хвост на случай, если ключ разрезан между фрагментами
+                    buffer = buffer[-(len(key) + 64):]
+                    continue
+                position = match.end()
+            started = True
+
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position >= len(buffer):
+                break
+            if buffer[position] == ']':
+                finished = True
+                break
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                break  # элемент еще не получен целиком
+            if end >= len(buffer) or buffer[end] not in ' \t\r\n,]':
+                break  # число на границе фрагмента может быть неполным
+            yield item
+            position = end
+
+        buffer = buffer[position:]
+        if finished:
+            return
+
+    if started:
+        raise CRMRequestError("Ответ CRM/LMS оборван: JSON-массив не завершен")
+    if key and buffer.strip():
+        raise CRMRequestError(f"В ответе CRM/LMS нет поля '{key}': ...{buffer[-200:]}")
+
+
+class ResilientHTTPClient:
+    """Обертка над aiohttp.ClientSession с повторами, выключателем и лимитом частоты"""
+
+    def __init__(self, session: aiohttp.ClientSession, config: Optional[Dict[str, Any]] = None):
+        self.session = session
+        self.config = {**DEFAULT_HTTP_CONFIG, **{
+            key: value for key, value in (config or {}).items() if key in DEFAULT_HTTP_CONFIG
+        }}
+
+    def _backoff(self, attempt: int) -> float:
+        """Экспоненциальная задержка с полным джиттером"""
+        ceiling = min(self.config['backoff_max'], self.config['backoff_base'] * (2 ** attempt))
+        return random.uniform(0, ceiling)
+
+    def _record_error(self, host_state: HostState, message: str):
+        host_state.errors += 1
+        host_state.last_error = message
+        host_state.last_error_at = datetime.now()
+        host_state.breaker.record_failure()
+
+    @asynccontextmanager
+    async def request(self, method: str, url: str, **kwargs) -> AsyncIterator[aiohttp.ClientResponse]:
+        """Выполнение запроса с повторами; отдает успешный ответ"""
+        host_state = get_host_state(url, self.config)
+        max_retries = self.config['max_retries']
+
+        for attempt in range(max_retries + 1):
+            if not host_state.breaker.allow_request():
+                raise CircuitOpenError(host_state.host, host_state.breaker.retry_after())
+
+            try:
+                await host_state.limiter.acquire()
+                host_state.requests += 1
+                response = await self.session.request(method, url, **kwargs)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                message = f"{type(e).__name__}: {e}"
+                self._record_error(host_state, message)
+                if attempt == max_retries:
+                    raise CRMRequestError(f"Ошибка запроса к {host_state.host}: {message}") from e
+                delay = self._backoff(attempt)
+            except BaseException:
+                # Отмена задачи (или другая ошибка) во время ожидания лимита или
+                # ответа: пробный запрос не должен навсегда блокировать хост
+                host_state.breaker.release_trial()
+                raise
+            else:
+                if response.status < 400:
+                    host_state.breaker.record_success()
+                    try:
+                        yield response
+                    finally:
+                        response.release()
+                    return
+
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                response.release()
+                message = f"HTTP {response.status}"
+
+                if response.status not in RETRYABLE_STATUSES:
+                    # Ошибки клиента не говорят о недоступности хоста
+                    host_state.breaker.record_success()
+                    host_state.errors += 1
+                    host_state.last_error = message
+                    host_state.last_error_at = datetime.now()
+                    raise CRMRequestError(f"{host_state.host} вернул {message}", response.status)
+
+                self._record_error(host_state, message)
+                if retry_after is not None and retry_after > self.config['backoff_max']:
+                    # Хост просит подождать дольше, чем мы готовы ждать в запросе:
+                    # не обращаемся к нему до указанного времени
+                    host_state.breaker.open_for(retry_after)
+                    raise CircuitOpenError(host_state.host, retry_after)
+                if attempt == max_retries:
+                    raise CRMRequestError(f"{host_state.host} вернул {message}", response.status)
+                delay = self._backoff(attempt)
+                if retry_after is not None:
+                    delay = max(delay, retry_after)
+
+            host_state.retries += 1
+            logger.warning(
+                f"Повтор запроса к {host_state.host} через {delay:.1f} с "
+                f"(повтор {attempt + 1} из {max_retries}): {host_state.last_error}"
+            )
+            await asyncio.sleep(delay)
+
+    async def get_json(self, url: str, **kwargs) -> Any:
+        """GET-запрос с разбором JSON"""
+        async with self.request('GET', url, **kwargs) as response:
+            body = await response.read()
+            get_host_state(url, self.config).bytes_received += len(body)
+            return json.loads(body)
+
+    async def stream_json_array(self, url: str, key: Optional[str] = None, **kwargs) -> AsyncIterator[Any]:
+        """GET-запрос с потоковым разбором JSON-массива по элементам"""
+        host_state = get_host_state(url, self.config)
+
+        def count_bytes(size: int):
+            host_state.bytes_received += size
+
+        async with self.request('GET', url, **kwargs) as response:
+            async for item in iter_json_array(response.content, key, on_chunk=count_bytes):
+                yield item
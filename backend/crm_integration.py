@@ -6,24 +6,39 @@
 import asyncio
 import aiohttp
 import os
-from typing import Dict, List, Optional, Any
+from typing import AsyncIterator, Dict, List, Optional, Any, Tuple, Type
 from datetime import datetime, timedelta
 import json
 import logging
+from .crm_http import ResilientHTTPClient, CRMRequestError, get_host_state
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Возможности интеграций, по которым сервис синхронизации выбирает стратегию
+CAPABILITY_BULK_PROGRESS = 'bulk_progress'  # прогресс всех студентов курса одним запросом
+CAPABILITY_DELTA_QUERIES = 'delta_queries'  # выборка только измененных записей
+CAPABILITY_WEBHOOKS = 'webhooks'  # push-уведомления об изменениях
+
+# Типы сущностей в изменениях, полученных через вебхуки
+ENTITY_STUDENT = 'student'
+ENTITY_LESSON = 'lesson'
+ENTITY_PROGRESS = 'progress'
+
 class CRMIntegration:
     """Базовый класс для интеграции с CRM/LMS системами"""
     
+    crm_type = ''
+    capabilities = frozenset()
+    
     def __init__(self, config: Dict[str, Any]):
         self.config = config
         self.base_url = config.get('base_url', '')
         self.api_key = config.get('api_key', '')
         self.timeout = config.get('timeout', 30)
         self.session = None
+        self.http = None
     
     async def __aenter__(self):
         self.session = aiohttp.ClientSession(
@@ -33,33 +48,98 @@ class CRMIntegration:
                 'Content-Type': 'application/json'
             }
         )
+        self.http = ResilientHTTPClient(self.session, self.config)
         return self
     
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         if self.session:
             await self.session.close()
     
+    @classmethod
+    def make_config(cls, base_url: str, api_token: str, course_id: Optional[str] = None) -> Dict[str, Any]:
+        """Конфигурация интеграции из параметров, заданных в админ-панели"""
+        return {
+            'base_url': base_url,
+            'api_key': api_token,
+            'course_id': course_id,
+            'timeout': 30
+        }
+    
+    @classmethod
+    def supports(cls, capability: str) -> bool:
+        """Поддерживает ли интеграция указанную возможность"""
+        return capability in cls.capabilities
+    
+    def get_http_state(self) -> Dict[str, Any]:
+        """Состояние повторов, выключателя и лимита запросов для хоста"""
+        return get_host_state(self.base_url, self.config).get_state()
+    
     async def health_check(self) -> bool:
         """Проверка доступности CRM/LMS системы"""
         try:
-            async with self.session.get(f"{self.base_url}/health") as response:
-                return response.status == 200
-        except Exception as e:
+            async with self.http.request('GET', f"{self.base_url}/health"):
+                return True
+        except CRMRequestError as e:
             logger.error(f"Ошибка проверки здоровья CRM/LMS: {e}")
             return False
     
+    # Методы получения данных при недоступности CRM/LMS выбрасывают
+    # CRMRequestError, чтобы пустой ответ не затирал уже полученные данные
+    
     async def get_students(self) -> List[Dict[str, Any]]:
         """Получение списка студентов"""
-        raise NotImplementedError
+        return [student async for student in self.iter_students()]
     
     async def get_lessons(self, start_date: str = None, end_date: str = None) -> List[Dict[str, Any]]:
         """Получение расписания занятий"""
+        return [lesson async for lesson in self.iter_lessons(start_date, end_date)]
+    
+    async def iter_students(self) -> AsyncIterator[Dict[str, Any]]:
+        """Потоковое получение студентов по одному, без загрузки всего ответа в память"""
         raise NotImplementedError
+        yield
+    
+    async def iter_lessons(self, start_date: str = None, end_date: str = None) -> AsyncIterator[Dict[str, Any]]:
+        """Потоковое получение занятий по одному, без загрузки всего ответа в память"""
+        raise NotImplementedError
+        yield
     
     async def get_student_progress(self, student_id: str) -> Dict[str, Any]:
         """Получение прогресса студента"""
         raise NotImplementedError
     
+    async def iter_bulk_progress(self) -> AsyncIterator[Dict[str, Any]]:
+        """Прогресс всех студентов курса за один запрос (CAPABILITY_BULK_PROGRESS)"""
+        raise NotImplementedError
+        yield
+    
+    def _build_progress(self, student_id: str, completed: int, total: int) -> Dict[str, Any]:
+        """Прогресс студента в едином формате"""
+        return {
+            'student_id': student_id,
+            'completed_activities': completed,
+            'total_activities': total,
+            'completion_percentage': int((completed / total) * 100) if total > 0 else 0,
+            'last_activity': None,
+            'points': 0
+        }
+    
+    async def get_students_by_ids(self, student_ids: List[str]) -> List[Dict[str, Any]]:
+        """Получение отдельных студентов (для точечных обновлений по вебхукам)"""
+        raise NotImplementedError
+    
+    async def get_lessons_by_ids(self, lesson_ids: List[str]) -> List[Dict[str, Any]]:
+        """Получение отдельных занятий (для точечных обновлений по вебхукам)"""
+        raise NotImplementedError
+    
+    def parse_webhook(self, payload: Any) -> List[Tuple[str, str, bool]]:
+        """Разбор вебхука в список изменений (тип сущности, id, удалена ли)
+        
+        Поддерживается интеграциями с CAPABILITY_WEBHOOKS; события других
+        курсов и неизвестные события пропускаются.
+        """
+        raise NotImplementedError
+    
     async def create_lesson_booking(self, student_id: str, lesson_id: str, date: str) -> bool:
         """Бронирование занятия"""
         raise NotImplementedError
@@ -75,123 +155,208 @@ class CRMIntegration:
 class MoodleIntegration(CRMIntegration):
     """Интеграция с Moodle LMS"""
     
+    capabilities = frozenset({CAPABILITY_BULK_PROGRESS, CAPABILITY_WEBHOOKS})
+    
+    # События Moodle (event observers), которые меняют данные школы
+    WEBHOOK_EVENTS = {
+        '\\core\\event\\user_enrolment_created': (ENTITY_STUDENT, False),
+        '\\core\\event\\user_enrolment_updated': (ENTITY_STUDENT, False),
+        '\\core\\event\\user_enrolment_deleted': (ENTITY_STUDENT, True),
+        '\\core\\event\\user_updated': (ENTITY_STUDENT, False),
+        '\\core\\event\\calendar_event_created': (ENTITY_LESSON, False),
+        '\\core\\event\\calendar_event_updated': (ENTITY_LESSON, False),
+        '\\core\\event\\calendar_event_deleted': (ENTITY_LESSON, True),
+        '\\core\\event\\course_module_completion_updated': (ENTITY_PROGRESS, False),
+        '\\core\\event\\user_graded': (ENTITY_PROGRESS, False)
+    }
+    
     def __init__(self, config: Dict[str, Any]):
         super().__init__(config)
         self.webservice_token = config.get('webservice_token', '')
-        self.session.headers.update({
-            'Authorization': f'Bearer {self.webservice_token}'
-        })
+        self.api_key = self.webservice_token
     
-    async def get_students(self) -> List[Dict[str, Any]]:
-        """Получение списка студентов из Moodle"""
-        try:
-            params = {
-                'wstoken': self.webservice_token,
-                'wsfunction': 'core_enrol_get_enrolled_users',
-                'moodlewsrestformat': 'json',
-                'courseid': self.config.get('course_id', 1)
-            }
-            
-            async with self.session.get(f"{self.base_url}/webservice/rest/server.php", params=params) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    students = []
-                    for user in data:
-                        students.append({
-                            'id': str(user.get('id')),
-                            'username': user.get('username'),
-                            'firstname': user.get('firstname'),
-                            'lastname': user.get('lastname'),
-                            'email': user.get('email'),
-                            'level': self._determine_level(user),
-                            'enrolled_date': user.get('enrolleddate')
-                        })
-                    return students
-                else:
-                    logger.error(f"Ошибка получения студентов: {response.status}")
-                    return []
-        except Exception as e:
-            logger.error(f"Ошибка интеграции с Moodle: {e}")
-            return []
+    @classmethod
+    def make_config(cls, base_url: str, api_token: str, course_id: Optional[str] = None) -> Dict[str, Any]:
+        return {
+            'base_url': base_url,
+            'webservice_token': api_token,
+            'course_id': int(course_id) if course_id else 1,
+            'timeout': 30
+        }
     
-    async def get_lessons(self, start_date: str = None, end_date: str = None) -> List[Dict[str, Any]]:
-        """Получение расписания занятий из Moodle"""
-        try:
-            params = {
-                'wstoken': self.webservice_token,
-                'wsfunction': 'core_calendar_get_calendar_events',
-                'moodlewsrestformat': 'json',
-                'events[courseids][]': self.config.get('course_id', 1)
-            }
-            
-            if start_date:
-                params['events[timestartfrom]'] = start_date
-            if end_date:
-                params['events[timestartto]'] = end_date
-            
-            async with self.session.get(f"{self.base_url}/webservice/rest/server.php", params=params) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    lessons = []
-                    for event in data.get('events', []):
-                        if event.get('eventtype') == 'course':
-                            lessons.append({
-                                'id': str(event.get('id')),
-                                'title': event.get('name'),
-                                'description': event.get('description'),
-                                'start_time': event.get('timestart'),
-                                'end_time': event.get('timeduration'),
-                                'location': event.get('location', 'Онлайн'),
-                                'teacher': self._get_teacher_name(event),
-                                'level': self._determine_lesson_level(event)
-                            })
-                    return lessons
-                else:
-                    logger.error(f"Ошибка получения занятий: {response.status}")
-                    return []
-        except Exception as e:
-            logger.error(f"Ошибка получения занятий из Moodle: {e}")
-            return []
+    async def iter_students(self) -> AsyncIterator[Dict[str, Any]]:
+        """Потоковое получение студентов из Moodle"""
+        params = {
+            'wstoken': self.webservice_token,
+            'wsfunction': 'core_enrol_get_enrolled_users',
+            'moodlewsrestformat': 'json',
+            'courseid': self.config.get('course_id', 1)
+        }
+        
+        async for user in self.http.stream_json_array(f"{self.base_url}/webservice/rest/server.php", params=params):
+            yield self._normalize_student(user)
+    
+    async def get_students_by_ids(self, student_ids: List[str]) -> List[Dict[str, Any]]:
+        """Получение отдельных студентов из Moodle одним запросом"""
+        params = {
+            'wstoken': self.webservice_token,
+            'wsfunction': 'core_user_get_users_by_field',
+            'moodlewsrestformat': 'json',
+            'field': 'id'
+        }
+        for i, student_id in enumerate(student_ids):
+            params[f'values[{i}]'] = student_id
+        
+        data = self._check_response(
+            await self.http.get_json(f"{self.base_url}/webservice/rest/server.php", params=params)
+        )
+        if not isinstance(data, list):
+            raise CRMRequestError(f"Неожиданный ответ Moodle: {str(data)[:300]}")
+        return [self._normalize_student(user) for user in data]
+    
+    async def iter_lessons(self, start_date: str = None, end_date: str = None) -> AsyncIterator[Dict[str, Any]]:
+        """Потоковое получение расписания занятий из Moodle"""
+        params = {
+            'wstoken': self.webservice_token,
+            'wsfunction': 'core_calendar_get_calendar_events',
+            'moodlewsrestformat': 'json',
+            'events[courseids][]': self.config.get('course_id', 1)
+        }
+        
+        if start_date:
+            params['events[timestartfrom]'] = start_date
+        if end_date:
+            params['events[timestartto]'] = end_date
+        
+        async for event in self.http.stream_json_array(
+            f"{self.base_url}/webservice/rest/server.php", key='events', params=params
+        ):
+            if event.get('eventtype') == 'course':
+                yield self._normalize_lesson(event)
+    
+    async def get_lessons_by_ids(self, lesson_ids: List[str]) -> List[Dict[str, Any]]:
+        """Получение отдельных занятий из Moodle одним запросом"""
+        params = {
+            'wstoken': self.webservice_token,
+            'wsfunction': 'core_calendar_get_calendar_events',
+            'moodlewsrestformat': 'json'
+        }
+        for i, lesson_id in enumerate(lesson_ids):
+            params[f'events[eventids][{i}]'] = lesson_id
+        
+        data = self._check_response(
+            await self.http.get_json(f"{self.base_url}/webservice/rest/server.php", params=params)
+        )
+        return [
+            self._normalize_lesson(event) for event in data.get('events', [])
+            if event.get('eventtype') == 'course'
+        ]
+    
+    def parse_webhook(self, payload: Any) -> List[Tuple[str, str, bool]]:
+        """Разбор событий Moodle (одно событие или список)"""
+        events = payload if isinstance(payload, list) else [payload]
+        course_id = str(self.config.get('course_id', 1))
+        changes = []
+        
+        for event in events:
+            if not isinstance(event, dict):
+                continue
+            mapping = self.WEBHOOK_EVENTS.get(event.get('eventname'))
+            if mapping is None or str(event.get('courseid')) != course_id:
+                continue
+            entity, deleted = mapping
+            if entity == ENTITY_LESSON:
+                entity_id = event.get('objectid')
+            else:
+                entity_id = event.get('relateduserid') or event.get('userid')
+            if entity_id is not None:
+                changes.append((entity, str(entity_id), deleted))
+        
+        return changes
     
     async def get_student_progress(self, student_id: str) -> Dict[str, Any]:
-        """Получение прогресса студента из Moodle"""
-        try:
-            params = {
-                'wstoken': self.webservice_token,
-                'wsfunction': 'core_completion_get_activities_completion_status',
-                'moodlewsrestformat': 'json',
-                'userid': student_id,
-                'courseid': self.config.get('course_id', 1)
-            }
-            
-            async with self.session.get(f"{self.base_url}/webservice/rest/server.php", params=params) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    progress = {
-                        'student_id': student_id,
-                        'completed_activities': 0,
-                        'total_activities': len(data.get('statuses', [])),
-                        'completion_percentage': 0,
-                        'last_activity': None,
-                        'points': 0
-                    }
-                    
-                    for status in data.get('statuses', []):
-                        if status.get('state') == 1:  # Completed
-                            progress['completed_activities'] += 1
-                    
-                    if progress['total_activities'] > 0:
-                        progress['completion_percentage'] = int(
-                            (progress['completed_activities'] / progress['total_activities']) * 100
-                        )
-                    
-                    return progress
-                else:
-                    logger.error(f"Ошибка получения прогресса: {response.status}")
-                    return {}
-        except Exception as e:
-            logger.error(f"Ошибка получения прогресса из Moodle: {e}")
-            return {}
+        """Получение прогресса студента из Moodle
+        
+        Тот же отчет об оценках, что и в iter_bulk_progress, но с userid,
+        поэтому прогресс после вебхука совпадает с прогрессом полной синхронизации.
+        """
+        params = {
+            'wstoken': self.webservice_token,
+            'wsfunction': 'gradereport_user_get_grade_items',
+            'moodlewsrestformat': 'json',
+            'courseid': self.config.get('course_id', 1),
+            'userid': student_id
+        }
+        
+        data = self._check_response(
+            await self.http.get_json(f"{self.base_url}/webservice/rest/server.php", params=params)
+        )
+        for user_grades in data.get('usergrades', []):
+            if str(user_grades.get('userid')) == str(student_id):
+                return self._grades_progress(user_grades)
+        return self._build_progress(student_id, 0, 0)
+    
+    async def iter_bulk_progress(self) -> AsyncIterator[Dict[str, Any]]:
+        """Прогресс всех студентов курса из Moodle одним запросом
+        
+        У core_completion_get_activities_completion_status нет пакетной формы,
+        поэтому используется отчет об оценках: без userid он возвращает
+        элементы оценивания сразу для всех студентов курса.
+        """
+        params = {
+            'wstoken': self.webservice_token,
+            'wsfunction': 'gradereport_user_get_grade_items',
+            'moodlewsrestformat': 'json',
+            'courseid': self.config.get('course_id', 1)
+        }
+        
+        async for user_grades in self.http.stream_json_array(
+            f"{self.base_url}/webservice/rest/server.php", key='usergrades', params=params
+        ):
+            yield self._grades_progress(user_grades)
+    
+    def _grades_progress(self, user_grades: Dict[str, Any]) -> Dict[str, Any]:
+        """Прогресс по отчету об оценках: выполнен элемент, по которому выставлена оценка"""
+        items = [
+            item for item in user_grades.get('gradeitems', [])
+            if item.get('itemtype') != 'course'  # итоговая оценка курса не является активностью
+        ]
+        completed = sum(1 for item in items if item.get('graderaw') is not None)
+        return self._build_progress(str(user_grades.get('userid')), completed, len(items))
+    
+    @staticmethod
+    def _check_response(data: Any) -> Any:
+        """Ошибка веб-сервиса Moodle приходит со статусом 200 в виде объекта exception"""
+        if isinstance(data, dict) and 'exception' in data:
+            raise CRMRequestError(
+                f"Moodle вернул ошибку {data.get('errorcode') or data.get('exception')}: {data.get('message', '')}"
+            )
+        return data
+    
+    def _normalize_student(self, user: Dict[str, Any]) -> Dict[str, Any]:
+        """Студент Moodle в едином формате"""
+        return {
+            'id': str(user.get('id')),
+            'username': user.get('username'),
+            'firstname': user.get('firstname'),
+            'lastname': user.get('lastname'),
+            'email': user.get('email'),
+            'level': self._determine_level(user),
+            'enrolled_date': user.get('enrolleddate')
+        }
+    
+    def _normalize_lesson(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        """Событие календаря Moodle в формате занятия"""
+        return {
+            'id': str(event.get('id')),
+            'title': event.get('name'),
+            'description': event.get('description'),
+            'start_time': event.get('timestart'),
+            'end_time': event.get('timeduration'),
+            'location': event.get('location', 'Онлайн'),
+            'teacher': self._get_teacher_name(event),
+            'level': self._determine_lesson_level(event)
+        }
     
     def _determine_level(self, user: Dict[str, Any]) -> str:
         """Определение уровня студента"""
@@ -212,71 +377,143 @@ class MoodleIntegration(CRMIntegration):
 class CanvasIntegration(CRMIntegration):
     """Интеграция с Canvas LMS"""
     
+    capabilities = frozenset({CAPABILITY_BULK_PROGRESS, CAPABILITY_WEBHOOKS})
+    
+    # События Canvas Live Events, которые меняют данные школы
+    WEBHOOK_EVENTS = {
+        'enrollment_created': ENTITY_STUDENT,
+        'enrollment_updated': ENTITY_STUDENT,
+        'user_updated': ENTITY_STUDENT,
+        'calendar_event_created': ENTITY_LESSON,
+        'calendar_event_updated': ENTITY_LESSON,
+        'submission_created': ENTITY_PROGRESS,
+        'submission_updated': ENTITY_PROGRESS,
+        'grade_change': ENTITY_PROGRESS
+    }
+    
     def __init__(self, config: Dict[str, Any]):
         super().__init__(config)
         self.access_token = config.get('access_token', '')
         self.course_id = config.get('course_id', '')
-        self.session.headers.update({
-            'Authorization': f'Bearer {self.access_token}'
-        })
+        self.api_key = self.access_token
     
-    async def get_students(self) -> List[Dict[str, Any]]:
-        """Получение списка студентов из Canvas"""
-        try:
-            async with self.session.get(f"{self.base_url}/api/v1/courses/{self.course_id}/users") as response:
-                if response.status == 200:
-                    data = await response.json()
-                    students = []
-                    for user in data:
-                        if user.get('enrollment_type') == 'student':
-                            students.append({
-                                'id': str(user.get('id')),
-                                'username': user.get('login_id'),
-                                'firstname': user.get('first_name'),
-                                'lastname': user.get('last_name'),
-                                'email': user.get('email'),
-                                'level': self._determine_level(user),
-                                'enrolled_date': user.get('created_at')
-                            })
-                    return students
-                else:
-                    logger.error(f"Ошибка получения студентов: {response.status}")
-                    return []
-        except Exception as e:
-            logger.error(f"Ошибка интеграции с Canvas: {e}")
-            return []
+    @classmethod
+    def make_config(cls, base_url: str, api_token: str, course_id: Optional[str] = None) -> Dict[str, Any]:
+        return {
+            'base_url': base_url,
+            'access_token': api_token,
+            'course_id': course_id or '',
+            'timeout': 30
+        }
     
-    async def get_lessons(self, start_date: str = None, end_date: str = None) -> List[Dict[str, Any]]:
-        """Получение расписания занятий из Canvas"""
-        try:
-            params = {}
-            if start_date:
-                params['start_date'] = start_date
-            if end_date:
-                params['end_date'] = end_date
+    async def iter_students(self) -> AsyncIterator[Dict[str, Any]]:
+        """Потоковое получение студентов из Canvas"""
+        async for user in self.http.stream_json_array(f"{self.base_url}/api/v1/courses/{self.course_id}/users"):
+            if user.get('enrollment_type') == 'student':
+                yield self._normalize_student(user)
+    
+    async def get_students_by_ids(self, student_ids: List[str]) -> List[Dict[str, Any]]:
+        """Получение отдельных студентов из Canvas"""
+        students = []
+        for student_id in student_ids:
+            user = await self.http.get_json(f"{self.base_url}/api/v1/courses/{self.course_id}/users/{student_id}")
+            students.append(self._normalize_student(user))
+        return students
+    
+    async def iter_lessons(self, start_date: str = None, end_date: str = None) -> AsyncIterator[Dict[str, Any]]:
+        """Потоковое получение расписания занятий из Canvas"""
+        params = {}
+        if start_date:
+            params['start_date'] = start_date
+        if end_date:
+            params['end_date'] = end_date
+        
+        async for event in self.http.stream_json_array(
+            f"{self.base_url}/api/v1/courses/{self.course_id}/calendar_events", params=params
+        ):
+            yield self._normalize_lesson(event)
+    
+    async def get_lessons_by_ids(self, lesson_ids: List[str]) -> List[Dict[str, Any]]:
+        """Получение отдельных занятий из Canvas"""
+        lessons = []
+        for lesson_id in lesson_ids:
+            event = await self.http.get_json(f"{self.base_url}/api/v1/calendar_events/{lesson_id}")
+            lessons.append(self._normalize_lesson(event))
+        return lessons
+    
+    async def get_student_progress(self, student_id: str) -> Dict[str, Any]:
+        """Получение прогресса студента из Canvas"""
+        progress = await self.http.get_json(
+            f"{self.base_url}/api/v1/courses/{self.course_id}/users/{student_id}/progress"
+        )
+        return self._build_progress(
+            student_id,
+            progress.get('requirement_completed_count') or 0,
+            progress.get('requirement_count') or 0
+        )
+    
+    async def iter_bulk_progress(self) -> AsyncIterator[Dict[str, Any]]:
+        """Прогресс всех студентов курса из Canvas одним запросом"""
+        async for entry in self.http.stream_json_array(
+            f"{self.base_url}/api/v1/courses/{self.course_id}/bulk_user_progress"
+        ):
+            progress = entry.get('progress') or {}
+            yield self._build_progress(
+                str((entry.get('user') or {}).get('id')),
+                progress.get('requirement_completed_count') or 0,
+                progress.get('requirement_count') or 0
+            )
+    
+    def parse_webhook(self, payload: Any) -> List[Tuple[str, str, bool]]:
+        """Разбор Canvas Live Events (одно событие или список)"""
+        events = payload if isinstance(payload, list) else [payload]
+        changes = []
+        
+        for event in events:
+            if not isinstance(event, dict):
+                continue
+            metadata = event.get('metadata') or {}
+            body = event.get('body') or {}
+            entity = self.WEBHOOK_EVENTS.get(metadata.get('event_name'))
+            if entity is None:
+                continue
+            if metadata.get('context_type') == 'Course' and str(metadata.get('context_id')) != str(self.course_id):
+                continue
             
-            async with self.session.get(f"{self.base_url}/api/v1/courses/{self.course_id}/calendar_events", params=params) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    lessons = []
-                    for event in data:
-                        lessons.append({
-                            'id': str(event.get('id')),
-                            'title': event.get('title'),
-                            'description': event.get('description'),
-                            'start_time': event.get('start_at'),
-                            'end_time': event.get('end_at'),
-                            'location': event.get('location_name', 'Онлайн'),
-                            'teacher': self._get_teacher_name(event),
-                            'level': self._determine_lesson_level(event)
-                        })
-                    return lessons
-                else:
-                    logger.error(f"Ошибка получения занятий: {response.status}")
-                    return []
-        except Exception as e:
-            logger.error(f"Ошибка получения занятий из Canvas: {e}")
-            return []
+            deleted = body.get('workflow_state') == 'deleted'
+            if entity == ENTITY_LESSON:
+                entity_id = body.get('calendar_event_id')
+            else:
+                entity_id = body.get('student_id') or body.get('user_id')
+            if entity_id is not None:
+                changes.append((entity, str(entity_id), deleted))
+        
+        return changes
+    
+    def _normalize_student(self, user: Dict[str, Any]) -> Dict[str, Any]:
+        """Студент Canvas в едином формате"""
+        return {
+            'id': str(user.get('id')),
+            'username': user.get('login_id'),
+            'firstname': user.get('first_name'),
+            'lastname': user.get('last_name'),
+            'email': user.get('email'),
+            'level': self._determine_level(user),
+            'enrolled_date': user.get('created_at')
+        }
+    
+    def _normalize_lesson(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        """Событие календаря Canvas в формате занятия"""
+        return {
+            'id': str(event.get('id')),
+            'title': event.get('title'),
+            'description': event.get('description'),
+            'start_time': event.get('start_at'),
+            'end_time': event.get('end_at'),
+            'location': event.get('location_name', 'Онлайн'),
+            'teacher': self._get_teacher_name(event),
+            'level': self._determine_lesson_level(event)
+        }
     
     def _determine_level(self, user: Dict[str, Any]) -> str:
         """Определение уровня студента"""
@@ -291,17 +528,43 @@ class CanvasIntegration(CRMIntegration):
         return "Преподаватель"
 
 class CRMFactory:
-    """Фабрика для создания интеграций с CRM/LMS"""
+    """Реестр интеграций с CRM/LMS
     
-    @staticmethod
-    def create_integration(crm_type: str, config: Dict[str, Any]) -> CRMIntegration:
-        """Создание интеграции по типу CRM/LMS"""
-        if crm_type.lower() == 'moodle':
-            return MoodleIntegration(config)
-        elif crm_type.lower() == 'canvas':
-            return CanvasIntegration(config)
-        else:
+    Новая интеграция подключается вызовом CRMFactory.register без изменения
+    остального кода; сервис синхронизации выбирает стратегию по ее capabilities.
+    """
+    
+    _integrations: Dict[str, Type[CRMIntegration]] = {}
+    
+    @classmethod
+    def register(cls, crm_type: str, integration_class: Type[CRMIntegration]):
+        """Регистрация интеграции под указанным типом"""
+        integration_class.crm_type = crm_type.lower()
+        cls._integrations[crm_type.lower()] = integration_class
+    
+    @classmethod
+    def get_integration_class(cls, crm_type: str) -> Type[CRMIntegration]:
+        """Класс интеграции по типу CRM/LMS"""
+        integration_class = cls._integrations.get(crm_type.lower())
+        if integration_class is None:
             raise ValueError(f"Неподдерживаемый тип CRM/LMS: {crm_type}")
+        return integration_class
+    
+    @classmethod
+    def create_integration(cls, crm_type: str, config: Dict[str, Any]) -> CRMIntegration:
+        """Создание интеграции по типу CRM/LMS"""
+        return cls.get_integration_class(crm_type)(config)
+    
+    @classmethod
+    def available_integrations(cls) -> Dict[str, List[str]]:
+        """Зарегистрированные интеграции и их возможности"""
+        return {
+            crm_type: sorted(integration_class.capabilities)
+            for crm_type, integration_class in cls._integrations.items()
+        }
+
+CRMFactory.register('moodle', MoodleIntegration)
+CRMFactory.register('canvas', CanvasIntegration)
 
 # Конфигурация по умолчанию
 DEFAULT_CRM_CONFIG = {
@@ -5,12 +5,107 @@
 
 import asyncio
 import logging
+import os
+import time
+from collections import deque
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Any
-from .crm_integration import CRMFactory, DEFAULT_CRM_CONFIG
+from typing import AsyncIterator, Dict, List, Optional, Any, Tuple
+from .crm_integration import (
+    CRMFactory, DEFAULT_CRM_CONFIG, CAPABILITY_BULK_PROGRESS, CAPABILITY_WEBHOOKS,
+    ENTITY_STUDENT, ENTITY_LESSON, ENTITY_PROGRESS
+)
+from .crm_http import CRMRequestError, CircuitOpenError, get_host_state
+from .cache import TTLCache, SnapshotStore
+from db.repositories import CRMSyncRunRepository
 
 logger = logging.getLogger(__name__)
 
+class CRMSyncError(Exception):
+    """Синхронизация завершилась с ошибками"""
+
+async def iter_batches(items: AsyncIterator[Any], batch_size: int) -> AsyncIterator[List[Any]]:
+    """Группировка асинхронного потока записей в пакеты"""
+    batch = []
+    async for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+class SyncRunRecorder:
+    """Сбор метрик одного запуска синхронизации: длительность этапов,
+    количество записей и HTTP-запросов к хосту CRM/LMS"""
+    
+    def __init__(self, crm_type: str, trigger: str, host_state):
+        self.crm_type = crm_type
+        self.trigger = trigger
+        self.host_state = host_state
+        self.started_at = datetime.now()
+        self.phases: Dict[str, Dict[str, Any]] = {}
+        self._started = time.perf_counter()
+        self._http_start = (host_state.requests, host_state.retries, host_state.bytes_received)
+    
+    def record_phase(self, name: str, duration: float, counts: Optional[Dict[str, int]] = None,
+                     error: Optional[str] = None):
+        counts = counts or {}
+        self.phases[name] = {
+            'duration': round(duration, 3),
+            'fetched': counts.get('fetched', 0),
+            'changed': counts.get('changed', 0),
+            'failed': counts.get('failed', 0),
+            'error': error
+        }
+    
+    def finish(self, error: Optional[str] = None) -> Dict[str, Any]:
+        """Итог запуска в формате журнала"""
+        requests, retries, bytes_received = self._http_start
+        return {
+            'crm_type': self.crm_type,
+            'trigger': self.trigger,
+            'status': 'failed' if error else 'success',
+            'started_at': self.started_at,
+            'finished_at': datetime.now(),
+            'duration': round(time.perf_counter() - self._started, 3),
+            'records_fetched': sum(phase['fetched'] for phase in self.phases.values()),
+            'records_changed': sum(phase['changed'] for phase in self.phases.values()),
+            'records_failed': sum(phase['failed'] for phase in self.phases.values()),
+            'http_requests': self.host_state.requests - requests,
+            'http_retries': self.host_state.retries - retries,
+            'bytes_received': self.host_state.bytes_received - bytes_received,
+            'phases': self.phases,
+            'error': error
+        }
+
+def summarize_runs(runs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Сводные метрики по журналу запусков синхронизации"""
+    if not runs:
+        return {'runs': 0}
+    
+    durations = sorted(run['duration'] for run in runs)
+    phases: Dict[str, List[float]] = {}
+    for run in runs:
+        for name, phase in run['phases'].items():
+            phases.setdefault(name, []).append(phase['duration'])
+    
+    return {
+        'runs': len(runs),
+        'success_rate': round(sum(1 for run in runs if run['status'] == 'success') / len(runs), 4),
+        'duration': {
+            'avg': round(sum(durations) / len(durations), 3),
+            'p95': durations[min(len(durations) - 1, int(len(durations) * 0.95))],
+            'max': durations[-1]
+        },
+        'phases': {
+            name: {'avg': round(sum(values) / len(values), 3), 'max': max(values)}
+            for name, values in phases.items()
+        },
+        'avg_records_changed': round(sum(run['records_changed'] for run in runs) / len(runs), 1),
+        'avg_http_requests': round(sum(run['http_requests'] for run in runs) / len(runs), 1),
+        'avg_bytes_received': int(sum(run['bytes_received'] for run in runs) / len(runs))
+    }
+
 class CRMSyncService:
     """Сервис синхронизации с CRM/LMS"""
     
@@ -18,96 +113,283 @@ class CRMSyncService:
         self.crm_type = crm_type
         self.config = config or DEFAULT_CRM_CONFIG.get(crm_type, {})
         self.sync_interval = 300  # 5 минут
+        self.reconciliation_interval = 3600  # сверка при включенных вебхуках
+        self.batch_size = 500  # записей на пакет при потоковой загрузке
         self.running = False
         self.last_sync = None
+        self.last_error = None
+        self.consecutive_failures = 0
+        self.retry_delay = 60  # начальная задержка после ошибки
+        self.recent_runs = deque(maxlen=50)  # последние запуски (журнал хранится в БД)
         
+        # После перезапуска считаем последней синхронизацией время снимка кэша
+        cache_age = crm_cache.snapshot_age()
+        if cache_age is not None:
+            self.last_sync = datetime.now() - timedelta(seconds=cache_age)
+    
     async def start_sync(self):
         """Запуск автоматической синхронизации"""
         self.running = True
         logger.info(f"Запуск синхронизации с {self.crm_type.upper()}")
         
+        # Если кэш восстановлен из свежего снимка, первая синхронизация
+        # откладывается до истечения интервала
+        cache_age = crm_cache.snapshot_age()
+        if cache_age is not None and cache_age < self.get_poll_interval():
+            delay = self.get_poll_interval() - cache_age
+            logger.info(f"Кэш актуален, первая синхронизация через {int(delay)} с")
+            await asyncio.sleep(delay)
+        
         while self.running:
             try:
-                await self.sync_all_data()
+                await self.sync_all_data(trigger='scheduled')
                 self.last_sync = datetime.now()
                 logger.info(f"Синхронизация завершена: {self.last_sync}")
                 
                 # Ждем до следующей синхронизации
-                await asyncio.sleep(self.sync_interval)
-                
+                await asyncio.sleep(self.get_poll_interval())
+            
             except Exception as e:
-                logger.error(f"Ошибка синхронизации: {e}")
-                await asyncio.sleep(60)  # Ждем минуту при ошибке
+                delay = self._failure_delay()
+                logger.error(f"Ошибка синхронизации: {e}. Повтор через {int(delay)} с")
+                await asyncio.sleep(delay)
+    
+    @property
+    def webhooks_enabled(self) -> bool:
+        """Изменения приходят через вебхуки (задан секрет и LMS их поддерживает)"""
+        return bool(self.config.get('webhook_secret')) and \
+            CRMFactory.get_integration_class(self.crm_type).supports(CAPABILITY_WEBHOOKS)
+    
+    def get_poll_interval(self) -> float:
+        """Интервал опроса: при вебхуках опрос нужен только для редкой сверки"""
+        return self.reconciliation_interval if self.webhooks_enabled else self.sync_interval
+    
+    def _failure_delay(self) -> float:
+        """Задержка после неудачной синхронизации"""
+        # Экспоненциально увеличиваем паузу, но не дольше интервала синхронизации,
+        # и не раньше, чем выключатель разрешит пробный запрос
+        backoff = min(self.sync_interval, self.retry_delay * 2 ** max(0, self.consecutive_failures - 1))
+        return max(backoff, self._host_state().breaker.retry_after())
+    
+    def _host_state(self):
+        return get_host_state(self.config.get('base_url', ''), self.config)
+    
+    async def _save_run(self, run: Dict[str, Any]):
+        """Запись запуска в журнал; ошибка журнала не влияет на синхронизацию"""
+        self.recent_runs.append(run)
+        try:
+            await asyncio.to_thread(CRMSyncRunRepository.create_run, run)
+        except Exception as e:
+            logger.error(f"Ошибка записи журнала синхронизации: {e}")
     
     async def stop_sync(self):
         """Остановка синхронизации"""
         self.running = False
         logger.info("Синхронизация остановлена")
     
-    async def sync_all_data(self):
-        """Синхронизация всех данных"""
+    async def sync_all_data(self, trigger: str = 'manual'):
+        """Синхронизация всех данных
+        
+        Ошибка одного этапа не прерывает остальные; если хотя бы один этап
+        не выполнен, выбрасывается CRMSyncError. Этапы применяют данные
+        пакетами по мере загрузки: при ошибке в середине этапа полученные
+        пакеты остаются в кэше (и в снимке), остальные записи сохраняют
+        прежние значения, а удаление отсутствующих в LMS записей
+        выполняется только после полностью загруженного этапа. Каждый
+        запуск записывается в журнал.
+        """
+        run = SyncRunRecorder(self.crm_type, trigger, self._host_state())
+        errors = []
+        phases = [
+            ('students', self.sync_students),
+            ('lessons', self.sync_lessons),
+            ('progress', self.sync_progress),
+            ('tests', self.sync_tests)
+        ]
+        
+        async with CRMFactory.create_integration(self.crm_type, self.config) as crm:
+            for phase_name, phase in phases:
+                started = time.perf_counter()
+                try:
+                    counts = await phase(crm)
+                    run.record_phase(phase_name, time.perf_counter() - started, counts)
+                except CircuitOpenError as e:
+                    # Хост недоступен - остальные этапы выполнять бессмысленно
+                    run.record_phase(phase_name, time.perf_counter() - started, error=str(e))
+                    errors.append(f"{phase_name}: {e}")
+                    break
+                except Exception as e:
+                    run.record_phase(phase_name, time.perf_counter() - started, error=str(e))
+                    errors.append(f"{phase_name}: {e}")
+        
+        # Сохраняем снимок кэша для быстрого старта после перезапуска
+        started = time.perf_counter()
+        await asyncio.to_thread(crm_cache.save_snapshot)
+        run.record_phase('snapshot', time.perf_counter() - started)
+        
+        if errors:
+            self.consecutive_failures += 1
+            self.last_error = '; '.join(errors)
+        else:
+            self.consecutive_failures = 0
+            self.last_error = None
+        
+        await self._save_run(run.finish(self.last_error))
+        if errors:
+            raise CRMSyncError(self.last_error)
+    
+    def parse_webhook(self, payload: Any) -> List[Tuple[str, str, bool]]:
+        """Разбор вебхука средствами текущей интеграции"""
+        integration_class = CRMFactory.get_integration_class(self.crm_type)
+        return integration_class(self.config).parse_webhook(payload)
+    
+    async def apply_changes(self, changes: List[Tuple[str, str, bool]]):
+        """Точечное применение изменений, полученных через вебхуки
+        
+        Из CRM/LMS запрашиваются только измененные студенты и занятия;
+        удаленные сущности убираются из кэша без обращения к LMS.
+        Перед применением кэш обновляется из снимка, чтобы сохраненный
+        после изменений снимок не откатил данные других процессов.
+        """
+        run = SyncRunRecorder(self.crm_type, 'webhook', self._host_state())
+        started = time.perf_counter()
+        upserts = {ENTITY_STUDENT: [], ENTITY_LESSON: [], ENTITY_PROGRESS: []}
+        deleted = {ENTITY_STUDENT: [], ENTITY_LESSON: []}
+        for entity, entity_id, is_deleted in changes:
+            if is_deleted and entity in deleted:
+                deleted[entity].append(entity_id)
+            elif entity in upserts:
+                upserts[entity].append(entity_id)
+        
+        await asyncio.to_thread(crm_cache.refresh_from_snapshot)
+        crm_cache.delete_students(deleted[ENTITY_STUDENT])
+        crm_cache.delete_lessons(deleted[ENTITY_LESSON])
+        
+        counts = {'fetched': 0, 'changed': len(deleted[ENTITY_STUDENT]) + len(deleted[ENTITY_LESSON]), 'failed': 0}
+        progress_ids = dict.fromkeys(upserts[ENTITY_PROGRESS] + upserts[ENTITY_STUDENT])
         try:
             async with CRMFactory.create_integration(self.crm_type, self.config) as crm:
-                # Синхронизация студентов
-                await self.sync_students(crm)
-                
-                # Синхронизация занятий
-                await self.sync_lessons(crm)
-                
-                # Синхронизация прогресса
-                await self.sync_progress(crm)
-                
-                # Синхронизация тестов
-                await self.sync_tests(crm)
+                if upserts[ENTITY_STUDENT]:
+                    students = await crm.get_students_by_ids(upserts[ENTITY_STUDENT])
+                    counts['fetched'] += len(students)
+                    counts['changed'] += crm_cache.upsert_students(students)
+                if upserts[ENTITY_LESSON]:
+                    lessons = await crm.get_lessons_by_ids(upserts[ENTITY_LESSON])
+                    counts['fetched'] += len(lessons)
+                    counts['changed'] += crm_cache.upsert_lessons(lessons)
                 
+                # Прогресс пересчитываем для новых студентов и тех, у кого он изменился
+                for student_id in progress_ids:
+                    try:
+                        progress = await crm.get_student_progress(student_id)
+                        if progress:
+                            counts['changed'] += crm_cache.upsert_progress([progress])
+                            counts['fetched'] += 1
+                    except NotImplementedError:
+                        break
+                    except CircuitOpenError:
+                        raise
+                    except (CRMRequestError, KeyError, TypeError, ValueError) as e:
+                        # Ошибка или некорректный ответ по одному студенту не отменяет остальные изменения
+                        counts['failed'] += 1
+                        logger.warning(f"Не удалось обновить прогресс студента {student_id}: {e}")
+            
+            await asyncio.to_thread(crm_cache.save_snapshot)
         except Exception as e:
-            logger.error(f"Ошибка синхронизации данных: {e}")
+            run.record_phase('changes', time.perf_counter() - started, counts, error=str(e))
+            await self._save_run(run.finish(str(e)))
+            raise
+        
+        run.record_phase('changes', time.perf_counter() - started, counts)
+        await self._save_run(run.finish())
+        logger.info(
+            f"Применены изменения из {self.crm_type}: студентов {len(upserts[ENTITY_STUDENT])}, "
+            f"занятий {len(upserts[ENTITY_LESSON])}, прогресса {len(progress_ids)}, "
+            f"удалено {len(deleted[ENTITY_STUDENT]) + len(deleted[ENTITY_LESSON])}"
+        )
     
-    async def sync_students(self, crm):
+    async def sync_students(self, crm) -> Dict[str, int]:
         """Синхронизация студентов"""
         try:
-            students = await crm.get_students()
-            logger.info(f"Получено {len(students)} студентов из {self.crm_type}")
-            
-            # Здесь будет логика сохранения в базу данных
-            # Пока просто логируем
-            for student in students:
-                logger.debug(f"Студент: {student.get('firstname')} {student.get('lastname')} - {student.get('level')}")
+            changed = 0
+            # Студенты читаются потоком и сохраняются пакетами, поэтому
+            # пиковое потребление памяти не зависит от размера курса
+            received_ids = set()
+            async for batch in iter_batches(crm.iter_students(), self.batch_size):
+                changed += crm_cache.upsert_students(batch)
+                received_ids.update(student['id'] for student in batch)
                 
+                # Здесь будет логика сохранения в базу данных
+                # Пока просто логируем
+                for student in batch:
+                    logger.debug(f"Студент: {student.get('firstname')} {student.get('lastname')} - {student.get('level')}")
+            
+            changed += crm_cache.retain('students', received_ids)
+            logger.info(f"Получено {len(received_ids)} студентов из {self.crm_type}")
+            return {'fetched': len(received_ids), 'changed': changed}
+        
         except Exception as e:
             logger.error(f"Ошибка синхронизации студентов: {e}")
+            raise
     
-    async def sync_lessons(self, crm):
+    async def sync_lessons(self, crm) -> Dict[str, int]:
         """Синхронизация занятий"""
         try:
+            changed = 0
             # Получаем занятия на ближайшие 30 дней
             start_date = datetime.now().isoformat()
             end_date = (datetime.now() + timedelta(days=30)).isoformat()
             
-            lessons = await crm.get_lessons(start_date, end_date)
-            logger.info(f"Получено {len(lessons)} занятий из {self.crm_type}")
-            
-            for lesson in lessons:
-                logger.debug(f"Занятие: {lesson.get('title')} - {lesson.get('start_time')}")
+            received_ids = set()
+            async for batch in iter_batches(crm.iter_lessons(start_date, end_date), self.batch_size):
+                changed += crm_cache.upsert_lessons(batch)
+                received_ids.update(lesson['id'] for lesson in batch)
                 
+                for lesson in batch:
+                    logger.debug(f"Занятие: {lesson.get('title')} - {lesson.get('start_time')}")
+            
+            changed += crm_cache.retain('lessons', received_ids)
+            logger.info(f"Получено {len(received_ids)} занятий из {self.crm_type}")
+            return {'fetched': len(received_ids), 'changed': changed}
+        
         except Exception as e:
             logger.error(f"Ошибка синхронизации занятий: {e}")
+            raise
     
-    async def sync_progress(self, crm):
+    async def sync_progress(self, crm) -> Dict[str, int]:
         """Синхронизация прогресса студентов"""
         try:
-            # Получаем список студентов (в реальном проекте из БД)
-            student_ids = ["123456789", "987654321"]
+            counts = {'fetched': 0, 'changed': 0, 'failed': 0}
+            if crm.supports(CAPABILITY_BULK_PROGRESS):
+                # Прогресс всего курса за один запрос
+                async for batch in iter_batches(crm.iter_bulk_progress(), self.batch_size):
+                    counts['changed'] += crm_cache.upsert_progress(batch)
+                    counts['fetched'] += len(batch)
+                logger.info(f"Получен прогресс {counts['fetched']} студентов из {self.crm_type} одним запросом")
+                return counts
             
-            for student_id in student_ids:
-                progress = await crm.get_student_progress(student_id)
+            # Запасной вариант: по одному запросу на студента из кэша;
+            # ошибка по одному студенту не прерывает этап
+            for student in crm_cache.get_students():
+                try:
+                    progress = await crm.get_student_progress(student['id'])
+                except CircuitOpenError:
+                    raise
+                except CRMRequestError as e:
+                    counts['failed'] += 1
+                    logger.warning(f"Не удалось получить прогресс студента {student['id']}: {e}")
+                    continue
                 if progress:
-                    logger.info(f"Прогресс студента {student_id}: {progress.get('completion_percentage')}%")
-                    
+                    counts['fetched'] += 1
+                    counts['changed'] += crm_cache.upsert_progress([progress])
+                    logger.debug(f"Прогресс студента {student['id']}: {progress.get('completion_percentage')}%")
+            return counts
+        
         except Exception as e:
             logger.error(f"Ошибка синхронизации прогресса: {e}")
+            raise
     
-    async def sync_tests(self, crm):
+    async def sync_tests(self, crm) -> Dict[str, int]:
         """Синхронизация тестов"""
         try:
             tests = await crm.get_tests()
@@ -115,14 +397,19 @@ class CRMSyncService:
             
             for test in tests:
                 logger.debug(f"Тест: {test.get('title', 'Без названия')}")
-                
+            return {'fetched': len(tests)}
+        
+        except NotImplementedError:
+            logger.debug(f"{self.crm_type} не поддерживает получение тестов")
+            return {}
         except Exception as e:
             logger.error(f"Ошибка синхронизации тестов: {e}")
+            raise
     
     async def manual_sync(self):
         """Ручная синхронизация"""
         logger.info("Запуск ручной синхронизации")
-        await self.sync_all_data()
+        await self.sync_all_data(trigger='manual')
         self.last_sync = datetime.now()
         logger.info("Ручная синхронизация завершена")
     
@@ -130,81 +417,273 @@ class CRMSyncService:
         """Получение статуса синхронизации"""
         return {
             'crm_type': self.crm_type,
+            'capabilities': sorted(CRMFactory.get_integration_class(self.crm_type).capabilities),
             'running': self.running,
             'last_sync': self.last_sync.isoformat() if self.last_sync else None,
-            'sync_interval': self.sync_interval
+            'sync_interval': self.sync_interval,
+            'webhooks_enabled': self.webhooks_enabled,
+            'poll_interval': self.get_poll_interval(),
+            'cache_loaded_from_snapshot': crm_cache.loaded_from_snapshot,
+            'last_error': self.last_error,
+            'consecutive_failures': self.consecutive_failures,
+            'last_run': self.recent_runs[-1] if self.recent_runs else None,
+            'http': get_host_state(self.config.get('base_url', ''), self.config).get_state()
         }
 
 class CRMCache:
     """Кэш для данных CRM/LMS"""
     
-    def __init__(self):
-        self.students = {}
-        self.lessons = {}
-        self.progress = {}
-        self.tests = {}
-        self.cache_timeout = 3600  # 1 час
+    # Разделы, которые сохраняются в снимок и восстанавливаются при старте
+    SNAPSHOT_SECTIONS = ('students', 'lessons')
+    
+    def __init__(self, cache_timeout: int = 3600, max_entries: int = 50000,
+                 snapshot_path: Optional[str] = None):
+        self.cache_timeout = cache_timeout  # 1 час
+        self.students = TTLCache(ttl=cache_timeout, max_entries=max_entries)
+        self.lessons = TTLCache(
+            ttl=cache_timeout,
+            max_entries=max_entries,
+            index_by=lambda lesson: lesson.get('level')
+        )
+        self.progress = TTLCache(ttl=cache_timeout, max_entries=max_entries)
+        self.tests = TTLCache(ttl=cache_timeout, max_entries=max_entries)
+        
+        self.snapshot = SnapshotStore(snapshot_path) if snapshot_path else None
+        self.updated_at: Dict[str, float] = {}  # время обновления раздела (unix time)
+        self.loaded_from_snapshot = False
+        self._dirty = set()
+        self._refresh_task: Optional[asyncio.Task] = None
     
     def update_students(self, students: List[Dict[str, Any]]):
         """Обновление кэша студентов"""
-        self.students = {
-            student['id']: {
-                'data': student,
-                'timestamp': datetime.now()
-            }
-            for student in students
-        }
+        self.students.clear()
+        self.students.update({student['id']: student for student in students})
+        self._mark_updated('students')
     
     def update_lessons(self, lessons: List[Dict[str, Any]]):
         """Обновление кэша занятий"""
-        self.lessons = {
-            lesson['id']: {
-                'data': lesson,
-                'timestamp': datetime.now()
-            }
-            for lesson in lessons
-        }
+        self.lessons.clear()
+        self.lessons.update({lesson['id']: lesson for lesson in lessons})
+        self._mark_updated('lessons')
+    
+    def upsert_students(self, students: List[Dict[str, Any]]) -> int:
+        """Добавление или обновление пакета студентов, возвращает число изменений"""
+        return self._upsert('students', {student['id']: student for student in students})
+    
+    def upsert_lessons(self, lessons: List[Dict[str, Any]]) -> int:
+        """Добавление или обновление пакета занятий, возвращает число изменений"""
+        return self._upsert('lessons', {lesson['id']: lesson for lesson in lessons})
+    
+    def upsert_progress(self, progress: List[Dict[str, Any]]) -> int:
+        """Добавление или обновление пакета прогресса, возвращает число изменений"""
+        return self._upsert('progress', {entry['student_id']: entry for entry in progress})
+    
+    def _upsert(self, section: str, records: Dict[str, Dict[str, Any]]) -> int:
+        cache = getattr(self, section)
+        changed = sum(1 for key, record in records.items() if cache.peek(key) != record)
+        cache.update(records)
+        self._mark_updated(section)
+        return changed
+    
+    def get_progress(self, student_id: str) -> Optional[Dict[str, Any]]:
+        """Получение прогресса студента из кэша"""
+        return self.progress.get(student_id)
+    
+    def retain(self, section: str, ids: set) -> int:
+        """Удаление из раздела записей, которых нет среди ids, возвращает число удаленных"""
+        cache = getattr(self, section)
+        removed = 0
+        for key, _ in cache.items():
+            if key not in ids:
+                cache.delete(key)
+                removed += 1
+        self._mark_updated(section)
+        return removed
+    
+    def delete_students(self, student_ids: List[str]) -> int:
+        """Удаление студентов вместе с их прогрессом, возвращает число удаленных"""
+        removed = sum(1 for student_id in student_ids if self.students.delete(student_id))
+        for student_id in student_ids:
+            self.progress.delete(student_id)
+        if student_ids:
+            self._mark_updated('students')
+        return removed
+    
+    def delete_lessons(self, lesson_ids: List[str]) -> int:
+        """Удаление занятий, возвращает число удаленных"""
+        removed = sum(1 for lesson_id in lesson_ids if self.lessons.delete(lesson_id))
+        if lesson_ids:
+            self._mark_updated('lessons')
+        return removed
+    
+    def _mark_updated(self, section: str):
+        self.updated_at[section] = time.time()
+        self._dirty.add(section)
     
     def get_student(self, student_id: str) -> Optional[Dict[str, Any]]:
         """Получение студента из кэша"""
-        if student_id in self.students:
-            cache_entry = self.students[student_id]
-            if (datetime.now() - cache_entry['timestamp']).seconds < self.cache_timeout:
-                return cache_entry['data']
-        return None
+        return self.students.get(student_id)
+    
+    def get_students(self) -> List[Dict[str, Any]]:
+        """Получение всех студентов из кэша"""
+        return self.students.values()
     
     def get_lessons(self, level: str = None) -> List[Dict[str, Any]]:
         """Получение занятий из кэша"""
-        lessons = []
-        for lesson_id, cache_entry in self.lessons.items():
-            if (datetime.now() - cache_entry['timestamp']).seconds < self.cache_timeout:
-                lesson = cache_entry['data']
-                if level is None or lesson.get('level') == level:
-                    lessons.append(lesson)
-        return lessons
+        if level is None:
+            return self.lessons.values()
+        return self.lessons.get_by_index(level)
     
     def clear_expired(self):
         """Очистка устаревших данных"""
-        current_time = datetime.now()
+        for cache in (self.students, self.lessons, self.progress, self.tests):
+            cache.clear_expired()
+    
+    def get_updated_at(self, section: str) -> Optional[str]:
+        """Время последнего обновления раздела в формате ISO"""
+        updated_at = self.updated_at.get(section)
+        return datetime.fromtimestamp(updated_at).isoformat() if updated_at else None
+    
+    def snapshot_age(self) -> Optional[float]:
+        """Возраст самых старых данных в кэше в секундах"""
+        if not self.updated_at:
+            return None
+        return time.time() - min(self.updated_at.values())
+    
+    def save_snapshot(self) -> int:
+        """Сохранение измененных разделов в снимок, возвращает их количество"""
+        if self.snapshot is None or not self._dirty:
+            return 0
         
-        # Очистка студентов
-        expired_students = [
-            student_id for student_id, cache_entry in self.students.items()
-            if (current_time - cache_entry['timestamp']).seconds >= self.cache_timeout
-        ]
-        for student_id in expired_students:
-            del self.students[student_id]
+        # Набор забирается до сохранения: разделы, измененные во время
+        # записи снимка, попадут в следующий снимок
+        dirty, self._dirty = self._dirty, set()
+        sections = {
+            section: (self.updated_at[section], getattr(self, section).values())
+            for section in dirty
+            if section in self.SNAPSHOT_SECTIONS
+        }
+        try:
+            self.snapshot.save(sections)
+        except Exception:
+            self._dirty |= dirty
+            raise
+        logger.info(f"Снимок кэша CRM/LMS сохранен: {', '.join(sections)}")
+        return len(sections)
+    
+    def load_snapshot(self) -> int:
+        """Загрузка кэша из снимка, возвращает количество восстановленных записей"""
+        if self.snapshot is None:
+            return 0
+        
+        try:
+            sections = self.snapshot.load()
+        except Exception as e:
+            logger.error(f"Ошибка загрузки снимка кэша CRM/LMS: {e}")
+            return 0
+        
+        restored = self._restore(sections)
+        self.loaded_from_snapshot = bool(sections)
+        if sections:
+            logger.info(f"Кэш CRM/LMS восстановлен из снимка: {restored} записей")
+        return restored
+    
+    def refresh_from_snapshot(self) -> int:
+        """Перечитывание разделов, которые другой процесс сохранил позже нашего обновления
+        
+        Так процессы получают данные полной синхронизации лидера и изменения
+        из вебхуков, примененные любым воркером; истекший раздел
+        перечитывается, даже если снимок не менялся.
+        """
+        if self.snapshot is None:
+            return 0
         
-        # Очистка занятий
-        expired_lessons = [
-            lesson_id for lesson_id, cache_entry in self.lessons.items()
-            if (current_time - cache_entry['timestamp']).seconds >= self.cache_timeout
+        stale = [
+            section for section, saved_at in self.snapshot.saved_at().items()
+            if section in self.SNAPSHOT_SECTIONS
+            and (saved_at > self.updated_at.get(section, 0) or self._is_expired(section))
         ]
-        for lesson_id in expired_lessons:
-            del self.lessons[lesson_id]
+        restored = self._restore(self.snapshot.load(stale))
+        if stale:
+            logger.debug(f"Кэш CRM/LMS обновлен из снимка: {', '.join(stale)} ({restored} записей)")
+        return restored
+    
+    def _is_expired(self, section: str) -> bool:
+        cache = getattr(self, section)
+        cache.clear_expired()
+        return len(cache) == 0
+    
+    def _restore(self, sections: Dict[str, Tuple[float, List[Dict[str, Any]]]]) -> int:
+        restored = 0
+        for section, (saved_at, records) in sections.items():
+            if section not in self.SNAPSHOT_SECTIONS:
+                continue
+            cache = getattr(self, section)
+            cache.clear()
+            cache.update({record['id']: record for record in records})
+            self.updated_at[section] = saved_at
+            restored += len(records)
+        return restored
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика кэша по типам данных"""
+        age = self.snapshot_age()
+        return {
+            'students': self.students.get_stats(),
+            'lessons': self.lessons.get_stats(),
+            'progress': self.progress.get_stats(),
+            'tests': self.tests.get_stats(),
+            'snapshot': {
+                'path': self.snapshot.path if self.snapshot else None,
+                'loaded_from_snapshot': self.loaded_from_snapshot,
+                'updated_at': {section: self.get_updated_at(section) for section in self.updated_at},
+                'age_seconds': int(age) if age is not None else None
+            }
+        }
+    
+    def start_expiry(self, interval: float = 60):
+        """Запуск фоновой очистки устаревших данных"""
+        for cache in (self.students, self.lessons, self.progress, self.tests):
+            cache.start_expiry(interval)
+    
+    async def stop_expiry(self):
+        """Остановка фоновой очистки"""
+        for cache in (self.students, self.lessons, self.progress, self.tests):
+            await cache.stop_expiry()
+    
+    def start_snapshot_refresh(self, interval: float):
+        """Периодическое обновление из снимка
+        
+        Выполняется во всех процессах, включая лидера: вебхук может
+        обработать любой воркер, и лидер узнает об изменении из снимка.
+        Собственный снимок процесса не перечитывается - время его
+        сохранения совпадает со временем обновления разделов.
+        """
+        if self._refresh_task is not None and not self._refresh_task.done():
+            return
+        self._refresh_task = asyncio.create_task(self._refresh_loop(interval))
+    
+    async def stop_snapshot_refresh(self):
+        """Остановка обновления из снимка"""
+        if self._refresh_task is None:
+            return
+        self._refresh_task.cancel()
+        try:
+            await self._refresh_task
+        except asyncio.CancelledError:
+            pass
+        self._refresh_task = None
+    
+    async def _refresh_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.refresh_from_snapshot)
+            except Exception as e:
+                logger.error(f"Ошибка обновления кэша CRM/LMS из снимка: {e}")
 
 # Глобальный экземпляр кэша
-crm_cache = CRMCache()
+crm_cache = CRMCache(snapshot_path=os.getenv('CRM_CACHE_SNAPSHOT', './crm_cache_snapshot.db'))
 
 async def start_crm_sync(crm_type: str = 'moodle'):
     """Запуск синхронизации CRM/LMS"""
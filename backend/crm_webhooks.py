@@ -0,0 +1,192 @@
+"""
+Прием push-уведомлений (вебхуков) от CRM/LMS
+Проверка подписи, очередь измененных сущностей и фоновый обработчик,
+который точечно обновляет кэш вместо полной синхронизации
+"""
+
+import asyncio
+import hashlib
+import hmac
+import logging
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Заголовок с HMAC-SHA256 подписью тела запроса
+SIGNATURE_HEADER = 'X-CRM-Signature'
+
+# Изменение: (тип сущности, id, удалена ли)
+Change = Tuple[str, str, bool]
+
+
+def sign_payload(secret: str, body: bytes) -> str:
+    """Подпись тела запроса (HMAC-SHA256, hex)"""
+    return hmac.new(secret.encode('utf-8'), body, hashlib.sha256).hexdigest()
+
+
+def verify_signature(secret: str, body: bytes, signature: Optional[str]) -> bool:
+    """Проверка подписи вебхука; допускается префикс 'sha256='"""
+    if not secret or not signature:
+        return False
+    if signature.startswith('sha256='):
+        signature = signature[len('sha256='):]
+    return hmac.compare_digest(sign_payload(secret, body), signature.strip().lower())
+
+
+class ChangeQueue:
+    """Очередь измененных сущностей с объединением повторов
+
+    Несколько событий об одной сущности, пришедшие до обработки, сливаются
+    в одно изменение. При переполнении очередь сбрасывается и выставляется
+    флаг полной сверки - точечные обновления уже не дешевле полной синхронизации.
+    """
+
+    def __init__(self, maxsize: int = 10000):
+        self.maxsize = maxsize
+        self._pending: "OrderedDict[Tuple[str, str], bool]" = OrderedDict()
+        self._event = asyncio.Event()
+        self.needs_full_sync = False
+        self.received = 0
+        self.merged = 0
+        self.overflows = 0
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def put(self, changes: List[Change]) -> int:
+        """Добавление изменений, возвращает количество новых записей в очереди"""
+        added = 0
+        for entity, entity_id, deleted in changes:
+            self.received += 1
+            key = (entity, entity_id)
+            if key in self._pending:
+                self.merged += 1
+            else:
+                added += 1
+            # Последнее событие определяет, удалена ли сущность
+            self._pending[key] = deleted
+
+        if len(self._pending) > self.maxsize:
+            logger.warning(f"Очередь вебхуков переполнена ({len(self._pending)}), будет выполнена полная сверка")
+            self._pending.clear()
+            self.needs_full_sync = True
+            self.overflows += 1
+
+        if self._pending or self.needs_full_sync:
+            self._event.set()
+        return added
+
+    def requeue(self, changes: List[Change]):
+        """Возврат необработанного пакета в начало очереди
+
+        Событие, пришедшее по той же сущности во время обработки, новее
+        возвращаемого, поэтому такие записи не перезаписываются.
+        """
+        for entity, entity_id, deleted in reversed(changes):
+            key = (entity, entity_id)
+            if key not in self._pending:
+                self._pending[key] = deleted
+                self._pending.move_to_end(key, last=False)
+
+        if self._pending or self.needs_full_sync:
+            self._event.set()
+
+    async def get_batch(self, max_items: int = 100, linger: float = 0.5) -> List[Change]:
+        """Ожидание и получение пакета изменений
+
+        После первого события ждем linger секунд, чтобы собрать в пакет
+        связанные изменения (например, серию событий одного курса).
+        """
+        await self._event.wait()
+        if linger:
+            await asyncio.sleep(linger)
+
+        batch = []
+        while self._pending and len(batch) < max_items:
+            (entity, entity_id), deleted = self._pending.popitem(last=False)
+            batch.append((entity, entity_id, deleted))
+
+        if not self._pending and not self.needs_full_sync:
+            self._event.clear()
+        return batch
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'pending': len(self._pending),
+            'received': self.received,
+            'merged': self.merged,
+            'overflows': self.overflows,
+            'needs_full_sync': self.needs_full_sync
+        }
+
+
+class WebhookWorker:
+    """Фоновый обработчик очереди вебхуков"""
+
+    def __init__(self, queue: ChangeQueue, get_service: Callable[[], Any],
+                 batch_size: int = 100, linger: float = 0.5, retry_delay: float = 5):
+        self.queue = queue
+        self.get_service = get_service
+        self.batch_size = batch_size
+        self.linger = linger
+        self.retry_delay = retry_delay
+        self.processed = 0
+        self.failed = 0
+        self.last_error: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Запуск обработчика в текущем event loop"""
+        if self._task is not None and not self._task.done():
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановка обработчика"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            batch = await self.queue.get_batch(self.batch_size, self.linger)
+            service = self.get_service()
+            if service is None:
+                # Изменения и признак полной сверки сохраняются до настройки интеграции
+                logger.warning(
+                    f"Вебхук получен, но интеграция CRM/LMS не настроена. Повтор через {int(self.retry_delay)} с"
+                )
+                self.queue.requeue(batch)
+                await asyncio.sleep(self.retry_delay)
+                continue
+
+            try:
+                if self.queue.needs_full_sync:
+                    self.queue.needs_full_sync = False
+                    await service.manual_sync()
+                if batch:
+                    await service.apply_changes(batch)
+                    self.processed += len(batch)
+                self.last_error = None
+            except Exception as e:
+                # Возвращаем изменения в очередь, чтобы не потерять их
+                self.failed += len(batch)
+                self.last_error = str(e)
+                logger.error(f"Ошибка обработки вебхуков: {e}. Повтор через {int(self.retry_delay)} с")
+                self.queue.requeue(batch)
+                await asyncio.sleep(self.retry_delay)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.queue.get_stats(),
+            'running': self._task is not None and not self._task.done(),
+            'processed': self.processed,
+            'failed': self.failed,
+            'last_error': self.last_error
+        }
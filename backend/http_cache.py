@@ -0,0 +1,169 @@
+"""
+HTTP-кэширование редко меняющихся данных (ETag / If-None-Match)
+ETag строится из версии ресурса (db/versions.py), поэтому повторный запрос
+неизменившихся данных получает 304 без обращения к БД и без тела ответа.
+Для остальных запросов готовый JSON хранится на сервере в виде байтов
+"""
+
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Optional, Type
+
+import orjson
+from fastapi import Request, Response
+from pydantic import BaseModel
+
+from db.repositories import DataVersionRepository
+from .cache import TTLCache
+from db.versions import on_versions_committed
+
+# Ответ зависит от пользователя только через авторизацию, но общие прокси
+# кэшировать его не должны; no-cache - клиент всегда переспрашивает сервер
+CACHE_CONTROL = "private, no-cache"
+
+class ResourceVersions:
+    """Версии ресурсов в памяти процесса
+    
+    Изменения, сделанные этим процессом, видны сразу (после commit);
+    изменения других воркеров - не позже чем через max_age секунд,
+    когда версии перечитываются из БД одним запросом.
+    """
+    
+    def __init__(self, max_age: float = 5):
+        self.max_age = max_age
+        self._versions: Dict[str, int] = {}
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        self.refreshes = 0
+    
+    def get(self, resource: str) -> int:
+        if time.monotonic() - self._loaded_at > self.max_age:
+            with self._lock:
+                if time.monotonic() - self._loaded_at > self.max_age:
+                    self._versions = DataVersionRepository.get_all()
+                    self._loaded_at = time.monotonic()
+                    self.refreshes += 1
+        return self._versions.get(resource, 0)
+    
+    def invalidate(self, resources: Optional[Iterable[str]] = None):
+        """Перечитать версии при следующем обращении"""
+        self._loaded_at = 0.0
+
+resource_versions = ResourceVersions()
+on_versions_committed(resource_versions.invalidate)
+
+def make_etag(resource: str, version: int) -> str:
+    return f'"{resource}-{version}"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Проверка If-None-Match (слабое сравнение, как требует RFC 9110)"""
+    header = request.headers.get('if-none-match')
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    return any(tag.strip().removeprefix('W/') == etag for tag in header.split(','))
+
+class ResponseCacheBackend:
+    """Хранилище готовых ответов
+    
+    Для нескольких воркеров можно подключить общее хранилище (например,
+    Redis) через set_response_cache_backend: ключ уже содержит версию
+    ресурса, поэтому общему хранилищу не нужна отдельная инвалидация.
+    """
+    
+    def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+    
+    def set(self, key: str, body: bytes):
+        raise NotImplementedError
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {}
+
+class MemoryResponseCache(ResponseCacheBackend):
+    """Готовые ответы в памяти процесса (LRU + TTL)
+    
+    Ответы устаревших версий не удаляются явно - к ним больше никто не
+    обращается, и они вытесняются по LRU или истекают по TTL.
+    """
+    
+    def __init__(self, max_entries: int = 1000, ttl: float = 600):
+        self.entries = TTLCache(ttl=ttl, max_entries=max_entries)
+    
+    def get(self, key: str) -> Optional[bytes]:
+        return self.entries.get(key)
+    
+    def set(self, key: str, body: bytes):
+        self.entries.set(key, body)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {'backend': 'memory', **self.entries.get_stats()}
+
+_response_cache: ResponseCacheBackend = MemoryResponseCache()
+
+def get_response_cache() -> ResponseCacheBackend:
+    return _response_cache
+
+def set_response_cache_backend(backend: ResponseCacheBackend):
+    """Замена хранилища готовых ответов до начала работы приложения"""
+    global _response_cache
+    _response_cache = backend
+
+def render_json(content: Any, model: Optional[Type[BaseModel]] = None) -> bytes:
+    """Сериализация так же, как в ORJSONResponse (с проверкой моделью ответа)"""
+    if model is not None:
+        content = model.model_validate(content).model_dump(mode="json")
+    return orjson.dumps(content)
+
+def response_version(resource: str, max_age: Optional[float] = None) -> str:
+    """Версия ответа: версия ресурса и, для max_age, номер интервала времени
+
+    Данные, которые меняются без увеличения версии (счетчики мест),
+    перечитываются не чаще одного раза за max_age секунд. Интервалы
+    считаются по времени эпохи, поэтому у всех воркеров они совпадают.
+    """
+    version = str(resource_versions.get(resource))
+    if max_age:
+        version += f".{int(time.time() // max_age)}"
+    return version
+
+def cached_body(resource: str, model: Optional[Type[BaseModel]], build: Callable[..., Any], *args,
+                max_age: Optional[float] = None, version: Optional[str] = None) -> bytes:
+    """Готовый JSON каталога для версии ресурса
+    
+    Ключ строится по функции build и ее аргументам, а не по пути запроса,
+    поэтому отдельный endpoint и /bootstrap читают одни и те же записи.
+    """
+    if version is None:
+        version = response_version(resource, max_age)
+    cache = get_response_cache()
+    key = f"{resource}:{version}:{build.__name__}:{args!r}"
+    body = cache.get(key)
+    if body is None:
+        body = render_json(build(*args), model)
+        cache.set(key, body)
+    return body
+
+def render_object(parts: Dict[str, bytes]) -> bytes:
+    """JSON-объект из уже сериализованных значений без повторной сериализации"""
+    return b"{" + b",".join(orjson.dumps(name) + b":" + part for name, part in parts.items()) + b"}"
+
+def cached_response(request: Request, resource: str, model: Optional[Type[BaseModel]],
+                    build: Callable[..., Any], *args, max_age: Optional[float] = None) -> Response:
+    """Ответ каталога с учетом версии ресурса
+    
+    304, если у клиента актуальная версия; иначе готовые байты из кэша,
+    а при промахе - build(*args), проверенный моделью model и
+    сериализованный один раз на версию.
+    Версия берется до загрузки данных: если ресурс изменится во время
+    загрузки, ответ сохранится под старой версией и больше не будет выдан.
+    """
+    version = response_version(resource, max_age)
+    etag = make_etag(resource, version)
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    
+    body = cached_body(resource, model, build, *args, version=version)
+    return Response(content=body, media_type="application/json", headers=headers)
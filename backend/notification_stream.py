@@ -0,0 +1,59 @@
+"""
+Поток событий уведомлений для Mini App (Server-Sent Events)
+Клиент держит одно соединение и получает новые уведомления и изменения
+счетчика непрочитанных без периодического перезапроса списка
+"""
+
+import asyncio
+import json
+from typing import Any, AsyncIterator, Dict
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+from db.notification_bus import get_notification_bus
+from db.repositories import NotificationRepository
+
+# Комментарий раз в HEARTBEAT_INTERVAL секунд не дает прокси закрыть
+# простаивающее соединение и позволяет заметить отключение клиента
+HEARTBEAT_INTERVAL = 25
+
+def format_event(event: Dict[str, Any]) -> str:
+    """Событие в формате text/event-stream"""
+    return f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+async def notification_events(user_id: int, request: Request,
+                               heartbeat: float = HEARTBEAT_INTERVAL) -> AsyncIterator[str]:
+    """События пользователя до отключения клиента
+    
+    Первым отправляется текущий счетчик непрочитанных, чтобы клиент,
+    переподключившийся после обрыва, сразу получил актуальное значение.
+    """
+    bus = get_notification_bus()
+    subscription = bus.subscribe(user_id)
+    try:
+        unread_count = await asyncio.to_thread(NotificationRepository.get_unread_count, user_id)
+        yield "retry: 5000\n\n"
+        yield format_event({"type": "unread_count", "unread_count": unread_count})
+        
+        while True:
+            event = await subscription.get(timeout=heartbeat)
+            if await request.is_disconnected():
+                break
+            if event is None:
+                yield ": ping\n\n"
+                continue
+            yield format_event(event)
+    finally:
+        bus.unsubscribe(subscription)
+
+def notification_stream_response(user_id: int, request: Request) -> StreamingResponse:
+    return StreamingResponse(
+        notification_events(user_id, request),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # Отключаем буферизацию ответа в nginx
+            "X-Accel-Buffering": "no"
+        }
+    )
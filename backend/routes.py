@@ -1,7 +1,8 @@
-from fastapi import APIRouter, Query
+from fastapi import APIRouter, Query, Request, Header, HTTPException
 from typing import List, Optional
 import json
 import asyncio
+import os
 from pydantic import BaseModel
 
 router = APIRouter()
@@ -28,6 +29,7 @@ class CRMConfigRequest(BaseModel):
     base_url: str
     api_token: str
     course_id: Optional[str] = None
+    webhook_secret: Optional[str] = None
 
 # Моковые данные (в реальном проекте используйте БД)
 MOCK_SCHEDULE = [
@@ -406,7 +408,11 @@ def update_notification_settings(request: NotificationSettingsRequest):
 
 # Импорт модулей CRM/LMS
 from .crm_integration import CRMFactory, DEFAULT_CRM_CONFIG
-from .crm_sync_service import CRMSyncService, crm_cache
+from .crm_sync_service import CRMSyncService, crm_cache, summarize_runs
+from db.init_db import init_db
+from db.repositories import CRMSyncRunRepository, JobLeaseRepository
+from db.leader import LeaderElection
+from .crm_webhooks import ChangeQueue, WebhookWorker, verify_signature
 
 @router.post('/notifications/send')
 def send_notification(request: NotificationRequest):
@@ -437,6 +443,43 @@ def send_notification(request: NotificationRequest):
 # Глобальный экземпляр сервиса синхронизации
 crm_sync_service = None
 
+# Синхронизацию выполняет только процесс-лидер, даже при нескольких воркерах
+crm_sync_leader = LeaderElection('crm_sync')
+
+# Все процессы раз в интервал перечитывают снимок кэша: его сохраняет лидер
+# после синхронизации и любой воркер после обработки вебхуков
+CRM_CACHE_REFRESH_INTERVAL = float(os.getenv('CRM_CACHE_REFRESH_INTERVAL', '60'))
+
+# Очередь и обработчик вебхуков CRM/LMS
+crm_webhook_queue = ChangeQueue()
+crm_webhook_worker = WebhookWorker(crm_webhook_queue, lambda: crm_sync_service)
+
+@router.on_event("startup")
+async def init_crm_cache():
+    """Восстановление кэша CRM/LMS из снимка и запуск фоновой очистки"""
+    global crm_sync_service
+    
+    # Таблицы журнала синхронизации и аренд фоновых задач
+    await asyncio.to_thread(init_db)
+    await asyncio.to_thread(crm_cache.load_snapshot)
+    crm_cache.start_expiry()
+    crm_cache.start_snapshot_refresh(CRM_CACHE_REFRESH_INTERVAL)
+    crm_webhook_worker.start()
+    
+    # Автосинхронизация из переменных окружения: каждый воркер участвует
+    # в выборах, поэтому синхронизация переживает перезапуск любого из них
+    if os.getenv('CRM_SYNC_AUTOSTART', '').lower() in ('1', 'true', 'yes'):
+        crm_sync_service = CRMSyncService(os.getenv('CRM_TYPE', 'moodle'))
+        crm_sync_leader.start(crm_sync_service.start_sync)
+
+@router.on_event("shutdown")
+async def shutdown_crm_cache():
+    """Остановка фоновой очистки кэша CRM/LMS, обработчика вебхуков и синхронизации"""
+    await crm_sync_leader.stop()
+    await crm_webhook_worker.stop()
+    await crm_cache.stop_snapshot_refresh()
+    await crm_cache.stop_expiry()
+
 @router.get('/crm/status')
 def get_crm_status():
     """Получить статус интеграции с CRM/LMS"""
@@ -448,7 +491,26 @@ def get_crm_status():
             "message": "CRM/LMS интеграция не настроена"
         }
     
-    return crm_sync_service.get_sync_status()
+    return {
+        **crm_sync_service.get_sync_status(),
+        'leader': crm_sync_leader.get_state()
+    }
+
+@router.get('/crm/leases')
+async def get_job_leases():
+    """Получить аренды фоновых задач (какой процесс их выполняет)"""
+    leases = await asyncio.to_thread(JobLeaseRepository.get_all)
+    return {"leases": leases}
+
+@router.get('/crm/integrations')
+def get_crm_integrations():
+    """Получить список поддерживаемых CRM/LMS и их возможностей"""
+    return {"integrations": CRMFactory.available_integrations()}
+
+@router.get('/crm/cache')
+def get_crm_cache_stats():
+    """Получить статистику кэша CRM/LMS"""
+    return crm_cache.get_stats()
 
 @router.post('/crm/sync')
 async def manual_crm_sync():
@@ -473,13 +535,67 @@ async def manual_crm_sync():
             "message": f"Ошибка синхронизации: {str(e)}"
         }
 
+@router.post('/crm/webhook')
+async def receive_crm_webhook(
+    request: Request,
+    x_crm_signature: Optional[str] = Header(None, alias='X-CRM-Signature')
+):
+    """Прием push-уведомлений об изменениях в CRM/LMS"""
+    if crm_sync_service is None or not crm_sync_service.webhooks_enabled:
+        raise HTTPException(status_code=404, detail="Вебхуки CRM/LMS не настроены")
+    
+    body = await request.body()
+    if not verify_signature(crm_sync_service.config['webhook_secret'], body, x_crm_signature):
+        raise HTTPException(status_code=403, detail="Неверная подпись вебхука")
+    
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Некорректный JSON")
+    
+    # Обработка идет в фоне, чтобы LMS быстро получила ответ
+    changes = crm_sync_service.parse_webhook(payload)
+    queued = crm_webhook_queue.put(changes)
+    return {
+        "success": True,
+        "accepted": len(changes),
+        "queued": queued
+    }
+
+@router.get('/crm/webhook/status')
+def get_crm_webhook_status():
+    """Получить статистику обработки вебхуков CRM/LMS"""
+    return crm_webhook_worker.get_stats()
+
+@router.get('/crm/sync/runs')
+async def get_crm_sync_runs(
+    limit: int = Query(50, ge=1, le=500, description="Количество запусков"),
+    crm_type: Optional[str] = Query(None, description="Тип CRM/LMS")
+):
+    """Получить журнал запусков синхронизации с CRM/LMS"""
+    runs = await asyncio.to_thread(CRMSyncRunRepository.get_recent_runs, limit, crm_type)
+    return {
+        "runs": runs,
+        "total": len(runs)
+    }
+
+@router.get('/crm/sync/metrics')
+async def get_crm_sync_metrics(
+    limit: int = Query(100, ge=1, le=1000, description="Количество последних запусков"),
+    crm_type: Optional[str] = Query(None, description="Тип CRM/LMS")
+):
+    """Получить сводные метрики синхронизации по журналу"""
+    runs = await asyncio.to_thread(CRMSyncRunRepository.get_recent_runs, limit, crm_type)
+    return summarize_runs(runs)
+
 @router.get('/crm/students')
 def get_crm_students():
     """Получить список студентов из CRM/LMS"""
-    students = list(crm_cache.students.values())
+    students = crm_cache.get_students()
     return {
-        "students": [entry['data'] for entry in students],
-        "total": len(students)
+        "students": students,
+        "total": len(students),
+        "updated_at": crm_cache.get_updated_at('students')
     }
 
 @router.get('/crm/lessons')
@@ -488,7 +604,8 @@ def get_crm_lessons(level: Optional[str] = Query(None, description="Уровен
     lessons = crm_cache.get_lessons(level)
     return {
         "lessons": lessons,
-        "total": len(lessons)
+        "total": len(lessons),
+        "updated_at": crm_cache.get_updated_at('lessons')
     }
 
 @router.get('/crm/student/{student_id}')
@@ -508,23 +625,17 @@ def configure_crm_integration(request: CRMConfigRequest):
     """Настроить интеграцию с CRM/LMS"""
     global crm_sync_service
     
-    try:
-        config = {
-            'base_url': request.base_url,
-            'timeout': 30
+    if request.crm_type.lower() not in CRMFactory.available_integrations():
+        return {
+            "success": False,
+            "message": f"Неподдерживаемый тип CRM/LMS: {request.crm_type}"
         }
-        
-        if request.crm_type.lower() == 'moodle':
-            config['webservice_token'] = request.api_token
-            config['course_id'] = int(request.course_id) if request.course_id else 1
-        elif request.crm_type.lower() == 'canvas':
-            config['access_token'] = request.api_token
-            config['course_id'] = request.course_id or ''
-        else:
-            return {
-                "success": False,
-                "message": f"Неподдерживаемый тип CRM/LMS: {request.crm_type}"
-            }
+    
+    try:
+        integration_class = CRMFactory.get_integration_class(request.crm_type)
+        config = integration_class.make_config(request.base_url, request.api_token, request.course_id)
+        if request.webhook_secret:
+            config['webhook_secret'] = request.webhook_secret
         
         # Создаем новый сервис синхронизации
         crm_sync_service = CRMSyncService(request.crm_type, config)
@@ -535,7 +646,8 @@ def configure_crm_integration(request: CRMConfigRequest):
             "config": {
                 "crm_type": request.crm_type,
                 "base_url": request.base_url,
-                "course_id": request.course_id
+                "course_id": request.course_id,
+                "webhooks_enabled": crm_sync_service.webhooks_enabled
             }
         }
     except Exception as e:
@@ -600,12 +712,14 @@ async def start_crm_sync():
         }
     
     try:
-        # Запускаем синхронизацию в фоне
-        asyncio.create_task(crm_sync_service.start_sync())
+        # Запускаем синхронизацию в фоне; цикл выполняется только у лидера
+        await crm_sync_leader.stop()
+        crm_sync_leader.start(crm_sync_service.start_sync)
         
         return {
             "success": True,
-            "message": "Автоматическая синхронизация запущена"
+            "message": "Автоматическая синхронизация запущена",
+            "holder": crm_sync_leader.holder
         }
     except Exception as e:
         return {
@@ -614,7 +728,7 @@ async def start_crm_sync():
         }
 
 @router.get('/crm/sync/stop')
-def stop_crm_sync():
+async def stop_crm_sync():
     """Остановить автоматическую синхронизацию"""
     global crm_sync_service
     
@@ -625,7 +739,8 @@ def stop_crm_sync():
         }
     
     try:
-        asyncio.create_task(crm_sync_service.stop_sync())
+        await crm_sync_service.stop_sync()
+        await crm_sync_leader.stop()
         
         return {
             "success": True,
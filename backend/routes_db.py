@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Query, HTTPException, Depends
+from fastapi import APIRouter, Query, HTTPException, Depends, Header, Response
 from typing import List, Optional
 import json
 import asyncio
@@ -7,9 +7,12 @@ from sqlalchemy.orm import Session
 from db.database import get_db
 from db.repositories import (
     UserRepository, LessonRepository, ClubRepository, TestRepository,
-    NotificationRepository, NotificationSettingsRepository, BookingRepository
+    NotificationRepository, NotificationSettingsRepository, BookingRepository,
+    LessonOccurrenceRepository
 )
 from datetime import datetime
+from db.occurrences import OCCURRENCE_HORIZON_WEEKS
+from .booking import book_lesson_for_user
 
 router = APIRouter()
 
@@ -34,6 +37,7 @@ class BookingRequest(BaseModel):
     lesson_id: int
     user_id: str
     booking_date: Optional[str] = None
+    idempotency_key: Optional[str] = None
 
 class TestSubmissionRequest(BaseModel):
     test_id: int
@@ -57,7 +61,11 @@ def get_schedule(
         raise HTTPException(status_code=500, detail=f"Ошибка при получении расписания: {str(e)}")
 
 @router.post('/book')
-def book_lesson(request: BookingRequest):
+def book_lesson(
+    request: BookingRequest,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
     """Забронировать урок"""
     try:
         # Получаем пользователя по telegram_id
@@ -65,34 +73,11 @@ def book_lesson(request: BookingRequest):
         if not user:
             raise HTTPException(status_code=404, detail="Пользователь не найден")
         
-        # Проверяем существование урока
-        lesson = LessonRepository.get_by_id(request.lesson_id)
-        if not lesson:
-            raise HTTPException(status_code=404, detail="Урок не найден")
-        
-        # Парсим дату бронирования
-        booking_date = datetime.now()
-        if request.booking_date:
-            try:
-                booking_date = datetime.fromisoformat(request.booking_date.replace('Z', '+00:00'))
-            except ValueError:
-                raise HTTPException(status_code=400, detail="Неверный формат даты")
-        
-        # Создаем бронирование
-        booking = BookingRepository.create_booking(user.id, request.lesson_id, booking_date)
-        
-        return {
-            "success": True,
-            "message": f"Урок '{lesson.title}' забронирован успешно!",
-            "lesson": {
-                "id": lesson.id,
-                "title": lesson.title,
-                "teacher": lesson.teacher.name if lesson.teacher else "Не назначен",
-                "time": f"{lesson.day_of_week}, {lesson.start_time}",
-                "location": lesson.location
-            },
-            "booking_id": booking.id
-        }
+        # Повтор с тем же ключом возвращает ту же запись
+        return book_lesson_for_user(
+            user.id, request.lesson_id, request.booking_date,
+            idempotency_key or request.idempotency_key, response
+        )
     except HTTPException:
         raise
     except Exception as e:
@@ -111,7 +96,7 @@ def get_clubs():
         raise HTTPException(status_code=500, detail=f"Ошибка при получении клубов: {str(e)}")
 
 @router.post('/clubs/{club_id}/join')
-def join_club(club_id: int, user_id: str):
+def join_club(club_id: int, user_id: str, response: Response):
     """Присоединиться к клубу"""
     try:
         # Получаем пользователя по telegram_id
@@ -125,26 +110,67 @@ def join_club(club_id: int, user_id: str):
             raise HTTPException(status_code=404, detail="Клуб не найден")
         
         # Пытаемся присоединиться к клубу
-        success = ClubRepository.join_club(user.id, club_id)
-        
-        if success:
-            return {
-                "success": True,
-                "message": f"Вы успешно присоединились к клубу '{club.name}'!",
-                "club": {
-                    "id": club.id,
-                    "name": club.name,
-                    "description": club.description,
-                    "schedule": f"{club.day_of_week}, {club.start_time}"
+        status = ClubRepository.join_club(user.id, club_id)
+        if status == 'already_member':
+            raise HTTPException(status_code=409, detail="Вы уже состоите в этом клубе")
+        if status == 'full':
+            position = ClubRepository.join_waitlist(user.id, club_id)
+            if position is not None:
+                response.status_code = 202
+                return {
+                    "success": False,
+                    "waitlisted": True,
+                    "position": position,
+                    "message": f"В клубе нет свободных мест: вы в листе ожидания (место {position}). Мы сообщим, когда место освободится"
                 }
+        
+        return {
+            "success": True,
+            "message": f"Вы успешно присоединились к клубу '{club.name}'!",
+            "club": {
+                "id": club.id,
+                "name": club.name,
+                "description": club.description,
+                "schedule": f"{club.day_of_week}, {club.start_time}"
             }
-        else:
-            raise HTTPException(status_code=400, detail="Не удалось присоединиться к клубу. Возможно, клуб переполнен или вы уже состоите в нем.")
+        }
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при присоединении к клубу: {str(e)}")
 
+@router.post('/clubs/{club_id}/leave')
+def leave_club(club_id: int, user_id: str):
+    """Выйти из клуба или его листа ожидания"""
+    try:
+        user = UserRepository.get_by_telegram_id(user_id)
+        if not user:
+            raise HTTPException(status_code=404, detail="Пользователь не найден")
+        
+        if ClubRepository.leave_club(user.id, club_id):
+            return {"success": True, "message": "Вы вышли из клуба"}
+        raise HTTPException(status_code=404, detail="Вы не состоите в клубе")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка при выходе из клуба: {str(e)}")
+
+@router.post('/bookings/{booking_id}/cancel')
+def cancel_booking(booking_id: int, user_id: str):
+    """Отменить бронирование"""
+    try:
+        user = UserRepository.get_by_telegram_id(user_id)
+        if not user:
+            raise HTTPException(status_code=404, detail="Пользователь не найден")
+        
+        if BookingRepository.cancel_booking(user.id, booking_id):
+            return {"success": True, "message": "Бронирование отменено"}
+        raise HTTPException(status_code=404, detail="Бронирование не найдено")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка при отмене бронирования: {str(e)}")
+
 @router.get('/profile')
 def get_profile(user_id: str = Query(..., description="ID пользователя")):
     """Получить профиль пользователя"""
@@ -264,32 +290,61 @@ def get_lessons(level: Optional[str] = Query(None, description="Уровень 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при получении уроков: {str(e)}")
 
+@router.get('/lessons/{lesson_id}/occurrences')
+def get_lesson_occurrences(
+    lesson_id: int,
+    weeks: int = Query(OCCURRENCE_HORIZON_WEEKS, ge=1, le=OCCURRENCE_HORIZON_WEEKS, description="Недель вперед")
+):
+    """Ближайшие занятия урока со свободными местами"""
+    try:
+        if not LessonRepository.get_by_id(lesson_id):
+            raise HTTPException(status_code=404, detail="Урок не найден")
+        occurrences = LessonOccurrenceRepository.get_upcoming(lesson_id, weeks)
+        return {"occurrences": occurrences, "total": len(occurrences)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка при получении занятий: {str(e)}")
+
 @router.get('/notifications')
-def get_notifications(user_id: str = Query(..., description="ID пользователя")):
-    """Получить уведомления пользователя"""
+def get_notifications(
+    user_id: str = Query(..., description="ID пользователя"),
+    before_id: Optional[int] = Query(None, description="Уведомления старше указанного"),
+    after_id: Optional[int] = Query(None, description="Уведомления новее указанного"),
+    notification_type: Optional[str] = Query(None, description="Тип уведомления"),
+    unread_only: bool = Query(False, description="Только непрочитанные"),
+    limit: int = Query(50, ge=1, le=100, description="Размер страницы")
+):
+    """Получить уведомления пользователя
+    
+    Страница от новых к старым: before_id - загрузить более старые (для
+    бесконечной прокрутки), after_id - более новые. Курсоры следующих
+    запросов возвращаются в поле cursor.
+    """
     try:
         user = UserRepository.get_by_telegram_id(user_id)
         if not user:
             raise HTTPException(status_code=404, detail="Пользователь не найден")
         
-        notifications = NotificationRepository.get_user_notifications(user.id)
+        if before_id is not None and after_id is not None:
+            raise HTTPException(status_code=400, detail="Укажите только один из параметров before_id и after_id")
+        
+        notifications, has_more = NotificationRepository.get_notifications_page(
+            user.id, limit, before_id, after_id, notification_type, unread_only
+        )
         unread_count = NotificationRepository.get_unread_count(user.id)
         
-        notification_list = []
-        for notification in notifications:
-            notification_list.append({
-                "id": notification.id,
-                "title": notification.title,
-                "message": notification.message,
-                "is_read": notification.is_read,
-                "notification_type": notification.notification_type,
-                "created_at": notification.created_at.isoformat() if notification.created_at else None
-            })
+        notification_list = [NotificationRepository.notification_to_dict(notification) for notification in notifications]
         
         return {
             "notifications": notification_list,
             "unread_count": unread_count,
-            "total": len(notification_list)
+            "total": len(notification_list),
+            "has_more": has_more,
+            "cursor": {
+                "before_id": notification_list[-1]["id"] if notification_list else before_id,
+                "after_id": notification_list[0]["id"] if notification_list else after_id
+            }
         }
     except HTTPException:
         raise
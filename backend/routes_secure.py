@@ -1,18 +1,32 @@
-from fastapi import APIRouter, Query, HTTPException, Depends
-from typing import List, Optional
+from fastapi import APIRouter, Query, HTTPException, Depends, Header, Request, Response
+from fastapi.responses import ORJSONResponse
+from typing import Dict, List, Optional
 import json
+import os
 import asyncio
+from functools import partial
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
 from db.database import get_db
 from db.repositories import (
     UserRepository, LessonRepository, ClubRepository, TestRepository,
-    NotificationRepository, NotificationSettingsRepository, BookingRepository
+    NotificationRepository, NotificationSettingsRepository, BookingRepository,
+    LessonOccurrenceRepository
 )
-from .auth import get_current_user, create_telegram_token
+from .auth import get_current_user, get_staff_user, get_user_by_token, verify_token, create_telegram_token
+from .http_cache import cached_body, cached_response, get_response_cache, render_json, render_object
+from .booking import book_lesson_for_user
+from .notification_stream import notification_stream_response
 from datetime import datetime
+from db.occurrences import OCCURRENCE_HORIZON_WEEKS
 
-router = APIRouter()
+# Ответы сериализуются через orjson; для маршрутов с response_model FastAPI
+# проверяет данные моделью и не прогоняет их через jsonable_encoder
+router = APIRouter(default_response_class=ORJSONResponse)
+
+# Вступление в клуб не меняет версию 'clubs', поэтому число участников
+# в списке клубов обновляется не реже, чем раз в столько секунд
+CLUB_COUNTS_MAX_AGE = float(os.getenv('CLUB_COUNTS_MAX_AGE', '10'))
 
 # Pydantic модели
 class NotificationRequest(BaseModel):
@@ -32,6 +46,7 @@ class NotificationSettingsRequest(BaseModel):
 class BookingRequest(BaseModel):
     lesson_id: int
     booking_date: Optional[str] = None
+    idempotency_key: Optional[str] = None
 
 class TestSubmissionRequest(BaseModel):
     test_id: int
@@ -40,6 +55,202 @@ class TestSubmissionRequest(BaseModel):
 class LoginRequest(BaseModel):
     telegram_id: str
 
+# Модели ответов
+class ScheduleItem(BaseModel):
+    id: int
+    title: str
+    teacher: str
+    time: str
+    location: Optional[str] = None
+    level: str
+    duration: str
+
+class ScheduleResponse(BaseModel):
+    schedule: List[ScheduleItem]
+    total: int
+    level: Optional[str] = None
+
+class LessonItem(BaseModel):
+    id: int
+    title: str
+    description: Optional[str] = None
+    level: str
+    duration: Optional[int] = None
+    teacher: str
+    schedule: str
+    location: Optional[str] = None
+
+class LessonsResponse(BaseModel):
+    lessons: List[LessonItem]
+    total: int
+
+class OccurrenceItem(BaseModel):
+    id: Optional[int] = None  # None - занятие по расписанию еще не создано
+    lesson_id: int
+    starts_at: str
+    booked_count: int
+    max_students: Optional[int] = None
+    seats_left: int
+
+class OccurrencesResponse(BaseModel):
+    occurrences: List[OccurrenceItem]
+    total: int
+
+class RosterItem(BaseModel):
+    booking_id: int
+    user_id: int
+    telegram_id: str
+    name: Optional[str] = None
+
+class RosterResponse(BaseModel):
+    occurrence_id: int
+    roster: List[RosterItem]
+    total: int
+
+class ClubItem(BaseModel):
+    id: int
+    name: str
+    description: Optional[str] = None
+    schedule: str
+    max_participants: Optional[int] = None
+    current_participants: int
+
+class ClubsResponse(BaseModel):
+    clubs: List[ClubItem]
+    total: int
+
+class TestItem(BaseModel):
+    id: int
+    title: str
+    description: Optional[str] = None
+    level: str
+    questions_count: int
+    time_limit: Optional[int] = None
+
+class TestsResponse(BaseModel):
+    tests: List[TestItem]
+    total: int
+
+class ProfileResponse(BaseModel):
+    user_id: str
+    level: Optional[str] = None
+    progress: Optional[float] = None
+    lessons_completed: Optional[int] = None
+    points: Optional[int] = None
+    current_streak: int
+    total_study_time: str
+
+class NotificationItem(BaseModel):
+    id: int
+    title: str
+    message: str
+    is_read: bool
+    notification_type: str
+    created_at: Optional[str] = None
+
+class NotificationCursor(BaseModel):
+    before_id: Optional[int] = None
+    after_id: Optional[int] = None
+
+class NotificationsResponse(BaseModel):
+    notifications: List[NotificationItem]
+    unread_count: int
+    total: int
+    has_more: bool
+    cursor: NotificationCursor
+
+class BootstrapResponse(BaseModel):
+    profile: Optional[ProfileResponse] = None
+    schedule: Optional[ScheduleResponse] = None
+    clubs: Optional[ClubsResponse] = None
+    tests: Optional[TestsResponse] = None
+    notifications: Optional[NotificationsResponse] = None
+    errors: Dict[str, str]
+
+# Данные экранов Mini App; используются отдельными endpoint'ами и /bootstrap
+def build_schedule_view(level: Optional[str] = None) -> dict:
+    schedule = LessonRepository.get_schedule(level)
+    return {
+        "schedule": schedule,
+        "total": len(schedule),
+        "level": level
+    }
+
+def build_lessons_view(level: Optional[str] = None) -> dict:
+    lesson_list = []
+    for lesson in LessonRepository.get_all(level):
+        lesson_list.append({
+            "id": lesson.id,
+            "title": lesson.title,
+            "description": lesson.description,
+            "level": lesson.level,
+            "duration": lesson.duration,
+            "teacher": lesson.teacher.name if lesson.teacher else "Не назначен",
+            "schedule": f"{lesson.day_of_week}, {lesson.start_time}",
+            "location": lesson.location
+        })
+    
+    return {
+        "lessons": lesson_list,
+        "total": len(lesson_list)
+    }
+
+def build_clubs_view() -> dict:
+    clubs = ClubRepository.get_clubs_with_membership_count()
+    return {
+        "clubs": clubs,
+        "total": len(clubs)
+    }
+
+def build_tests_view(level: Optional[str] = None) -> dict:
+    test_list = []
+    for test in TestRepository.get_all(level):
+        questions = json.loads(test.questions)
+        test_list.append({
+            "id": test.id,
+            "title": test.title,
+            "description": test.description,
+            "level": test.level,
+            "questions_count": len(questions),
+            "time_limit": test.time_limit
+        })
+    
+    return {
+        "tests": test_list,
+        "total": len(test_list)
+    }
+
+def build_profile_view(user) -> dict:
+    return {
+        "user_id": user.telegram_id,
+        "level": user.level,
+        "progress": user.progress,
+        "lessons_completed": user.lessons_completed,
+        "points": user.points,
+        "current_streak": 0,  # TODO: Добавить логику подсчета стрика
+        "total_study_time": "0 часов"  # TODO: Добавить логику подсчета времени
+    }
+
+def build_notifications_view(user_id: int, limit: int = 50, before_id: Optional[int] = None,
+                             after_id: Optional[int] = None, notification_type: Optional[str] = None,
+                             unread_only: bool = False) -> dict:
+    notifications, has_more = NotificationRepository.get_notifications_page(
+        user_id, limit, before_id, after_id, notification_type, unread_only
+    )
+    unread_count = NotificationRepository.get_unread_count(user_id)
+    
+    notification_list = [NotificationRepository.notification_to_dict(notification) for notification in notifications]
+    return {
+        "notifications": notification_list,
+        "unread_count": unread_count,
+        "total": len(notification_list),
+        "has_more": has_more,
+        "cursor": {
+            "before_id": notification_list[-1]["id"] if notification_list else before_id,
+            "after_id": notification_list[0]["id"] if notification_list else after_id
+        }
+    }
+
 @router.post('/auth/login')
 def login(request: LoginRequest):
     """Получить токен доступа для Telegram пользователя"""
@@ -61,77 +272,133 @@ def login(request: LoginRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при авторизации: {str(e)}")
 
-@router.get('/schedule')
+# Каталоги (расписание, уроки, клубы, тесты) одинаковы для всех пользователей:
+# достаточно проверить токен без запроса пользователя из БД; повторный
+# запрос с актуальным ETag получает 304, остальные - готовый JSON из кэша
+@router.get('/schedule', response_model=ScheduleResponse)
 def get_schedule(
+    request: Request,
     level: Optional[str] = Query(None, description="Уровень обучения"),
-    current_user = Depends(get_current_user)
+    telegram_id: str = Depends(verify_token)
 ):
     """Получить расписание занятий (защищенный)"""
     try:
-        schedule = LessonRepository.get_schedule(level)
-        return {
-            "schedule": schedule,
-            "total": len(schedule),
-            "level": level
-        }
+        return cached_response(request, 'lessons', ScheduleResponse, build_schedule_view, level)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при получении расписания: {str(e)}")
 
+@router.get('/bootstrap', response_model=BootstrapResponse)
+async def bootstrap(
+    level: Optional[str] = Query(None, description="Уровень для расписания и тестов"),
+    notifications_limit: int = Query(20, ge=1, le=100, description="Размер первой страницы уведомлений"),
+    current_user = Depends(get_current_user)
+):
+    """Все данные для первого экрана Mini App одним запросом (защищенный)
+    
+    Пользователь проверяется один раз, разделы собираются параллельно в
+    пуле потоков. Каталоги берутся из тех же готовых ответов, что и
+    отдельные endpoint'ы, и вставляются в ответ без повторной сериализации.
+    Ошибка одного раздела не ломает ответ: раздел будет null, а причина -
+    в errors.
+    """
+    sections = {
+        "profile": lambda: render_json(build_profile_view(current_user), ProfileResponse),
+        "schedule": partial(cached_body, 'lessons', ScheduleResponse, build_schedule_view, level),
+        "clubs": partial(cached_body, 'clubs', ClubsResponse, build_clubs_view, max_age=CLUB_COUNTS_MAX_AGE),
+        "tests": partial(cached_body, 'tests', TestsResponse, build_tests_view, level),
+        "notifications": lambda: render_json(
+            build_notifications_view(current_user.id, notifications_limit), NotificationsResponse
+        )
+    }
+    results = await asyncio.gather(
+        *(asyncio.to_thread(call) for call in sections.values()),
+        return_exceptions=True
+    )
+    
+    parts = {}
+    errors = {}
+    for name, result in zip(sections, results):
+        if isinstance(result, Exception):
+            parts[name] = b"null"
+            errors[name] = str(result)
+        else:
+            parts[name] = result
+    parts["errors"] = render_json(errors)
+    return Response(content=render_object(parts), media_type="application/json")
+
 @router.post('/book')
 def book_lesson(
     request: BookingRequest,
-    current_user = Depends(get_current_user)
+    response: Response,
+    current_user = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
 ):
     """Забронировать урок (защищенный)"""
     try:
-        # Проверяем существование урока
-        lesson = LessonRepository.get_by_id(request.lesson_id)
-        if not lesson:
-            raise HTTPException(status_code=404, detail="Урок не найден")
-        
-        # Парсим дату бронирования
-        booking_date = datetime.now()
-        if request.booking_date:
-            try:
-                booking_date = datetime.fromisoformat(request.booking_date.replace('Z', '+00:00'))
-            except ValueError:
-                raise HTTPException(status_code=400, detail="Неверный формат даты")
-        
-        # Создаем бронирование
-        booking = BookingRepository.create_booking(current_user.id, request.lesson_id, booking_date)
-        
-        return {
-            "success": True,
-            "message": f"Урок '{lesson.title}' забронирован успешно!",
-            "lesson": {
-                "id": lesson.id,
-                "title": lesson.title,
-                "teacher": lesson.teacher.name if lesson.teacher else "Не назначен",
-                "time": f"{lesson.day_of_week}, {lesson.start_time}",
-                "location": lesson.location
-            },
-            "booking_id": booking.id
-        }
+        # Повтор с тем же ключом возвращает ту же запись
+        return book_lesson_for_user(
+            current_user.id, request.lesson_id, request.booking_date,
+            idempotency_key or request.idempotency_key, response
+        )
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при бронировании: {str(e)}")
 
-@router.get('/clubs')
-def get_clubs(current_user = Depends(get_current_user)):
+@router.get('/lessons', response_model=LessonsResponse)
+def get_lessons(
+    request: Request,
+    level: Optional[str] = Query(None, description="Уровень урока"),
+    telegram_id: str = Depends(verify_token)
+):
+    """Получить список уроков (защищенный)"""
+    try:
+        return cached_response(request, 'lessons', LessonsResponse, build_lessons_view, level)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка при получении уроков: {str(e)}")
+
+@router.get('/lessons/{lesson_id}/occurrences', response_model=OccurrencesResponse)
+def get_lesson_occurrences(
+    lesson_id: int,
+    weeks: int = Query(OCCURRENCE_HORIZON_WEEKS, ge=1, le=OCCURRENCE_HORIZON_WEEKS, description="Недель вперед"),
+    telegram_id: str = Depends(verify_token)
+):
+    """Ближайшие занятия урока со свободными местами (защищенный)"""
+    try:
+        if not LessonRepository.get_by_id(lesson_id):
+            raise HTTPException(status_code=404, detail="Урок не найден")
+        occurrences = LessonOccurrenceRepository.get_upcoming(lesson_id, weeks)
+        return {"occurrences": occurrences, "total": len(occurrences)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка при получении занятий: {str(e)}")
+
+@router.get('/lessons/{lesson_id}/occurrences/{occurrence_id}/roster', response_model=RosterResponse)
+def get_occurrence_roster(lesson_id: int, occurrence_id: int, staff_user = Depends(get_staff_user)):
+    """Список записавшихся на занятие (только для преподавателей и администраторов)"""
+    try:
+        roster = LessonOccurrenceRepository.get_roster(lesson_id, occurrence_id)
+        if roster is None:
+            raise HTTPException(status_code=404, detail="Занятие не найдено")
+        return {"occurrence_id": occurrence_id, "roster": roster, "total": len(roster)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка при получении списка записавшихся: {str(e)}")
+
+@router.get('/clubs', response_model=ClubsResponse)
+def get_clubs(request: Request, telegram_id: str = Depends(verify_token)):
     """Получить список клубов (защищенный)"""
     try:
-        clubs = ClubRepository.get_clubs_with_membership_count()
-        return {
-            "clubs": clubs,
-            "total": len(clubs)
-        }
+        return cached_response(request, 'clubs', ClubsResponse, build_clubs_view, max_age=CLUB_COUNTS_MAX_AGE)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при получении клубов: {str(e)}")
 
 @router.post('/clubs/{club_id}/join')
 def join_club(
     club_id: int, 
+    response: Response,
     current_user = Depends(get_current_user)
 ):
     """Присоединиться к клубу (защищенный)"""
@@ -142,39 +409,70 @@ def join_club(
             raise HTTPException(status_code=404, detail="Клуб не найден")
         
         # Пытаемся присоединиться к клубу
-        success = ClubRepository.join_club(current_user.id, club_id)
-        
-        if success:
-            return {
-                "success": True,
-                "message": f"Вы успешно присоединились к клубу '{club.name}'!",
-                "club": {
-                    "id": club.id,
-                    "name": club.name,
-                    "description": club.description,
-                    "schedule": f"{club.day_of_week}, {club.start_time}"
+        status = ClubRepository.join_club(current_user.id, club_id)
+        if status == 'already_member':
+            raise HTTPException(status_code=409, detail="Вы уже состоите в этом клубе")
+        if status == 'full':
+            position = ClubRepository.join_waitlist(current_user.id, club_id)
+            if position is not None:
+                response.status_code = 202
+                return {
+                    "success": False,
+                    "waitlisted": True,
+                    "position": position,
+                    "message": f"В клубе нет свободных мест: вы в листе ожидания (место {position}). Мы сообщим, когда место освободится"
                 }
+        
+        return {
+            "success": True,
+            "message": f"Вы успешно присоединились к клубу '{club.name}'!",
+            "club": {
+                "id": club.id,
+                "name": club.name,
+                "description": club.description,
+                "schedule": f"{club.day_of_week}, {club.start_time}"
             }
-        else:
-            raise HTTPException(status_code=400, detail="Не удалось присоединиться к клубу. Возможно, клуб переполнен или вы уже состоите в нем.")
+        }
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при присоединении к клубу: {str(e)}")
 
-@router.get('/profile')
+@router.post('/clubs/{club_id}/leave')
+def leave_club(
+    club_id: int,
+    current_user = Depends(get_current_user)
+):
+    """Выйти из клуба или его листа ожидания (защищенный)"""
+    try:
+        if ClubRepository.leave_club(current_user.id, club_id):
+            return {"success": True, "message": "Вы вышли из клуба"}
+        raise HTTPException(status_code=404, detail="Вы не состоите в клубе")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка при выходе из клуба: {str(e)}")
+
+@router.post('/bookings/{booking_id}/cancel')
+def cancel_booking(
+    booking_id: int,
+    current_user = Depends(get_current_user)
+):
+    """Отменить бронирование (защищенный)"""
+    try:
+        if BookingRepository.cancel_booking(current_user.id, booking_id):
+            return {"success": True, "message": "Бронирование отменено"}
+        raise HTTPException(status_code=404, detail="Бронирование не найдено")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка при отмене бронирования: {str(e)}")
+
+@router.get('/profile', response_model=ProfileResponse)
 def get_profile(current_user = Depends(get_current_user)):
     """Получить профиль пользователя (защищенный)"""
     try:
-        return {
-            "user_id": current_user.telegram_id,
-            "level": current_user.level,
-            "progress": current_user.progress,
-            "lessons_completed": current_user.lessons_completed,
-            "points": current_user.points,
-            "current_streak": 0,  # TODO: Добавить логику подсчета стрика
-            "total_study_time": "0 часов"  # TODO: Добавить логику подсчета времени
-        }
+        return build_profile_view(current_user)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при получении профиля: {str(e)}")
 
@@ -223,60 +521,51 @@ def submit_test(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при отправке теста: {str(e)}")
 
-@router.get('/tests')
+@router.get('/tests', response_model=TestsResponse)
 def get_tests(
+    request: Request,
     level: Optional[str] = Query(None, description="Уровень теста"),
-    current_user = Depends(get_current_user)
+    telegram_id: str = Depends(verify_token)
 ):
     """Получить список тестов (защищенный)"""
     try:
-        tests = TestRepository.get_all(level)
-        test_list = []
-        
-        for test in tests:
-            questions = json.loads(test.questions)
-            test_list.append({
-                "id": test.id,
-                "title": test.title,
-                "description": test.description,
-                "level": test.level,
-                "questions_count": len(questions),
-                "time_limit": test.time_limit
-            })
-        
-        return {
-            "tests": test_list,
-            "total": len(test_list)
-        }
+        return cached_response(request, 'tests', TestsResponse, build_tests_view, level)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при получении тестов: {str(e)}")
 
-@router.get('/notifications')
-def get_notifications(current_user = Depends(get_current_user)):
-    """Получить уведомления пользователя (защищенный)"""
+@router.get('/notifications', response_model=NotificationsResponse)
+def get_notifications(
+    before_id: Optional[int] = Query(None, description="Уведомления старше указанного"),
+    after_id: Optional[int] = Query(None, description="Уведомления новее указанного"),
+    notification_type: Optional[str] = Query(None, description="Тип уведомления"),
+    unread_only: bool = Query(False, description="Только непрочитанные"),
+    limit: int = Query(50, ge=1, le=100, description="Размер страницы"),
+    current_user = Depends(get_current_user)
+):
+    """Получить уведомления пользователя (защищенный)
+    
+    Страница от новых к старым: before_id - загрузить более старые (для
+    бесконечной прокрутки), after_id - более новые. Курсоры следующих
+    запросов возвращаются в поле cursor.
+    """
     try:
-        notifications = NotificationRepository.get_user_notifications(current_user.id)
-        unread_count = NotificationRepository.get_unread_count(current_user.id)
+        if before_id is not None and after_id is not None:
+            raise HTTPException(status_code=400, detail="Укажите только один из параметров before_id и after_id")
         
-        notification_list = []
-        for notification in notifications:
-            notification_list.append({
-                "id": notification.id,
-                "title": notification.title,
-                "message": notification.message,
-                "is_read": notification.is_read,
-                "notification_type": notification.notification_type,
-                "created_at": notification.created_at.isoformat() if notification.created_at else None
-            })
-        
-        return {
-            "notifications": notification_list,
-            "unread_count": unread_count,
-            "total": len(notification_list)
-        }
+        return build_notifications_view(
+            current_user.id, limit, before_id, after_id, notification_type, unread_only
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при получении уведомлений: {str(e)}")
 
+@router.get('/notifications/stream')
+async def stream_notifications(request: Request, token: str = Query(..., description="Токен доступа")):
+    """Поток новых уведомлений и счетчика непрочитанных (Server-Sent Events)"""
+    user = await asyncio.to_thread(get_user_by_token, token)
+    return notification_stream_response(user.id, request)
+
 @router.post('/notifications/{notification_id}/read')
 def mark_notification_read(
     notification_id: int, 
@@ -366,5 +655,6 @@ def health_check():
     return {
         "status": "healthy",
         "database": "connected",
+        "response_cache": get_response_cache().get_stats(),
         "timestamp": datetime.now().isoformat()
     } 
\ No newline at end of file
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Сравнение стоимости сериализации ответов API
+Прежний путь (jsonable_encoder + stdlib json в JSONResponse) против модели
+ответа с ORJSONResponse и готовых байтов из кэша каталогов
+"""
+
+import json
+import sys
+import time
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+from backend.http_cache import render_json
+from backend.routes_secure import NotificationsResponse, ScheduleResponse
+
+SIZES = [20, 100, 500]
+REQUESTS = 300
+
+def make_notifications(count: int) -> dict:
+    notifications = [{
+        "id": i,
+        "title": f"Напоминание о занятии {i}",
+        "message": "Через час начнется занятие «Английский для начинающих» в аудитории 101",
+        "is_read": i % 3 == 0,
+        "notification_type": "lesson_reminder",
+        "created_at": "2025-01-15T09:00:00"
+    } for i in range(count, 0, -1)]
+    return {
+        "notifications": notifications,
+        "unread_count": count // 3,
+        "total": count,
+        "has_more": True,
+        "cursor": {"before_id": 1, "after_id": count}
+    }
+
+def make_schedule(count: int) -> dict:
+    schedule = [{
+        "id": i,
+        "title": f"Английский для начинающих, группа {i}",
+        "teacher": "Анна Петрова",
+        "time": "Monday, 10:00",
+        "location": "Аудитория 101",
+        "level": "beginner",
+        "duration": "60 мин"
+    } for i in range(count)]
+    return {"schedule": schedule, "total": count, "level": None}
+
+def encode_before(payload: dict) -> bytes:
+    """Словарь без модели ответа: так FastAPI отдавал ответы раньше"""
+    return JSONResponse(jsonable_encoder(payload)).body
+
+def encode_after(payload: dict, model) -> bytes:
+    """Проверка моделью ответа и ORJSONResponse (без jsonable_encoder)"""
+    return ORJSONResponse(model.model_validate(payload).model_dump(mode="json")).body
+
+def same_json(left: bytes, right: bytes) -> bool:
+    return json.loads(left) == json.loads(right)
+
+def measure(encode) -> float:
+    """Среднее время сериализации одного ответа в микросекундах"""
+    for _ in range(20):
+        encode()
+    started = time.perf_counter()
+    for _ in range(REQUESTS):
+        encode()
+    return (time.perf_counter() - started) / REQUESTS * 1_000_000
+
+def main():
+    """Запуск сравнения"""
+    print("⏱  СЕРИАЛИЗАЦИЯ ОТВЕТОВ (мкс на ответ)")
+    print("=" * 72)
+    print(f"{'ответ':<14} | {'записей':>7} | {'dict + json':>11} | {'модель + orjson':>15} | {'ускорение':>9}")
+    print("-" * 72)
+
+    speedups = []
+    for name, make, model in (("уведомления", make_notifications, NotificationsResponse),
+                              ("расписание", make_schedule, ScheduleResponse)):
+        for size in SIZES:
+            payload = make(size)
+            # Ответы должны совпадать по содержимому
+            assert same_json(encode_before(payload), encode_after(payload, model))
+            assert same_json(encode_before(payload), render_json(payload, model))
+
+            before = measure(lambda: encode_before(payload))
+            after = measure(lambda: encode_after(payload, model))
+            speedups.append(before / after)
+            print(f"{name:<14} | {size:>7} | {before:>11.1f} | {after:>15.1f} | {before / after:>8.1f}x")
+
+    print("\nОтветы каталогов из кэша не сериализуются повторно: стоимость - поиск в словаре")
+    sys.exit(0 if min(speedups) > 1 else 1)
+
+if __name__ == "__main__":
+    main()
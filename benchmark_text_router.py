@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Сравнение стоимости маршрутизации текстовых кнопок бота
+Цепочка фильтров lambda message: message.text == '...' против TextRouter
+при разном количестве кнопок; обновления подаются в настоящий Dispatcher
+"""
+
+import asyncio
+import sys
+import time
+from datetime import datetime
+
+from aiogram import Bot, Dispatcher, types
+
+from bot.text_router import TextRouter
+
+BUTTON_COUNTS = [7, 50, 200]
+UPDATES = 2000
+
+def make_update(text: str) -> types.Update:
+    return types.Update(
+        update_id=1,
+        message=types.Message(
+            message_id=1,
+            date=datetime.now(),
+            chat=types.Chat(id=1, type='private'),
+            from_user=types.User(id=1, is_bot=False, first_name='Тест'),
+            text=text
+        )
+    )
+
+async def noop(message: types.Message):
+    pass
+
+def build_lambda_dispatcher(buttons) -> Dispatcher:
+    """Текущий подход: по фильтру на кнопку"""
+    dp = Dispatcher()
+    for text in buttons:
+        dp.message(lambda message, text=text: message.text == text)(noop)
+    dp.message()(noop)
+    return dp
+
+def build_router_dispatcher(buttons) -> Dispatcher:
+    """Таблица кнопок с одним обработчиком"""
+    dp = Dispatcher()
+    router = TextRouter()
+    for text in buttons:
+        router.register(text, f'{text} (en)')(noop)
+
+    @dp.message(router.filter)
+    async def handle_keyboard_text(message: types.Message, text_route, **data):
+        await router.dispatch(message, text_route, **data)
+
+    dp.message()(noop)
+    return dp
+
+async def measure(dp: Dispatcher, bot: Bot, update: types.Update) -> float:
+    """Среднее время обработки одного обновления в микросекундах"""
+    for _ in range(100):
+        await dp.feed_update(bot, update)
+    started = time.perf_counter()
+    for _ in range(UPDATES):
+        await dp.feed_update(bot, update)
+    return (time.perf_counter() - started) / UPDATES * 1_000_000
+
+async def main():
+    """Запуск сравнения"""
+    # Токен нужен только для создания объекта, запросов к Telegram нет
+    bot = Bot(token='42:BENCHMARK')
+    print("⏱  МАРШРУТИЗАЦИЯ ТЕКСТОВЫХ КНОПОК (мкс на обновление)")
+    print("=" * 64)
+    print(f"{'кнопок':>7} | {'сообщение':<18} | {'lambda-цепочка':>14} | {'TextRouter':>10}")
+    print("-" * 64)
+
+    results = []
+    for count in BUTTON_COUNTS:
+        buttons = [f'Кнопка {i}' for i in range(count)]
+        lambda_dp = build_lambda_dispatcher(buttons)
+        router_dp = build_router_dispatcher(buttons)
+
+        for label, text in (("последняя кнопка", buttons[-1]), ("неизвестный текст", 'привет')):
+            update = make_update(text)
+            chain = await measure(lambda_dp, bot, update)
+            table = await measure(router_dp, bot, update)
+            results.append((count, chain, table))
+            print(f"{count:>7} | {label:<18} | {chain:>14.1f} | {table:>10.1f}")
+
+    await bot.session.close()
+
+    # Стоимость TextRouter не должна расти с числом кнопок
+    router_times = [table for count, _, table in results]
+    growth = max(router_times) / min(router_times)
+    print(f"\nРазброс TextRouter между 7 и {BUTTON_COUNTS[-1]} кнопками: x{growth:.2f}")
+    sys.exit(0 if growth < 2 else 1)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,13 +1,24 @@
 from aiogram import Bot, Dispatcher, types
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, WebAppInfo
 from aiogram.filters import Command
+from aiogram.fsm.context import FSMContext
 import asyncio
+import logging
 import os
 import aiohttp
 import json
 from dotenv import load_dotenv
 from .notification_service import NotificationService
-from db.repositories import UserRepository
+from .storage import DBStorage
+from .text_router import TextRouter
+from .throttling import ThrottlingMiddleware
+from .render_cache import RenderedCache
+from .sharding import run_sharded
+from db.repositories import UserRepository, NotificationRepository
+from db.leader import LeaderElection
+from db.init_db import init_db
+
+logger = logging.getLogger(__name__)
 
 # Загружаем переменные из .env файла
 load_dotenv()
@@ -15,11 +26,54 @@ load_dotenv()
 TOKEN = os.getenv('TELEGRAM_BOT_TOKEN', 'YOUR_BOT_TOKEN_HERE')
 BACKEND_URL = os.getenv('BACKEND_URL', 'http://localhost:8000/api/v1')
 
+# Масштабирование: при BOT_WORKERS > 0 обновления раскладываются по разделам
+# очереди BOT_QUEUE (sqlite или memory) и обрабатываются BOT_WORKERS обработчиками
+BOT_WORKERS = int(os.getenv('BOT_WORKERS', 0))
+BOT_PARTITIONS = int(os.getenv('BOT_PARTITIONS', 16))
+BOT_QUEUE = os.getenv('BOT_QUEUE', 'sqlite')
+BOT_QUEUE_PATH = os.getenv('BOT_QUEUE_PATH', './bot_updates.db')
+
 bot = Bot(token=TOKEN)
-dp = Dispatcher()
 
-# Состояния пользователей (в реальном проекте используйте БД)
-user_states = {}
+# Состояния пользователей хранятся в БД (общие для всех экземпляров бота),
+# в памяти - только LRU-кэш недавних пользователей
+dp = Dispatcher(storage=DBStorage())
+
+# Ограничение частоты запросов: до 5 запросов подряд, затем 1 в секунду.
+# Внешний middleware срабатывает до фильтров, поэтому флуд не доходит до обработчиков
+throttling = ThrottlingMiddleware(rate=1.0, burst=5)
+dp.message.outer_middleware(throttling)
+dp.callback_query.outer_middleware(throttling)
+
+# Готовые тексты расписания по уровням; сбрасываются при изменении занятий
+render_cache = RenderedCache()
+
+# Кнопки reply-клавиатуры: текст (и его переводы) -> обработчик
+text_router = TextRouter()
+
+# Информация о школе не меняется - текст собирается один раз при запуске
+COURSE_INFO_TEXT = """
+🏫 О нашей школе английского языка:
+
+📚 Наши курсы:
+• Начальный уровень (A1-A2)
+• Продвинутый уровень (B1-C1)
+• Разговорные клубы
+• Подготовка к экзаменам
+
+🎯 Преимущества:
+• Опытные преподаватели
+• Индивидуальный подход
+• Современные методики
+• Удобное расписание
+
+💰 Стоимость:
+• Групповые занятия: от 2000₽/мес
+• Индивидуальные: от 1500₽/занятие
+• Клубы: от 500₽/месяц
+
+📍 Адрес: ул. Примерная, 123
+"""
 
 def get_level_keyboard():
     return ReplyKeyboardMarkup(
@@ -43,9 +97,9 @@ def get_main_keyboard():
     )
 
 @dp.message(Command('start'))
-async def cmd_start(message: types.Message):
+async def cmd_start(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
-    user_states[user_id] = {'level': None}
+    await state.set_data({'level': None})
     
     # Создаем или получаем пользователя из БД
     user = UserRepository.get_by_telegram_id(str(user_id))
@@ -108,28 +162,30 @@ async def cmd_profile(message: types.Message):
     await message.answer(profile_text)
 
 @dp.message(Command('schedule'))
-async def cmd_schedule(message: types.Message):
+async def cmd_schedule(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
-    user_state = user_states.get(user_id, {})
-    level = user_state.get('level', 'all')
+    user_state = await state.get_data()
+    if 'level' not in user_state:
+        # Состояния нет (пользователь не нажимал /start) - берем уровень из профиля
+        user = UserRepository.get_by_telegram_id(str(user_id))
+        user_state['level'] = user.level if user else None
+    level = user_state.get('level') or 'all'
+    
+    # Обычный случай - готовый текст из кэша, без запроса к backend
+    schedule_text = render_cache.get('lessons', level)
+    if schedule_text is not None:
+        await message.answer(schedule_text)
+        return
     
     # Получаем расписание из backend
+    version = render_cache.version('lessons')
     try:
         async with aiohttp.ClientSession() as session:
             async with session.get(f'{BACKEND_URL}/schedule?level={level}&user_id={user_id}') as response:
                 if response.status == 200:
                     schedule_data = await response.json()
-                    schedule = schedule_data.get('schedule', [])
-                    
-                    if schedule:
-                        schedule_text = "📅 Расписание занятий:\n\n"
-                        for lesson in schedule:
-                            schedule_text += f"🕐 {lesson.get('time', 'N/A')}\n"
-                            schedule_text += f"📚 {lesson.get('title', 'N/A')}\n"
-                            schedule_text += f"👨‍🏫 {lesson.get('teacher', 'N/A')}\n"
-                            schedule_text += f"📍 {lesson.get('location', 'N/A')}\n\n"
-                    else:
-                        schedule_text = "📅 Расписание пока пусто"
+                    schedule_text = render_schedule(schedule_data.get('schedule', []))
+                    render_cache.set('lessons', level, schedule_text, version)
                 else:
                     schedule_text = "❌ Не удалось загрузить расписание"
     except:
@@ -137,6 +193,21 @@ async def cmd_schedule(message: types.Message):
     
     await message.answer(schedule_text)
 
+def render_schedule(schedule: list) -> str:
+    """Текст расписания для отправки пользователю"""
+    if not schedule:
+        return "📅 Расписание пока пусто"
+    
+    parts = ["📅 Расписание занятий:\n\n"]
+    for lesson in schedule:
+        parts.append(
+            f"🕐 {lesson.get('time', 'N/A')}\n"
+            f"📚 {lesson.get('title', 'N/A')}\n"
+            f"👨‍🏫 {lesson.get('teacher', 'N/A')}\n"
+            f"📍 {lesson.get('location', 'N/A')}\n\n"
+        )
+    return ''.join(parts)
+
 @dp.message(Command('notifications'))
 async def cmd_notifications(message: types.Message):
     user_id = message.from_user.id
@@ -178,10 +249,10 @@ async def cmd_notifications(message: types.Message):
     except:
         await message.answer("❌ Ошибка соединения с сервером")
 
-@dp.message(lambda message: message.text == 'Начальный уровень')
-async def handle_beginner_level(message: types.Message):
+@text_router.register('Начальный уровень', 'Beginner level')
+async def handle_beginner_level(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
-    user_states[user_id] = {'level': 'beginner'}
+    await state.update_data(level='beginner')
     
     # Обновляем уровень в БД
     user = UserRepository.get_by_telegram_id(str(user_id))
@@ -198,10 +269,10 @@ async def handle_beginner_level(message: types.Message):
         reply_markup=get_main_keyboard()
     )
 
-@dp.message(lambda message: message.text == 'Продвинутый уровень')
-async def handle_advanced_level(message: types.Message):
+@text_router.register('Продвинутый уровень', 'Advanced level')
+async def handle_advanced_level(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
-    user_states[user_id] = {'level': 'advanced'}
+    await state.update_data(level='advanced')
     
     # Обновляем уровень в БД
     user = UserRepository.get_by_telegram_id(str(user_id))
@@ -218,7 +289,7 @@ async def handle_advanced_level(message: types.Message):
         reply_markup=get_main_keyboard()
     )
 
-@dp.message(lambda message: message.text == 'Открыть мини-приложение')
+@text_router.register('Открыть мини-приложение', 'Open mini app')
 async def handle_open_webapp(message: types.Message):
     await message.answer(
         '🌐 Открываю мини-приложение...\n\n'
@@ -230,7 +301,7 @@ async def handle_open_webapp(message: types.Message):
         '• Отслеживать прогресс'
     )
 
-@dp.message(lambda message: message.text == 'Связаться с куратором / преподавателем')
+@text_router.register('Связаться с куратором / преподавателем', 'Contact curator / teacher')
 async def handle_contact_teacher(message: types.Message):
     await message.answer(
         '👨‍🏫 Связь с преподавателем:\n\n'
@@ -240,72 +311,103 @@ async def handle_contact_teacher(message: types.Message):
         '⏰ Время работы: Пн-Пт 9:00-18:00'
     )
 
-@dp.message(lambda message: message.text == 'Информация о курсах и школе')
+@text_router.register('Информация о курсах и школе', 'About courses and school')
 async def handle_course_info(message: types.Message):
-    info_text = """
-🏫 О нашей школе английского языка:
-
-📚 Наши курсы:
-• Начальный уровень (A1-A2)
-• Продвинутый уровень (B1-C1)
-• Разговорные клубы
-• Подготовка к экзаменам
-
-🎯 Преимущества:
-• Опытные преподаватели
-• Индивидуальный подход
-• Современные методики
-• Удобное расписание
-
-💰 Стоимость:
-• Групповые занятия: от 2000₽/мес
-• Индивидуальные: от 1500₽/занятие
-• Клубы: от 500₽/месяц
+    await message.answer(COURSE_INFO_TEXT)
 
-📍 Адрес: ул. Примерная, 123
-    """
-    await message.answer(info_text)
-
-@dp.message(lambda message: message.text == 'Изменить уровень обучения')
+@text_router.register('Изменить уровень обучения', 'Change level')
 async def handle_change_level(message: types.Message):
     await message.answer(
         'Выберите новый уровень обучения:',
         reply_markup=get_level_keyboard()
     )
 
-@dp.message(lambda message: message.text == '🔔 Уведомления')
+@text_router.register('🔔 Уведомления', '🔔 Notifications')
 async def handle_notifications_button(message: types.Message):
     await cmd_notifications(message)
 
-@dp.callback_query(lambda c: c.data == "all_notifications")
+# Все кнопки обрабатываются одним обработчиком с поиском по словарю
+@dp.message(text_router.filter)
+async def handle_keyboard_text(message: types.Message, text_route, **data):
+    await text_router.dispatch(message, text_route, **data)
+
+# Уведомлений на одной странице списка; длинные тексты обрезаются,
+# чтобы страница всегда помещалась в одно сообщение Telegram
+NOTIFICATIONS_PAGE_SIZE = 5
+NOTIFICATION_PREVIEW_LENGTH = 300
+
+def render_notifications_page(notifications: list) -> str:
+    """Текст страницы списка уведомлений"""
+    parts = ["🔔 Ваши уведомления:\n\n"]
+    for notification in notifications:
+        status = "🔴" if not notification.is_read else "⚪"
+        text = notification.message
+        if len(text) > NOTIFICATION_PREVIEW_LENGTH:
+            text = text[:NOTIFICATION_PREVIEW_LENGTH] + "…"
+        date = notification.created_at.strftime('%Y-%m-%d') if notification.created_at else ""
+        parts.append(
+            f"{status} {notification.title}\n"
+            f"   {text}\n"
+            f"   📅 {date}\n\n"
+        )
+    return ''.join(parts)
+
+def get_notifications_page_keyboard(notifications: list, has_newer: bool, has_older: bool):
+    """Кнопки листания; курсор - id крайнего уведомления на странице"""
+    row = []
+    if has_newer:
+        row.append(types.InlineKeyboardButton(text="⬅️ Новее", callback_data=f"notifications_page:after:{notifications[0].id}"))
+    if has_older:
+        row.append(types.InlineKeyboardButton(text="Старее ➡️", callback_data=f"notifications_page:before:{notifications[-1].id}"))
+    
+    keyboard = [row] if row else []
+    keyboard.append([types.InlineKeyboardButton(text="✅ Отметить все как прочитанные", callback_data="mark_all_read")])
+    return types.InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+@dp.callback_query(lambda c: c.data == "all_notifications" or (c.data or "").startswith("notifications_page:"))
 async def show_all_notifications(callback_query: types.CallbackQuery):
     user_id = callback_query.from_user.id
     
+    # Курсор из кнопки: notifications_page:<before|after>:<id>
+    before_id = after_id = None
+    if callback_query.data != "all_notifications":
+        _, direction, cursor = callback_query.data.split(':')
+        if direction == 'after':
+            after_id = int(cursor)
+        else:
+            before_id = int(cursor)
+    
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f'{BACKEND_URL}/notifications?user_id={user_id}') as response:
-                if response.status == 200:
-                    data = await response.json()
-                    notifications = data.get('notifications', [])
-                    
-                    if not notifications:
-                        await callback_query.message.edit_text("🔔 У вас пока нет уведомлений")
-                        return
-                    
-                    notification_text = "🔔 Все ваши уведомления:\n\n"
-                    
-                    for i, notification in enumerate(notifications, 1):
-                        status = "🔴" if not notification["is_read"] else "⚪"
-                        date = notification["created_at"][:10] if notification["created_at"] else ""
-                        notification_text += f"{i}. {status} {notification['title']}\n"
-                        notification_text += f"   {notification['message']}\n"
-                        notification_text += f"   📅 {date}\n\n"
-                    
-                    await callback_query.message.edit_text(notification_text)
-                else:
-                    await callback_query.answer("❌ Не удалось загрузить уведомления")
-    except:
-        await callback_query.answer("❌ Ошибка соединения с сервером")
+        user = await asyncio.to_thread(UserRepository.get_by_telegram_id, str(user_id))
+        if not user:
+            await callback_query.message.edit_text("🔔 У вас пока нет уведомлений")
+            return
+        
+        notifications, has_more = await asyncio.to_thread(
+            NotificationRepository.get_notifications_page,
+            user.id, NOTIFICATIONS_PAGE_SIZE, before_id, after_id
+        )
+        if not notifications:
+            if before_id is None and after_id is None:
+                await callback_query.message.edit_text("🔔 У вас пока нет уведомлений")
+            else:
+                await callback_query.answer("Больше уведомлений нет")
+            return
+        
+        # При листании вперед более новые есть всегда, назад - всегда есть более старые
+        if after_id is not None:
+            has_newer, has_older = has_more, True
+        else:
+            has_newer, has_older = before_id is not None, has_more
+        
+        await callback_query.message.edit_text(
+            render_notifications_page(notifications),
+            reply_markup=get_notifications_page_keyboard(notifications, has_newer, has_older)
+        )
+        await callback_query.answer()
+    except Exception:
+        logger.exception("Ошибка загрузки уведомлений")
+        await callback_query.answer("❌ Не удалось загрузить уведомления")
 
 @dp.callback_query(lambda c: c.data == "mark_all_read")
 async def mark_all_notifications_read(callback_query: types.CallbackQuery):
@@ -375,23 +477,34 @@ async def handle_unknown(message: types.Message):
     )
 
 async def main():
+    # Таблицы состояний бота и аренд фоновых задач
+    init_db()
+    
     # Запускаем сервис уведомлений
     notification_service = NotificationService(bot)
     
+    # При нескольких экземплярах бота рассылку выполняет только лидер
+    notification_leader = LeaderElection('notification_scheduler')
+    
     try:
         # Запускаем сервис уведомлений в фоне
-        notification_task = asyncio.create_task(notification_service.start())
+        notification_leader.start(notification_service.start)
+        render_cache.start()
         
-        # Запускаем бота с явным указанием параметров
         print("🤖 Бот запущен и готов к работе!")
-        await dp.start_polling(bot, skip_updates=True)
+        if BOT_WORKERS > 0:
+            # Один процесс получает обновления, обработчики читают свои разделы очереди
+            await run_sharded(bot, dp, BOT_WORKERS, BOT_PARTITIONS, BOT_QUEUE, BOT_QUEUE_PATH)
+        else:
+            # Запускаем бота с явным указанием параметров
+            await dp.start_polling(bot, skip_updates=True)
     except KeyboardInterrupt:
         print("Остановка бота...")
     finally:
-        # Останавливаем сервис уведомлений
+        # Останавливаем сервис уведомлений и освобождаем аренду
         await notification_service.stop()
-        if 'notification_task' in locals():
-            notification_task.cancel()
+        await notification_leader.stop()
+        await render_cache.stop()
 
 if __name__ == '__main__':
     asyncio.run(main())
@@ -4,8 +4,14 @@ import os
 from datetime import datetime, timedelta
 from typing import List, Dict, Optional
 
+from db.repositories import LessonOccurrenceRepository
+
 BACKEND_URL = os.getenv('BACKEND_URL', 'http://localhost:8000/api/v1')
 
+# Напоминание уходит, когда до занятия осталось 24 ч или 1 ч плюс-минус
+# REMINDER_WINDOW; окно шире интервала проверки, чтобы не пропустить занятие
+REMINDER_WINDOW = timedelta(minutes=6)
+
 class NotificationService:
     def __init__(self, bot):
         self.bot = bot
@@ -34,58 +40,34 @@ class NotificationService:
     async def _check_and_send_notifications(self):
         """Проверка и отправка уведомлений"""
         try:
+            # Занятия на горизонт вперед: напоминания и записи работают с готовыми строками
+            await asyncio.to_thread(LessonOccurrenceRepository.ensure_horizon)
+            await self._send_lesson_reminders()
+            
             async with aiohttp.ClientSession() as session:
                 # Получаем всех пользователей с активными уведомлениями
                 # В реальном проекте здесь будет запрос к БД
                 test_users = ["123456789", "987654321"]
                 
                 for user_id in test_users:
-                    await self._send_scheduled_notifications(session, user_id)
                     await self._send_daily_motivation(session, user_id)
                     
         except Exception as e:
             print(f"Ошибка при проверке уведомлений: {e}")
     
-    async def _send_scheduled_notifications(self, session: aiohttp.ClientSession, user_id: str):
-        """Отправка запланированных уведомлений"""
-        try:
-            # Получаем настройки пользователя
-            async with session.get(f'{BACKEND_URL}/notifications/settings?user_id={user_id}') as response:
-                if response.status != 200:
-                    return
-                
-                settings = await response.json()
-                
-                # Проверяем, нужно ли отправлять уведомления
-                if not settings.get('lesson_reminders', True):
-                    return
-                
-                # Получаем расписание пользователя
-                async with session.get(f'{BACKEND_URL}/schedule?user_id={user_id}') as response:
-                    if response.status != 200:
-                        return
-                    
-                    schedule_data = await response.json()
-                    lessons = schedule_data.get('schedule', [])
-                    
-                    # Проверяем ближайшие занятия
-                    now = datetime.now()
-                    for lesson in lessons:
-                        # Парсим время занятия (упрощенная логика)
-                        lesson_time = self._parse_lesson_time(lesson.get('time', ''))
-                        if lesson_time:
-                            time_diff = lesson_time - now
-                            
-                            # Отправляем уведомление за 1 час до занятия
-                            if timedelta(hours=0, minutes=55) <= time_diff <= timedelta(hours=1, minutes=5):
-                                await self._send_lesson_reminder(user_id, lesson)
-                            
-                            # Отправляем уведомление за 24 часа до занятия
-                            elif timedelta(hours=23, minutes=55) <= time_diff <= timedelta(hours=24, minutes=5):
-                                await self._send_lesson_reminder(user_id, lesson, is_advance=True)
-                                
-        except Exception as e:
-            print(f"Ошибка при отправке запланированных уведомлений: {e}")
+    async def _send_lesson_reminders(self):
+        """Напоминания записавшимся за сутки и за час до занятия
+        
+        Занятия в окне находятся по индексу starts_at, получатели - по
+        записям на занятие; каждое напоминание отправляется один раз.
+        """
+        for lead, is_advance in ((timedelta(hours=24), True), (timedelta(hours=1), False)):
+            occurrences = await asyncio.to_thread(
+                LessonOccurrenceRepository.claim_due_reminders, lead, REMINDER_WINDOW, is_advance
+            )
+            for occurrence in occurrences:
+                for recipient in occurrence['recipients']:
+                    await self._send_lesson_reminder(recipient['telegram_id'], occurrence, is_advance)
     
     async def _send_daily_motivation(self, session: aiohttp.ClientSession, user_id: str):
         """Отправка ежедневной мотивации"""
@@ -110,48 +92,14 @@ class NotificationService:
         except Exception as e:
             print(f"Ошибка при отправке мотивации: {e}")
     
-    def _parse_lesson_time(self, time_str: str) -> Optional[datetime]:
-        """Парсинг времени занятия"""
-        try:
-            # Упрощенный парсинг для демонстрации
-            # В реальном проекте здесь будет более сложная логика
-            if "Понедельник" in time_str and "18:00" in time_str:
-                # Вычисляем следующий понедельник
-                now = datetime.now()
-                days_ahead = 0 - now.weekday()  # 0 = понедельник
-                if days_ahead <= 0:  # Понедельник уже прошел на этой неделе
-                    days_ahead += 7
-                next_monday = now + timedelta(days=days_ahead)
-                return next_monday.replace(hour=18, minute=0, second=0, microsecond=0)
-            
-            elif "Вторник" in time_str and "19:00" in time_str:
-                now = datetime.now()
-                days_ahead = 1 - now.weekday()  # 1 = вторник
-                if days_ahead <= 0:
-                    days_ahead += 7
-                next_tuesday = now + timedelta(days=days_ahead)
-                return next_tuesday.replace(hour=19, minute=0, second=0, microsecond=0)
-            
-            elif "Среда" in time_str and "17:30" in time_str:
-                now = datetime.now()
-                days_ahead = 2 - now.weekday()  # 2 = среда
-                if days_ahead <= 0:
-                    days_ahead += 7
-                next_wednesday = now + timedelta(days=days_ahead)
-                return next_wednesday.replace(hour=17, minute=30, second=0, microsecond=0)
-            
-            return None
-        except:
-            return None
-    
-    async def _send_lesson_reminder(self, user_id: str, lesson: Dict, is_advance: bool = False):
+    async def _send_lesson_reminder(self, user_id: str, occurrence: Dict, is_advance: bool = False):
         """Отправка напоминания о занятии"""
         try:
             title = "Напоминание о занятии"
             if is_advance:
-                message = f"Завтра в {lesson.get('time', '').split(', ')[1]} у вас занятие '{lesson.get('title', '')}'"
+                message = f"Завтра в {occurrence['starts_at']:%H:%M} у вас занятие '{occurrence['title']}'"
             else:
-                message = f"Через час у вас занятие '{lesson.get('title', '')}' в {lesson.get('location', '')}"
+                message = f"Через час у вас занятие '{occurrence['title']}' в {occurrence.get('location') or 'школе'}"
             
             # Отправляем уведомление через API
             async with aiohttp.ClientSession() as session:
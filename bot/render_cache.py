@@ -0,0 +1,81 @@
+"""
+Кэш готовых текстов ответов бота
+Текст хранится вместе с версией ресурса, из которого он построен; версии
+периодически читаются из БД одним запросом, поэтому обычный запрос
+пользователя обслуживается поиском в словаре без обращения к backend
+"""
+
+import asyncio
+import logging
+from typing import Dict, Hashable, Optional
+
+from backend.cache import TTLCache
+from db.repositories import DataVersionRepository
+
+logger = logging.getLogger(__name__)
+
+class RenderedCache:
+    """Готовые тексты по (ресурс, ключ) с инвалидацией по версии ресурса
+    
+    max_age ограничивает срок жизни текста на случай, если обновление
+    версий не запущено или БД недоступна.
+    """
+    
+    def __init__(self, max_entries: int = 1000, max_age: float = 300):
+        self.texts = TTLCache(ttl=max_age, max_entries=max_entries)
+        self.versions: Dict[str, int] = {}
+        self.invalidations = 0
+        self._refresh_task: Optional[asyncio.Task] = None
+    
+    def get(self, resource: str, key: Hashable) -> Optional[str]:
+        """Готовый текст, если он построен по текущей версии ресурса"""
+        entry = self.texts.get((resource, key))
+        if entry is None:
+            return None
+        version, text = entry
+        if version != self.version(resource):
+            self.texts.delete((resource, key))
+            self.invalidations += 1
+            return None
+        return text
+    
+    def version(self, resource: str) -> int:
+        """Текущая известная версия ресурса"""
+        return self.versions.get(resource, 0)
+    
+    def set(self, resource: str, key: Hashable, text: str, version: Optional[int] = None):
+        """Сохранение текста с версией ресурса
+        
+        Версию стоит запомнить до загрузки данных: если ресурс изменится во
+        время загрузки, такой текст будет сразу считаться устаревшим.
+        """
+        self.texts.set((resource, key), (self.version(resource) if version is None else version, text))
+    
+    async def refresh_versions(self):
+        """Чтение актуальных версий ресурсов из БД"""
+        self.versions = await asyncio.to_thread(DataVersionRepository.get_all)
+    
+    def start(self, interval: float = 15):
+        """Запуск периодического обновления версий в текущем event loop"""
+        if self._refresh_task is not None and not self._refresh_task.done():
+            return
+        self._refresh_task = asyncio.create_task(self._refresh_loop(interval))
+    
+    async def stop(self):
+        """Остановка обновления версий"""
+        if self._refresh_task is None:
+            return
+        self._refresh_task.cancel()
+        try:
+            await self._refresh_task
+        except asyncio.CancelledError:
+            pass
+        self._refresh_task = None
+    
+    async def _refresh_loop(self, interval: float):
+        while True:
+            try:
+                await self.refresh_versions()
+            except Exception as e:
+                logger.error(f"Ошибка обновления версий данных: {e}")
+            await asyncio.sleep(interval)
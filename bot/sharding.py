@@ -0,0 +1,145 @@
+"""
+Горизонтальное масштабирование бота
+Один процесс (ingress) получает обновления Telegram и раскладывает их по
+разделам очереди, N обработчиков читают свои разделы и передают
+обновления в Dispatcher; порядок обновлений внутри чата сохраняется
+"""
+
+import asyncio
+import logging
+import multiprocessing
+from typing import Callable, Dict, List, Optional
+
+from aiogram import Bot, Dispatcher, types
+
+from .update_queue import SQLiteUpdateQueue, create_update_queue
+
+logger = logging.getLogger(__name__)
+
+def get_chat_id(update: types.Update) -> Optional[int]:
+    """Чат, к которому относится обновление (или пользователь, если чата нет)"""
+    event = update.event
+    chat = getattr(event, 'chat', None)
+    if chat is None and getattr(event, 'message', None) is not None:
+        chat = getattr(event.message, 'chat', None)
+    if chat is not None:
+        return chat.id
+    user = getattr(event, 'from_user', None)
+    return user.id if user else None
+
+async def enqueue_update(queue, update: types.Update) -> int:
+    """Постановка обновления в очередь (общая для polling и вебхука)"""
+    payload = update.model_dump(mode='json', exclude_none=True)
+    return await queue.put(payload, get_chat_id(update))
+
+async def run_ingress(bot: Bot, dp: Dispatcher, queue, polling_timeout: int = 30):
+    """Получение обновлений через long polling и запись их в очередь
+    
+    Смещение сдвигается только после записи в очередь, поэтому при сбое
+    Telegram отдаст незаписанные обновления повторно.
+    """
+    offset = None
+    allowed_updates = dp.resolve_used_update_types()
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=polling_timeout, allowed_updates=allowed_updates)
+        except Exception as e:
+            logger.error(f"Ошибка получения обновлений: {e}")
+            await asyncio.sleep(5)
+            continue
+        
+        for update in updates:
+            await enqueue_update(queue, update)
+            offset = update.update_id + 1
+
+async def consume_partition(dp: Dispatcher, bot: Bot, queue, partition: int, batch_size: int = 100):
+    """Последовательная обработка обновлений одного раздела"""
+    while True:
+        items = await queue.fetch(partition, batch_size)
+        for item_id, payload in items:
+            try:
+                await dp.feed_raw_update(bot, payload)
+            except Exception as e:
+                # Ошибочное обновление не должно блокировать весь раздел
+                logger.error(f"Ошибка обработки обновления {item_id} (раздел {partition}): {e}")
+            await queue.ack(partition, [item_id])
+
+async def run_worker(dp: Dispatcher, bot: Bot, queue, partitions: List[int]):
+    """Обработчик, читающий заданные разделы очереди"""
+    logger.info(f"Обработчик обновлений запущен, разделы: {partitions}")
+    await asyncio.gather(*(consume_partition(dp, bot, queue, partition) for partition in partitions))
+
+def worker_partitions(index: int, workers: int, partitions: int) -> List[int]:
+    """Разделы, закрепленные за обработчиком с номером index"""
+    return list(range(index, partitions, workers))
+
+def _worker_process(index: int, workers: int, partitions: int, path: str):
+    """Точка входа процесса-обработчика"""
+    from .bot import bot, dp, render_cache
+    
+    async def main():
+        render_cache.start()
+        queue = SQLiteUpdateQueue(path, partitions)
+        try:
+            await run_worker(dp, bot, queue, worker_partitions(index, workers, partitions))
+        finally:
+            await render_cache.stop()
+            await bot.session.close()
+    
+    asyncio.run(main())
+
+async def supervise_workers(processes: Dict[int, multiprocessing.Process],
+                            start_worker: Callable[[int], multiprocessing.Process],
+                            workers: int, partitions: int, interval: float = 5):
+    """Перезапуск упавших процессов-обработчиков
+    
+    Без обработчика его разделы перестают читаться, а обновления копятся
+    в очереди; новый процесс продолжает с первого неподтвержденного.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        for index, process in list(processes.items()):
+            if process.is_alive():
+                continue
+            logger.error(
+                f"Обработчик {index} (разделы {worker_partitions(index, workers, partitions)}) "
+                f"завершился с кодом {process.exitcode}, перезапуск"
+            )
+            processes[index] = start_worker(index)
+
+async def run_sharded(bot: Bot, dp: Dispatcher, workers: int, partitions: int,
+                      backend: str = 'sqlite', path: str = './bot_updates.db'):
+    """Запуск ingress и обработчиков
+    
+    С очередью sqlite обработчики запускаются отдельными процессами и
+    используют все ядра; с очередью memory - задачами в текущем процессе
+    (для локальной отладки).
+    """
+    if workers < 1 or partitions < workers:
+        raise ValueError("Нужен хотя бы один обработчик и не меньше разделов, чем обработчиков")
+    
+    queue = create_update_queue(backend, partitions, path)
+    if backend == 'memory':
+        await asyncio.gather(
+            run_ingress(bot, dp, queue),
+            run_worker(dp, bot, queue, list(range(partitions)))
+        )
+        return
+    
+    context = multiprocessing.get_context('spawn')
+    
+    def start_worker(index: int) -> multiprocessing.Process:
+        process = context.Process(target=_worker_process, args=(index, workers, partitions, path), daemon=True)
+        process.start()
+        return process
+    
+    processes = {index: start_worker(index) for index in range(workers)}
+    supervisor = asyncio.create_task(supervise_workers(processes, start_worker, workers, partitions))
+    try:
+        await run_ingress(bot, dp, queue)
+    finally:
+        supervisor.cancel()
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            process.join(timeout=10)
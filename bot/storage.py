@@ -0,0 +1,65 @@
+"""
+Хранилище состояний FSM бота в БД
+Состояния переживают перезапуск и общие для всех экземпляров бота;
+в памяти процесса хранится только ограниченный LRU-кэш недавних пользователей
+"""
+
+import asyncio
+import copy
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+from backend.cache import TTLCache
+from db.repositories import BotStateRepository
+
+class DBStorage(BaseStorage):
+    """FSM-хранилище aiogram поверх таблицы bot_states
+    
+    Запись идет сразу в БД (write-through), чтение - из LRU-кэша, а при
+    промахе из БД. TTL кэша ограничивает время, в течение которого один
+    экземпляр бота может не видеть изменения, сделанные другим.
+    """
+    
+    def __init__(self, cache_size: int = 10000, cache_ttl: float = 60,
+                 key_builder: Optional[KeyBuilder] = None):
+        self.key_builder = key_builder or DefaultKeyBuilder()
+        self.cache = TTLCache(ttl=cache_ttl, max_entries=cache_size)
+    
+    async def _load(self, key: StorageKey) -> Tuple[str, Optional[str], Dict[str, Any]]:
+        db_key = self.key_builder.build(key)
+        record = self.cache.get(db_key)
+        if record is None:
+            record = await asyncio.to_thread(BotStateRepository.get, db_key) or (None, {})
+            self.cache.set(db_key, record)
+        state, data = record
+        return db_key, state, data
+    
+    async def _save(self, db_key: str, state: Optional[str], data: Dict[str, Any]):
+        await asyncio.to_thread(BotStateRepository.save, db_key, state, data)
+        self.cache.set(db_key, (state, data))
+    
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        db_key, _, data = await self._load(key)
+        await self._save(db_key, state.state if isinstance(state, State) else state, data)
+    
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        _, state, _ = await self._load(key)
+        return state
+    
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        db_key, state, _ = await self._load(key)
+        await self._save(db_key, state, copy.deepcopy(dict(data)))
+    
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, _, data = await self._load(key)
+        # Копия, чтобы изменения в обработчике не попадали в кэш без записи в БД
+        return copy.deepcopy(data)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика LRU-кэша состояний"""
+        return self.cache.get_stats()
+    
+    async def close(self) -> None:
+        self.cache.clear()
@@ -0,0 +1,71 @@
+"""
+Маршрутизация текстовых кнопок бота по таблице
+Вместо цепочки фильтров вида lambda message: message.text == '...'
+текст кнопки ищется в словаре за O(1), независимо от числа кнопок и языков
+"""
+
+import inspect
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, Optional, Tuple, Union
+
+from aiogram import types
+
+Handler = Callable[..., Awaitable[Any]]
+
+def normalize_text(text: str) -> str:
+    """Нормализация текста кнопки: регистр и лишние пробелы не важны"""
+    return ' '.join(text.split()).casefold()
+
+class TextRouter:
+    """Таблица «текст кнопки -> обработчик»
+
+    Регистрируется в диспетчере одним обработчиком: фильтр находит
+    обработчик в словаре и передает его дальше, поэтому сообщения, не
+    совпавшие ни с одной кнопкой, сразу уходят следующим обработчикам.
+    """
+
+    def __init__(self):
+        self._exact: Dict[str, Tuple[Handler, FrozenSet[str]]] = {}
+        self._aliases: Dict[str, Tuple[Handler, FrozenSet[str]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._exact) + len(self._aliases)
+
+    def register(self, text: str, *aliases: str) -> Callable[[Handler], Handler]:
+        """Декоратор: обработчик для текста кнопки и его переводов/синонимов"""
+        def decorator(handler: Handler) -> Handler:
+            # Заранее определяем, какие данные aiogram нужны обработчику
+            entry = (handler, frozenset(inspect.signature(handler).parameters))
+            for value in (text, *aliases):
+                key = normalize_text(value)
+                if value in self._exact or key in self._aliases:
+                    raise ValueError(f"Текст кнопки уже зарегистрирован: {value!r}")
+                self._exact[value] = entry
+                self._aliases[key] = entry
+            return handler
+        return decorator
+
+    def resolve(self, text: Optional[str]) -> Optional[Handler]:
+        """Поиск обработчика по тексту сообщения"""
+        entry = self._lookup(text)
+        return entry[0] if entry else None
+
+    def _lookup(self, text: Optional[str]) -> Optional[Tuple[Handler, FrozenSet[str]]]:
+        if not text:
+            return None
+        # Точное совпадение - самый частый случай (текст пришел с клавиатуры)
+        entry = self._exact.get(text)
+        if entry is None:
+            entry = self._aliases.get(normalize_text(text))
+        return entry
+
+    async def filter(self, message: types.Message) -> Union[bool, Dict[str, Any]]:
+        """Фильтр aiogram: передает найденный обработчик в данные события"""
+        entry = self._lookup(message.text)
+        if entry is None:
+            return False
+        return {'text_route': entry}
+
+    async def dispatch(self, message: types.Message, text_route: Tuple[Handler, FrozenSet[str]], **data: Any) -> Any:
+        """Вызов найденного обработчика только с нужными ему аргументами"""
+        handler, params = text_route
+        return await handler(message, **{name: value for name, value in data.items() if name in params})
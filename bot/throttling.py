@@ -0,0 +1,137 @@
+"""
+Ограничение частоты запросов пользователей бота
+Каждому пользователю выделяется свой token bucket; одинаковые запросы,
+пришедшие, пока первый еще обрабатывается, не выполняются повторно
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from aiogram import BaseMiddleware, types
+
+from backend.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+THROTTLED_MESSAGE = "⏳ Слишком много запросов. Пожалуйста, подождите несколько секунд."
+
+class TokenBucket:
+    """Неблокирующий token bucket: запрос либо проходит сразу, либо отклоняется"""
+    
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+    
+    def consume(self, now: Optional[float] = None) -> bool:
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Middleware aiogram для сообщений и нажатий inline-кнопок
+    
+    rate - сколько запросов в секунду восполняется, burst - сколько
+    запросов подряд допускается. О превышении лимита пользователь узнает
+    не чаще одного раза за warning_interval секунд, остальные запросы
+    отбрасываются молча.
+    """
+    
+    def __init__(self, rate: float = 1.0, burst: int = 5, warning_interval: float = 10,
+                 max_users: int = 100000):
+        self.rate = rate
+        self.burst = burst
+        self.warning_interval = warning_interval
+        # Корзины неактивных пользователей к этому времени уже полные, поэтому
+        # их можно забыть - память ограничена числом недавно активных
+        idle_ttl = max(60.0, burst / rate * 2)
+        self.buckets = TTLCache(ttl=idle_ttl, max_entries=max_users)
+        self.warned = TTLCache(ttl=max(warning_interval, 1), max_entries=max_users)
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+        
+        self.passed = 0
+        self.throttled = 0
+        self.coalesced = 0
+    
+    def _request_key(self, event: types.TelegramObject, user_id: int) -> Optional[Hashable]:
+        if isinstance(event, types.Message) and event.text:
+            return (user_id, 'message', event.text)
+        if isinstance(event, types.CallbackQuery) and event.data:
+            return (user_id, 'callback', event.data)
+        return None
+    
+    async def __call__(
+        self,
+        handler: Callable[[types.TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: types.TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get('event_from_user')
+        if user is None:
+            return await handler(event, data)
+        
+        # Повтор запроса, который еще выполняется, ждет его результата
+        key = self._request_key(event, user.id)
+        in_flight = self._in_flight.get(key) if key is not None else None
+        if in_flight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(in_flight)
+        
+        bucket = self.buckets.get(user.id)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.burst)
+            self.buckets.set(user.id, bucket)
+        if not bucket.consume():
+            self.throttled += 1
+            await self._warn(event, user.id)
+            return None
+        
+        self.passed += 1
+        if key is None:
+            return await handler(event, data)
+        
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            result = await handler(event, data)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Помечаем ошибку полученной: если дубликатов не было, asyncio не будет о ней предупреждать
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[key]
+    
+    async def _warn(self, event: types.TelegramObject, user_id: int):
+        """Вежливое предупреждение не чаще раза в warning_interval"""
+        if self.warned.get(user_id):
+            return
+        self.warned.set(user_id, True)
+        logger.info(f"Пользователь {user_id} превысил лимит запросов")
+        try:
+            # Для inline-кнопки это всплывающая подсказка, для сообщения - ответ
+            if isinstance(event, (types.Message, types.CallbackQuery)):
+                await event.answer(THROTTLED_MESSAGE)
+        except Exception as e:
+            logger.warning(f"Не удалось отправить предупреждение о лимите: {e}")
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'passed': self.passed,
+            'throttled': self.throttled,
+            'coalesced': self.coalesced,
+            'in_flight': len(self._in_flight),
+            'tracked_users': len(self.buckets)
+        }
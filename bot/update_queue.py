@@ -0,0 +1,159 @@
+"""
+Очередь обновлений Telegram, разбитая на разделы по chat id
+Все обновления одного чата попадают в один раздел, а каждый раздел читает
+ровно один обработчик, поэтому порядок сообщений в чате сохраняется
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+# Элемент очереди: (id, обновление в виде словаря)
+QueueItem = Tuple[int, Dict[str, Any]]
+
+def partition_for(chat_id: Optional[int], partitions: int) -> int:
+    """Раздел для чата; обновления без чата идут в раздел 0"""
+    if chat_id is None:
+        return 0
+    return chat_id % partitions
+
+class MemoryUpdateQueue:
+    """Очередь в памяти процесса (для локального запуска и тестов)"""
+    
+    def __init__(self, partitions: int = 4):
+        self.partitions = partitions
+        self._queues = [asyncio.Queue() for _ in range(partitions)]
+        self._next_id = 0
+    
+    async def put(self, update: Dict[str, Any], chat_id: Optional[int]) -> int:
+        self._next_id += 1
+        await self._queues[partition_for(chat_id, self.partitions)].put((self._next_id, update))
+        return self._next_id
+    
+    async def fetch(self, partition: int, limit: int = 100, timeout: float = 1.0) -> List[QueueItem]:
+        """Ожидание и получение очередных обновлений раздела"""
+        queue = self._queues[partition]
+        try:
+            items = [await asyncio.wait_for(queue.get(), timeout)]
+        except asyncio.TimeoutError:
+            return []
+        while len(items) < limit and not queue.empty():
+            items.append(queue.get_nowait())
+        return items
+    
+    async def ack(self, partition: int, ids: List[int]):
+        """Подтверждение обработки (в памяти элементы уже извлечены)"""
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'backend': 'memory',
+            'pending': [queue.qsize() for queue in self._queues]
+        }
+
+class SQLiteUpdateQueue:
+    """Надежная очередь в файле SQLite, общая для процессов на одной машине
+    
+    Обновление удаляется только после подтверждения обработки, поэтому
+    при падении обработчика оно будет обработано повторно (at-least-once).
+    """
+    
+    def __init__(self, path: str, partitions: int = 4, poll_interval: float = 0.05,
+                 max_poll_interval: float = 1.0):
+        self.path = path
+        self.partitions = partitions
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self._idle_delay: Dict[int, float] = {}  # текущая пауза опроса пустого раздела
+        self._local = threading.local()
+        self._connect()
+    
+    def _connect(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS bot_updates ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "partition INTEGER NOT NULL, "
+                "chat_id INTEGER, "
+                "payload TEXT NOT NULL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS ix_bot_updates_partition ON bot_updates (partition, id)"
+            )
+            connection.commit()
+            self._local.connection = connection
+        return connection
+    
+    def _put(self, update: Dict[str, Any], chat_id: Optional[int]) -> int:
+        connection = self._connect()
+        with connection:
+            cursor = connection.execute(
+                "INSERT INTO bot_updates (partition, chat_id, payload) VALUES (?, ?, ?)",
+                (partition_for(chat_id, self.partitions), chat_id, json.dumps(update, ensure_ascii=False))
+            )
+        return cursor.lastrowid
+    
+    def _fetch(self, partition: int, limit: int) -> List[QueueItem]:
+        rows = self._connect().execute(
+            "SELECT id, payload FROM bot_updates WHERE partition = ? ORDER BY id LIMIT ?",
+            (partition, limit)
+        ).fetchall()
+        return [(row_id, json.loads(payload)) for row_id, payload in rows]
+    
+    def _ack(self, ids: List[int]):
+        connection = self._connect()
+        with connection:
+            connection.executemany("DELETE FROM bot_updates WHERE id = ?", [(row_id,) for row_id in ids])
+    
+    async def put(self, update: Dict[str, Any], chat_id: Optional[int]) -> int:
+        return await asyncio.to_thread(self._put, update, chat_id)
+    
+    async def fetch(self, partition: int, limit: int = 100, timeout: float = 1.0) -> List[QueueItem]:
+        """Получение необработанных обновлений раздела (ожидание до timeout)
+        
+        Пока раздел пуст, пауза между опросами удваивается до max_poll_interval,
+        первое же обновление возвращает ее к poll_interval.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            items = await asyncio.to_thread(self._fetch, partition, limit)
+            if items:
+                self._idle_delay.pop(partition, None)
+                return items
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return items
+            delay = self._idle_delay.get(partition, self.poll_interval)
+            self._idle_delay[partition] = min(delay * 2, self.max_poll_interval)
+            await asyncio.sleep(min(delay, remaining))
+    
+    async def ack(self, partition: int, ids: List[int]):
+        if ids:
+            await asyncio.to_thread(self._ack, ids)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        rows = self._connect().execute(
+            "SELECT partition, COUNT(*) FROM bot_updates GROUP BY partition"
+        ).fetchall()
+        counts = dict(rows)
+        return {
+            'backend': 'sqlite',
+            'path': self.path,
+            'pending': [counts.get(partition, 0) for partition in range(self.partitions)]
+        }
+
+def create_update_queue(backend: str, partitions: int, path: Optional[str] = None):
+    """Создание очереди по имени backend: memory или sqlite"""
+    if backend == 'memory':
+        return MemoryUpdateQueue(partitions)
+    if backend == 'sqlite':
+        return SQLiteUpdateQueue(path or './bot_updates.db', partitions)
+    raise ValueError(f"Неизвестный тип очереди обновлений: {backend}")
@@ -1 +1,4 @@
-# Database package initialization 
\ No newline at end of file
+# Database package initialization
+
+# Регистрация отслеживания версий ресурсов для всех сессий SessionLocal
+from . import versions
@@ -1,4 +1,5 @@
 from sqlalchemy import create_engine
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
@@ -24,4 +25,9 @@ def get_db():
     try:
         yield db
     finally:
-        db.close() 
\ No newline at end of file
+        db.close()
+
+def upsert(bind, table):
+    """INSERT с поддержкой ON CONFLICT для диалекта подключения (SQLite/PostgreSQL)"""
+    dialect = postgresql if bind.dialect.name == 'postgresql' else sqlite
+    return dialect.insert(table)
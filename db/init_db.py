@@ -1,11 +1,106 @@
+from sqlalchemy import inspect, select, text
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from .database import engine, SessionLocal
-from .models import Base, User, Teacher, Lesson, Club, Test, NotificationSettings
+from .models import Base, User, Teacher, Lesson, Club, Test, NotificationSettings, Booking, LessonOccurrence
+from .occurrences import OccurrenceError, occurrence_start
 import json
 
+def link_bookings_to_occurrences(connection):
+    """Привязка прежних записей к занятиям по расписанию урока
+    
+    В booking_date прежних записей - день занятия (раньше туда попадало и
+    время создания записи). Запись привязывается к занятию урока в этот
+    день; если в этот день урока нет, occurrence_id остается NULL, чтобы
+    не создавать занятий вне расписания.
+    """
+    bookings = Booking.__table__
+    lessons = Lesson.__table__
+    occurrences = LessonOccurrence.__table__
+    rows = connection.execute(
+        select(bookings.c.id, bookings.c.user_id, bookings.c.lesson_id, bookings.c.booking_date,
+               lessons.c.day_of_week, lessons.c.start_time)
+        .join(lessons, lessons.c.id == bookings.c.lesson_id)
+        .order_by(bookings.c.id)
+    ).all()
+    
+    occurrence_ids = {}
+    linked = set()
+    for booking_id, user_id, lesson_id, booking_date, day_of_week, start_time in rows:
+        if booking_date is None:
+            continue
+        try:
+            starts_at = occurrence_start(day_of_week, start_time, booking_date.date())
+        except (OccurrenceError, ValueError):
+            continue
+        if (user_id, lesson_id, starts_at) in linked:
+            # Повторная запись того же пользователя на то же занятие не привязывается
+            continue
+        
+        key = (lesson_id, starts_at)
+        if key not in occurrence_ids:
+            occurrence_id = connection.execute(
+                select(occurrences.c.id).where(occurrences.c.lesson_id == lesson_id, occurrences.c.starts_at == starts_at)
+            ).scalar()
+            if occurrence_id is None:
+                occurrence_id = connection.execute(
+                    occurrences.insert().values(lesson_id=lesson_id, starts_at=starts_at, booked_count=0)
+                ).inserted_primary_key[0]
+            occurrence_ids[key] = occurrence_id
+        
+        connection.execute(
+            bookings.update().where(bookings.c.id == booking_id)
+            .values(occurrence_id=occurrence_ids[key], booking_date=starts_at)
+        )
+        linked.add((user_id, lesson_id, starts_at))
+
+# Заполнение добавленных столбцов по уже существующим данным (SQL или функция от соединения)
+COLUMN_BACKFILLS = {
+    ('clubs', 'participants_count'): (
+        'UPDATE clubs SET participants_count = ('
+        'SELECT COUNT(*) FROM club_memberships '
+        'WHERE club_memberships.club_id = clubs.id AND club_memberships.is_active = true)',
+    ),
+    # Прежние записи привязываются к занятиям, счетчики мест пересчитываются
+    ('bookings', 'occurrence_id'): (
+        link_bookings_to_occurrences,
+        'UPDATE lesson_occurrences SET booked_count = ('
+        "SELECT COUNT(*) FROM bookings WHERE bookings.occurrence_id = lesson_occurrences.id "
+        "AND bookings.status = 'confirmed')"
+    )
+}
+
 def init_db():
     """Создает таблицы в базе данных"""
     Base.metadata.create_all(bind=engine)
+    
+    # create_all не меняет уже существующие таблицы: добавляем новые
+    # столбцы (допускающие NULL или со значением по умолчанию) и индексы
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            if not column.nullable and column.server_default is None:
+                continue
+            column_sql = f'{column.name} {column.type.compile(dialect=engine.dialect)}'
+            if column.server_default is not None:
+                column_sql += f" NOT NULL DEFAULT {column.server_default.arg}"
+            with engine.begin() as connection:
+                connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column_sql}'))
+                for backfill in COLUMN_BACKFILLS.get((table.name, column.name), ()):
+                    if callable(backfill):
+                        backfill(connection)
+                    else:
+                        connection.execute(text(backfill))
+        
+        for index in table.indexes:
+            try:
+                index.create(bind=engine, checkfirst=True)
+            except IntegrityError as e:
+                # Уникальный индекс не создать, пока в данных есть дубликаты
+                print(f"⚠️ Не удалось создать индекс {index.name}: {e}")
 
 def create_sample_data():
     """Создает образцы данных для тестирования"""
@@ -0,0 +1,127 @@
+"""
+Выбор лидера для фоновых задач через аренду в БД
+Гарантирует, что при нескольких воркерах uvicorn или экземплярах бота
+фоновую задачу (синхронизацию CRM/LMS, рассылку уведомлений) выполняет
+ровно один процесс, а при его падении задачу подхватывает другой
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from .repositories import JobLeaseRepository
+
+logger = logging.getLogger(__name__)
+
+class LeaderElection:
+    """Аренда фоновой задачи с периодическим продлением (heartbeat)
+    
+    Процесс, захвативший аренду, запускает задачу и продлевает аренду
+    каждые renew_interval секунд. Если продлить не удалось, задача
+    останавливается; после истечения ttl аренду захватывает другой процесс.
+    Завершившаяся или упавшая задача перезапускается, пока процесс - лидер.
+    """
+    
+    def __init__(self, name: str, ttl: float = 30, renew_interval: Optional[float] = None,
+                 holder: Optional[str] = None):
+        if renew_interval is not None and renew_interval >= ttl:
+            raise ValueError("renew_interval должен быть меньше ttl")
+        
+        self.name = name
+        self.ttl = ttl
+        self.renew_interval = renew_interval or ttl / 3
+        self.holder = holder or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.is_leader = False
+        self.elections_won = 0
+        self.job_restarts = 0
+        self._task: Optional[asyncio.Task] = None
+    
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+    
+    def start(self, job: Callable[[], Awaitable[Any]]):
+        """Участие в выборах в текущем event loop; job запускается только у лидера"""
+        if self.running:
+            return
+        self._task = asyncio.create_task(self.run(job))
+    
+    async def stop(self):
+        """Остановка задачи и освобождение аренды"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+    
+    async def run(self, job: Callable[[], Awaitable[Any]]):
+        """Цикл выборов; работает до stop(), задача лидера при завершении перезапускается"""
+        job_task: Optional[asyncio.Task] = None
+        try:
+            while True:
+                try:
+                    acquired = await asyncio.to_thread(JobLeaseRepository.acquire, self.name, self.holder, self.ttl)
+                except Exception as e:
+                    # Без подтвержденной аренды задачу выполнять нельзя
+                    logger.error(f"Ошибка продления аренды '{self.name}': {e}")
+                    acquired = False
+                
+                if acquired and not self.is_leader:
+                    logger.info(f"Процесс {self.holder} стал лидером задачи '{self.name}'")
+                    self.elections_won += 1
+                elif not acquired and self.is_leader:
+                    logger.warning(f"Процесс {self.holder} потерял аренду задачи '{self.name}', задача остановлена")
+                    await self._cancel(job_task)
+                    job_task = None
+                self.is_leader = acquired
+                
+                if job_task is not None and job_task.done():
+                    if not job_task.cancelled() and job_task.exception() is not None:
+                        logger.error(f"Задача '{self.name}' завершилась с ошибкой: {job_task.exception()}")
+                    else:
+                        logger.warning(f"Задача '{self.name}' завершилась")
+                    job_task = None
+                    if self.is_leader:
+                        self.job_restarts += 1
+                        logger.info(f"Перезапуск задачи '{self.name}' (перезапусков: {self.job_restarts})")
+                
+                if self.is_leader and job_task is None:
+                    job_task = asyncio.create_task(job())
+                
+                await asyncio.sleep(self.renew_interval)
+        finally:
+            await self._cancel(job_task)
+            if self.is_leader:
+                self.is_leader = False
+                try:
+                    await asyncio.to_thread(JobLeaseRepository.release, self.name, self.holder)
+                except Exception as e:
+                    logger.error(f"Ошибка освобождения аренды '{self.name}': {e}")
+    
+    async def _cancel(self, task: Optional[asyncio.Task]):
+        if task is None or task.done():
+            return
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"Ошибка при остановке задачи '{self.name}': {e}")
+    
+    def get_state(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'holder': self.holder,
+            'running': self.running,
+            'is_leader': self.is_leader,
+            'elections_won': self.elections_won,
+            'job_restarts': self.job_restarts,
+            'ttl': self.ttl
+        }
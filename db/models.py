@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, ForeignKey, Float
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, ForeignKey, Float, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from .database import Base
@@ -65,13 +65,46 @@ class Booking(Base):
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
     lesson_id = Column(Integer, ForeignKey("lessons.id"))
-    booking_date = Column(DateTime, nullable=False)
+    occurrence_id = Column(Integer, ForeignKey("lesson_occurrences.id"), nullable=True)
+    booking_date = Column(DateTime, nullable=False)  # начало занятия (см. db/occurrences.py)
     status = Column(String, default="confirmed")  # confirmed, cancelled, completed
+    idempotency_key = Column(String, nullable=True)  # ключ повторной отправки запроса клиентом
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     # Связи
     user = relationship("User", back_populates="bookings")
     lesson = relationship("Lesson", back_populates="bookings")
+    occurrence = relationship("LessonOccurrence", back_populates="bookings")
+    
+    __table_args__ = (
+        # Одна запись пользователя на конкретное занятие
+        Index('ux_bookings_user_lesson_date', 'user_id', 'lesson_id', 'booking_date', unique=True),
+        Index('ux_bookings_idempotency', 'user_id', 'idempotency_key', unique=True),
+        # Список записавшихся на занятие
+        Index('ix_bookings_occurrence_status', 'occurrence_id', 'status'),
+    )
+
+class LessonOccurrence(Base):
+    __tablename__ = "lesson_occurrences"
+    
+    # Конкретное занятие по еженедельному расписанию урока и счетчик занятых мест;
+    # места занимаются условным UPDATE booked_count < max_students.
+    # Строки создаются заранее на несколько недель вперед (db/occurrences.py)
+    id = Column(Integer, primary_key=True, index=True)
+    lesson_id = Column(Integer, ForeignKey("lessons.id"), nullable=False)
+    starts_at = Column(DateTime, nullable=False)
+    booked_count = Column(Integer, nullable=False, default=0)
+    reminder_sent_at = Column(DateTime, nullable=True)  # напоминание за час
+    advance_reminder_sent_at = Column(DateTime, nullable=True)  # напоминание за сутки
+    
+    # Связи
+    bookings = relationship("Booking", back_populates="occurrence")
+    
+    __table_args__ = (
+        Index('ux_lesson_occurrences_lesson_start', 'lesson_id', 'starts_at', unique=True),
+        # Поиск занятий, для которых пора отправить напоминания
+        Index('ix_lesson_occurrences_starts_at', 'starts_at'),
+    )
 
 class Club(Base):
     __tablename__ = "clubs"
@@ -80,6 +113,9 @@ class Club(Base):
     name = Column(String, nullable=False)
     description = Column(Text, nullable=True)
     max_participants = Column(Integer, default=10)
+    # Число активных участников; места занимаются условным UPDATE
+    # participants_count < max_participants
+    participants_count = Column(Integer, nullable=False, default=0, server_default='0')
     day_of_week = Column(String, nullable=False)
     start_time = Column(String, nullable=False)
     duration = Column(Integer, default=90)  # в минутах
@@ -101,6 +137,27 @@ class ClubMembership(Base):
     # Связи
     user = relationship("User", back_populates="club_memberships")
     club = relationship("Club", back_populates="memberships")
+    
+    __table_args__ = (
+        # Одна запись участия на пользователя и клуб (выход - is_active = False)
+        Index('ux_club_memberships_user_club', 'user_id', 'club_id', unique=True),
+    )
+
+class WaitlistEntry(Base):
+    __tablename__ = "waitlist_entries"
+    
+    # Очередь на место: id растет, поэтому порядок в очереди - порядок id,
+    # и следующий кандидат находится поиском по индексу, без сортировки
+    id = Column(Integer, primary_key=True, index=True)
+    resource_type = Column(String, nullable=False)  # club, lesson
+    resource_id = Column(Integer, nullable=False)  # clubs.id или lesson_occurrences.id
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    __table_args__ = (
+        Index('ix_waitlist_entries_queue', 'resource_type', 'resource_id', 'id'),
+        Index('ux_waitlist_entries_user', 'resource_type', 'resource_id', 'user_id', unique=True),
+    )
 
 class Test(Base):
     __tablename__ = "tests"
@@ -146,6 +203,19 @@ class Notification(Base):
     
     # Связи
     user = relationship("User", back_populates="notifications")
+    
+    __table_args__ = (
+        # Постраничный просмотр уведомлений пользователя от новых к старым
+        Index('ix_notifications_user_created', 'user_id', 'created_at', 'id'),
+    )
+
+class NotificationCounter(Base):
+    __tablename__ = "notification_counters"
+    
+    # Число непрочитанных уведомлений пользователя; поддерживается
+    # NotificationRepository вместе с изменением самих уведомлений
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    unread_count = Column(Integer, nullable=False, default=0)
 
 class NotificationSettings(Base):
     __tablename__ = "notification_settings"
@@ -162,4 +232,51 @@ class NotificationSettings(Base):
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     
     # Связи
-    user = relationship("User", back_populates="notification_settings") 
\ No newline at end of file
+    user = relationship("User", back_populates="notification_settings") 
+
+class CRMSyncRun(Base):
+    __tablename__ = "crm_sync_runs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    crm_type = Column(String, nullable=False)
+    trigger = Column(String, nullable=False)  # scheduled, manual, webhook
+    status = Column(String, nullable=False)  # success, failed
+    started_at = Column(DateTime, nullable=False, index=True)
+    finished_at = Column(DateTime, nullable=False)
+    duration = Column(Float, nullable=False)  # секунды
+    records_fetched = Column(Integer, default=0)
+    records_changed = Column(Integer, default=0)
+    records_failed = Column(Integer, default=0)
+    http_requests = Column(Integer, default=0)
+    http_retries = Column(Integer, default=0)
+    bytes_received = Column(Integer, default=0)
+    phases = Column(Text, nullable=True)  # JSON: {этап: {duration, fetched, changed, failed, error}}
+    error = Column(Text, nullable=True)
+
+
+class JobLease(Base):
+    __tablename__ = "job_leases"
+    
+    name = Column(String, primary_key=True)  # crm_sync, notification_scheduler
+    holder = Column(String, nullable=False)  # host:pid:случайный суффикс
+    generation = Column(Integer, default=1)  # увеличивается при каждой смене лидера
+    acquired_at = Column(DateTime, nullable=False)
+    heartbeat_at = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+
+class BotState(Base):
+    __tablename__ = "bot_states"
+    
+    key = Column(String, primary_key=True)  # ключ FSM: fsm:<chat_id>:<user_id>
+    state = Column(String, nullable=True)
+    data = Column(Text, nullable=True)  # JSON
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class DataVersion(Base):
+    __tablename__ = "data_versions"
+    
+    name = Column(String, primary_key=True)  # lessons, clubs, tests
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -0,0 +1,121 @@
+"""
+Публикация событий уведомлений подписчикам (pub/sub)
+NotificationRepository публикует новые уведомления и изменения счетчика
+непрочитанных, потоковый endpoint подписывает на них подключенных клиентов
+"""
+
+import asyncio
+import threading
+from typing import Any, Dict, List, Optional
+
+class NotificationSubscription:
+    """Подписка одного клиента: ограниченная очередь событий в его event loop"""
+    
+    def __init__(self, user_id: int, maxsize: int = 100):
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+    
+    def deliver(self, event: Dict[str, Any]):
+        """Постановка события (выполняется в loop подписчика)"""
+        if self.queue.full():
+            # Медленный клиент теряет самые старые события, а не память сервера
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+    
+    async def get(self, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Следующее событие или None, если за timeout событий не было"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+class NotificationBus:
+    """Интерфейс шины событий уведомлений
+    
+    Реализация для нескольких процессов (например, поверх Redis pub/sub
+    или LISTEN/NOTIFY) пересылает publish остальным процессам и доставляет
+    события своим локальным подписчикам так же, как LocalNotificationBus.
+    """
+    
+    def subscribe(self, user_id: int) -> NotificationSubscription:
+        raise NotImplementedError
+    
+    def unsubscribe(self, subscription: NotificationSubscription):
+        raise NotImplementedError
+    
+    def has_subscribers(self, user_id: int) -> bool:
+        raise NotImplementedError
+    
+    def publish(self, user_id: int, event: Dict[str, Any]):
+        raise NotImplementedError
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {}
+
+class LocalNotificationBus(NotificationBus):
+    """Шина в памяти одного процесса
+    
+    publish можно вызывать из любого потока (репозитории работают в пуле
+    потоков FastAPI): событие передается в loop подписчика через
+    call_soon_threadsafe.
+    """
+    
+    def __init__(self, queue_size: int = 100):
+        self.queue_size = queue_size
+        self._subscribers: Dict[int, List[NotificationSubscription]] = {}
+        self._lock = threading.Lock()
+        self.published = 0
+    
+    def subscribe(self, user_id: int) -> NotificationSubscription:
+        subscription = NotificationSubscription(user_id, self.queue_size)
+        with self._lock:
+            self._subscribers.setdefault(user_id, []).append(subscription)
+        return subscription
+    
+    def unsubscribe(self, subscription: NotificationSubscription):
+        with self._lock:
+            subscriptions = self._subscribers.get(subscription.user_id, [])
+            if subscription in subscriptions:
+                subscriptions.remove(subscription)
+            if not subscriptions:
+                self._subscribers.pop(subscription.user_id, None)
+    
+    def has_subscribers(self, user_id: int) -> bool:
+        return user_id in self._subscribers
+    
+    def publish(self, user_id: int, event: Dict[str, Any]):
+        with self._lock:
+            subscriptions = list(self._subscribers.get(user_id, ()))
+        if not subscriptions:
+            return
+        self.published += 1
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+            except RuntimeError:
+                # Loop подписчика уже закрыт
+                self.unsubscribe(subscription)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            connections = sum(len(subscriptions) for subscriptions in self._subscribers.values())
+            users = len(self._subscribers)
+        return {
+            'backend': 'local',
+            'connections': connections,
+            'users': users,
+            'published': self.published
+        }
+
+_notification_bus: NotificationBus = LocalNotificationBus()
+
+def get_notification_bus() -> NotificationBus:
+    return _notification_bus
+
+def set_notification_bus(bus: NotificationBus):
+    """Замена шины (например, на межпроцессную) до начала работы приложения"""
+    global _notification_bus
+    _notification_bus = bus
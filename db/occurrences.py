@@ -0,0 +1,55 @@
+"""
+Конкретные занятия по еженедельному расписанию уроков
+Урок проводится раз в неделю (day_of_week, start_time); занятие -
+это урок в конкретную дату, к нему относятся записи и счетчик мест
+"""
+
+import os
+from datetime import date, datetime, timedelta
+from typing import List, Optional
+
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+# На сколько недель вперед занятия создаются заранее
+OCCURRENCE_HORIZON_WEEKS = int(os.getenv('OCCURRENCE_HORIZON_WEEKS', '4'))
+
+class OccurrenceError(ValueError):
+    """Запрошенная дата не соответствует расписанию урока"""
+
+def occurrence_start(day_of_week: str, start_time: str, on_date: Optional[date] = None,
+                     now: Optional[datetime] = None) -> datetime:
+    """Начало занятия урока
+
+    Без on_date - ближайшее еще не начавшееся занятие; с on_date - занятие в
+    этот день, если урок в этот день недели проводится.
+    """
+    if day_of_week not in WEEKDAYS:
+        raise OccurrenceError(f"Неизвестный день недели: {day_of_week}")
+    hour, minute = (int(part) for part in start_time.split(':'))
+    now = now or datetime.now()
+
+    if on_date is not None:
+        if on_date.weekday() != WEEKDAYS.index(day_of_week):
+            raise OccurrenceError(f"Урок проводится по расписанию: {day_of_week}")
+        return datetime.combine(on_date, datetime.min.time()).replace(hour=hour, minute=minute)
+
+    days_ahead = (WEEKDAYS.index(day_of_week) - now.weekday()) % 7
+    starts_at = (now + timedelta(days=days_ahead)).replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if starts_at <= now:
+        starts_at += timedelta(days=7)
+    return starts_at
+
+def check_horizon(starts_at: datetime, now: Optional[datetime] = None):
+    """Запись открыта только на занятия в пределах горизонта генерации"""
+    now = now or datetime.now()
+    if starts_at >= now + timedelta(weeks=OCCURRENCE_HORIZON_WEEKS):
+        raise OccurrenceError(f"Запись открыта не дальше чем на {OCCURRENCE_HORIZON_WEEKS} нед. вперед")
+
+def occurrence_starts(day_of_week: str, start_time: str, start: datetime, end: datetime) -> List[datetime]:
+    """Начала занятий урока в интервале [start, end)"""
+    starts = []
+    starts_at = occurrence_start(day_of_week, start_time, now=start - timedelta(microseconds=1))
+    while starts_at < end:
+        starts.append(starts_at)
+        starts_at += timedelta(days=7)
+    return starts
@@ -1,10 +1,17 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_
-from typing import List, Optional, Dict, Any
-from .models import User, Teacher, Lesson, Club, Test, Notification, NotificationSettings, Booking, ClubMembership, TestResult
-from .database import SessionLocal
+from sqlalchemy.orm import Session, joinedload
+from sqlalchemy import and_, or_, func, case, select
+from sqlalchemy.exc import IntegrityError
+from typing import Callable, List, Optional, Dict, Any, Tuple
+from .models import User, Teacher, Lesson, Club, Test, Notification, NotificationCounter, NotificationSettings, Booking, LessonOccurrence, ClubMembership, WaitlistEntry, TestResult, CRMSyncRun, JobLease, BotState, DataVersion
+from .database import SessionLocal, upsert
+from .notification_bus import get_notification_bus
+from .versions import bump_session_version
+from .occurrences import OCCURRENCE_HORIZON_WEEKS, OccurrenceError, check_horizon, occurrence_starts
 import json
-from datetime import datetime
+import logging
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
 
 class UserRepository:
     @staticmethod
@@ -85,14 +92,12 @@ class LessonRepository:
     def get_all(level: Optional[str] = None) -> List[Lesson]:
         db = SessionLocal()
         try:
-            query = db.query(Lesson).filter(Lesson.is_active == True)
+            # Преподаватель загружается тем же запросом: после закрытия
+            # сессии lesson.teacher уже не подгрузить
+            query = db.query(Lesson).options(joinedload(Lesson.teacher)).filter(Lesson.is_active == True)
             if level:
                 query = query.filter(Lesson.level == level)
-            lessons = query.all()
-            # Отсоединяем объекты от сессии
-            for lesson in lessons:
-                db.refresh(lesson)
-            return lessons
+            return query.all()
         finally:
             db.close()
     
@@ -100,10 +105,8 @@ class LessonRepository:
     def get_by_id(lesson_id: int) -> Optional[Lesson]:
         db = SessionLocal()
         try:
-            lesson = db.query(Lesson).filter(Lesson.id == lesson_id).first()
-            if lesson:
-                db.refresh(lesson)
-            return lesson
+            # Преподаватель загружается сразу: урок используется после закрытия сессии
+            return db.query(Lesson).options(joinedload(Lesson.teacher)).filter(Lesson.id == lesson_id).first()
         finally:
             db.close()
     
@@ -132,6 +135,39 @@ class LessonRepository:
             return schedule
         finally:
             db.close()
+    
+    @staticmethod
+    def set_capacity(lesson_id: int, max_students: int) -> bool:
+        """Изменение числа мест; новые места предстоящих занятий сразу получают ожидающие"""
+        db = SessionLocal()
+        try:
+            updated = db.query(Lesson).filter(Lesson.id == lesson_id).update(
+                {Lesson.max_students: max_students}, synchronize_session=False
+            )
+            if not updated:
+                db.rollback()
+                return False
+            bump_session_version(db, 'lessons')
+            
+            # Только занятия, у которых есть очередь
+            occurrence_ids = db.query(LessonOccurrence.id).join(
+                WaitlistEntry,
+                and_(WaitlistEntry.resource_type == 'lesson', WaitlistEntry.resource_id == LessonOccurrence.id)
+            ).filter(
+                LessonOccurrence.lesson_id == lesson_id,
+                LessonOccurrence.starts_at > datetime.now()
+            ).distinct().all()
+            notifications = []
+            for (occurrence_id,) in occurrence_ids:
+                notifications.extend(BookingRepository._promote_waitlist(db, occurrence_id))
+            db.commit()
+            NotificationRepository._publish_created(db, notifications)
+            return True
+        except Exception as e:
+            db.rollback()
+            raise e
+        finally:
+            db.close()
 
 class ClubRepository:
     @staticmethod
@@ -162,58 +198,207 @@ class ClubRepository:
         db = SessionLocal()
         try:
             clubs = db.query(Club).filter(Club.is_active == True).all()
-            result = []
             
-            for club in clubs:
-                current_participants = db.query(ClubMembership).filter(
-                    and_(ClubMembership.club_id == club.id, ClubMembership.is_active == True)
-                ).count()
-                
-                result.append({
+            return [
+                {
                     "id": club.id,
                     "name": club.name,
                     "description": club.description,
                     "schedule": f"{club.day_of_week}, {club.start_time}",
                     "max_participants": club.max_participants,
-                    "current_participants": current_participants
-                })
-            
-            return result
+                    "current_participants": club.participants_count
+                }
+                for club in clubs
+            ]
         finally:
             db.close()
     
     @staticmethod
-    def join_club(user_id: int, club_id: int) -> bool:
+    def _take_seat(db: Session, club_id: int) -> bool:
+        """Занять место в клубе, если оно есть (условный UPDATE счетчика)"""
+        return db.query(Club).filter(
+            Club.id == club_id,
+            Club.is_active == True,
+            Club.participants_count < Club.max_participants
+        ).update({Club.participants_count: Club.participants_count + 1}, synchronize_session=False) > 0
+    
+    @staticmethod
+    def join_club(user_id: int, club_id: int) -> str:
+        """Вступление в клуб
+        
+        Возвращает 'joined', 'already_member' или 'full' (клуб заполнен или
+        неактивен). Место занимается условным UPDATE счетчика, запись участия
+        защищена уникальным индексом: при гонке лишняя вставка откатывается
+        вместе с занятым местом, и лимит участников не превышается.
+        """
         db = SessionLocal()
         try:
-            # Проверяем, не состоит ли уже пользователь в клубе
-            existing_membership = db.query(ClubMembership).filter(
-                and_(ClubMembership.user_id == user_id, ClubMembership.club_id == club_id)
-            ).first()
-            
-            if existing_membership:
-                if not existing_membership.is_active:
-                    existing_membership.is_active = True
-                    db.commit()
-                    return True
-                return False  # Уже состоит в клубе
+            if not ClubRepository._take_seat(db, club_id):
+                db.rollback()
+                already_member = db.query(ClubMembership.id).filter(
+                    ClubMembership.user_id == user_id,
+                    ClubMembership.club_id == club_id,
+                    ClubMembership.is_active == True
+                ).first()
+                return 'already_member' if already_member else 'full'
             
-            # Проверяем, есть ли место в клубе
-            club = db.query(Club).filter(Club.id == club_id).first()
-            if not club:
-                return False
+            db.add(ClubMembership(user_id=user_id, club_id=club_id))
+            try:
+                db.commit()
+                return 'joined'
+            except IntegrityError:
+                db.rollback()
             
-            current_members = db.query(ClubMembership).filter(
-                and_(ClubMembership.club_id == club_id, ClubMembership.is_active == True)
-            ).count()
+            # Запись участия уже есть: возвращаем в клуб вышедшего участника
+            if not ClubRepository._take_seat(db, club_id):
+                db.rollback()
+                return 'full'
+            reactivated = db.query(ClubMembership).filter(
+                ClubMembership.user_id == user_id,
+                ClubMembership.club_id == club_id,
+                ClubMembership.is_active == False
+            ).update({ClubMembership.is_active: True}, synchronize_session=False)
+            if not reactivated:
+                db.rollback()
+                return 'already_member'
+            db.commit()
+            return 'joined'
+        except Exception as e:
+            db.rollback()
+            raise e
+        finally:
+            db.close()
+    
+    @staticmethod
+    def _release_seat(db: Session, club_id: int):
+        db.query(Club).filter(Club.id == club_id, Club.participants_count > 0).update(
+            {Club.participants_count: Club.participants_count - 1}, synchronize_session=False
+        )
+    
+    @staticmethod
+    def _admit_member(db: Session, user_id: int, club_id: int) -> bool:
+        """Запись участия для уже занятого места; False - пользователь уже участник"""
+        reactivated = db.query(ClubMembership).filter(
+            ClubMembership.user_id == user_id,
+            ClubMembership.club_id == club_id,
+            ClubMembership.is_active == False
+        ).update({ClubMembership.is_active: True}, synchronize_session=False)
+        if reactivated:
+            return True
+        if db.query(ClubMembership.id).filter(
+            ClubMembership.user_id == user_id, ClubMembership.club_id == club_id
+        ).first():
+            return False
+        db.add(ClubMembership(user_id=user_id, club_id=club_id))
+        db.flush()
+        return True
+    
+    @staticmethod
+    def _promote_waitlist(db: Session, club_id: int) -> List[Notification]:
+        """Перевод ожидающих на свободные места клуба (в транзакции вызывающего)"""
+        promoted = WaitlistRepository._promote(
+            db, 'club', club_id,
+            take_seat=lambda: ClubRepository._take_seat(db, club_id),
+            release_seat=lambda: ClubRepository._release_seat(db, club_id),
+            admit=lambda user_id: ClubRepository._admit_member(db, user_id, club_id)
+        )
+        if not promoted:
+            return []
+        club_name = db.query(Club.name).filter(Club.id == club_id).scalar()
+        return [
+            NotificationRepository._add_notification(
+                db, user_id, "Место в клубе",
+                f"В клубе «{club_name}» освободилось место - вы приняты из листа ожидания",
+                'waitlist_promotion'
+            )
+            for user_id in promoted
+        ]
+    
+    @staticmethod
+    def join_waitlist(user_id: int, club_id: int) -> Optional[int]:
+        """Постановка в лист ожидания клуба
+        
+        Возвращает место в очереди или None, если место в клубе успело
+        освободиться и пользователь сразу принят.
+        """
+        WaitlistRepository.enqueue('club', club_id, user_id)
+        ClubRepository.promote_waitlist(club_id)
+        if ClubRepository.is_member(user_id, club_id):
+            # Параллельный запрос этого же пользователя успел вступить
+            WaitlistRepository.remove('club', club_id, user_id)
+            return None
+        return WaitlistRepository.get_position('club', club_id, user_id)
+    
+    @staticmethod
+    def is_member(user_id: int, club_id: int) -> bool:
+        db = SessionLocal()
+        try:
+            return db.query(ClubMembership.id).filter(
+                ClubMembership.user_id == user_id,
+                ClubMembership.club_id == club_id,
+                ClubMembership.is_active == True
+            ).first() is not None
+        finally:
+            db.close()
+    
+    @staticmethod
+    def promote_waitlist(club_id: int) -> List[int]:
+        db = SessionLocal()
+        try:
+            notifications = ClubRepository._promote_waitlist(db, club_id)
+            db.commit()
+            NotificationRepository._publish_created(db, notifications)
+            return [notification.user_id for notification in notifications]
+        except Exception as e:
+            db.rollback()
+            raise e
+        finally:
+            db.close()
+    
+    @staticmethod
+    def leave_club(user_id: int, club_id: int) -> bool:
+        """Выход из клуба (или из его листа ожидания)
+        
+        Освободившееся место в той же транзакции получает первый в очереди,
+        поэтому его не может перехватить обычное вступление.
+        """
+        db = SessionLocal()
+        try:
+            left = db.query(ClubMembership).filter(
+                ClubMembership.user_id == user_id,
+                ClubMembership.club_id == club_id,
+                ClubMembership.is_active == True
+            ).update({ClubMembership.is_active: False}, synchronize_session=False)
+            if not left:
+                db.rollback()
+                return WaitlistRepository.remove('club', club_id, user_id)
             
-            if current_members >= club.max_participants:
+            ClubRepository._release_seat(db, club_id)
+            notifications = ClubRepository._promote_waitlist(db, club_id)
+            db.commit()
+            NotificationRepository._publish_created(db, notifications)
+            return True
+        except Exception as e:
+            db.rollback()
+            raise e
+        finally:
+            db.close()
+    
+    @staticmethod
+    def set_capacity(club_id: int, max_participants: int) -> bool:
+        """Изменение лимита участников; новые места сразу получают ожидающие"""
+        db = SessionLocal()
+        try:
+            updated = db.query(Club).filter(Club.id == club_id).update(
+                {Club.max_participants: max_participants}, synchronize_session=False
+            )
+            if not updated:
+                db.rollback()
                 return False
-            
-            # Добавляем пользователя в клуб
-            membership = ClubMembership(user_id=user_id, club_id=club_id)
-            db.add(membership)
+            bump_session_version(db, 'clubs')
+            notifications = ClubRepository._promote_waitlist(db, club_id)
             db.commit()
+            NotificationRepository._publish_created(db, notifications)
             return True
         except Exception as e:
             db.rollback()
@@ -271,41 +456,165 @@ class TestRepository:
 class NotificationRepository:
     @staticmethod
     def get_user_notifications(user_id: int, limit: int = 50) -> List[Notification]:
+        notifications, _ = NotificationRepository.get_notifications_page(user_id, limit)
+        return notifications
+    
+    @staticmethod
+    def get_notifications_page(user_id: int, limit: int = 5, before_id: Optional[int] = None,
+                               after_id: Optional[int] = None, notification_type: Optional[str] = None,
+                               unread_only: bool = False) -> Tuple[List[Notification], bool]:
+        """Страница уведомлений от новых к старым (keyset-пагинация)
+        
+        before_id - уведомления старше указанного, after_id - новее него.
+        Возвращает уведомления и признак того, что в направлении
+        листания есть еще. Запрос идет по индексу (user_id, created_at, id)
+        и читает не больше limit + 1 строк (без фильтров) независимо от
+        номера страницы.
+        """
         db = SessionLocal()
         try:
-            notifications = db.query(Notification).filter(
-                Notification.user_id == user_id
-            ).order_by(Notification.created_at.desc()).limit(limit).all()
-            # Отсоединяем объекты от сессии
-            for notification in notifications:
-                db.refresh(notification)
-            return notifications
+            query = db.query(Notification).filter(Notification.user_id == user_id)
+            if notification_type:
+                query = query.filter(Notification.notification_type == notification_type)
+            if unread_only:
+                query = query.filter(Notification.is_read == False)
+            cursor_id = before_id if before_id is not None else after_id
+            newer = before_id is None and after_id is not None
+            if cursor_id is not None:
+                cursor_created = db.query(Notification.created_at).filter(
+                    and_(Notification.id == cursor_id, Notification.user_id == user_id)
+                ).scalar_subquery()
+                if newer:
+                    query = query.filter(or_(
+                        Notification.created_at > cursor_created,
+                        and_(Notification.created_at == cursor_created, Notification.id > cursor_id)
+                    ))
+                else:
+                    query = query.filter(or_(
+                        Notification.created_at < cursor_created,
+                        and_(Notification.created_at == cursor_created, Notification.id < cursor_id)
+                    ))
+            
+            if newer:
+                order = (Notification.created_at.asc(), Notification.id.asc())
+            else:
+                order = (Notification.created_at.desc(), Notification.id.desc())
+            notifications = query.order_by(*order).limit(limit + 1).all()
+            
+            has_more = len(notifications) > limit
+            notifications = notifications[:limit]
+            if newer:
+                notifications.reverse()
+            return notifications, has_more
         finally:
             db.close()
     
     @staticmethod
     def get_unread_count(user_id: int) -> int:
+        """Число непрочитанных уведомлений (чтение счетчика по ключу)
+        
+        Если счетчика еще нет, он создается одним INSERT ... SELECT COUNT:
+        подсчет и вставка атомарны, поэтому уведомление, созданное
+        параллельно, не теряется.
+        """
         db = SessionLocal()
         try:
-            return db.query(Notification).filter(
-                and_(Notification.user_id == user_id, Notification.is_read == False)
-            ).count()
+            return NotificationRepository._read_unread_count(db, user_id)
+        except Exception as e:
+            db.rollback()
+            raise e
         finally:
             db.close()
     
+    @staticmethod
+    def _read_unread_count(db: Session, user_id: int) -> int:
+        counter = db.get(NotificationCounter, user_id)
+        if counter is not None:
+            return counter.unread_count
+        
+        NotificationRepository._create_unread_counter(db, user_id)
+        db.commit()
+        return db.get(NotificationCounter, user_id).unread_count
+    
+    @staticmethod
+    def _unread_count_query(user_id: int):
+        return select(func.count(Notification.id)).where(
+            and_(Notification.user_id == user_id, Notification.is_read == False)
+        ).scalar_subquery()
+    
+    @staticmethod
+    def _create_unread_counter(db: Session, user_id: int):
+        """Счетчик, посчитанный по таблице уведомлений, если его еще нет"""
+        table = NotificationCounter.__table__
+        statement = upsert(db.get_bind(), table).values(
+            user_id=user_id,
+            unread_count=NotificationRepository._unread_count_query(user_id)
+        )
+        db.execute(statement.on_conflict_do_nothing(index_elements=[table.c.user_id]))
+    
+    @staticmethod
+    def _adjust_unread_count(db: Session, user_id: int, delta: int):
+        """Изменение счетчика в транзакции изменения уведомлений
+        
+        Upsert без предварительного чтения: существующий счетчик меняется на
+        дельту (не ниже нуля), отсутствующий создается подсчетом уже
+        измененных уведомлений в этой же транзакции.
+        """
+        if not delta:
+            return
+        table = NotificationCounter.__table__
+        adjusted = table.c.unread_count + delta
+        statement = upsert(db.get_bind(), table).values(
+            user_id=user_id,
+            unread_count=NotificationRepository._unread_count_query(user_id)
+        )
+        db.execute(statement.on_conflict_do_update(
+            index_elements=[table.c.user_id],
+            set_={table.c.unread_count: case((adjusted < 0, 0), else_=adjusted)}
+        ))
+    
+    @staticmethod
+    def notification_to_dict(notification: Notification) -> Dict[str, Any]:
+        return {
+            "id": notification.id,
+            "title": notification.title,
+            "message": notification.message,
+            "is_read": notification.is_read,
+            "notification_type": notification.notification_type,
+            "created_at": notification.created_at.isoformat() if notification.created_at else None
+        }
+    
+    @staticmethod
+    def _publish(db: Session, user_id: int, event: Dict[str, Any]):
+        """Событие для подключенных клиентов пользователя (после commit)
+        
+        Счетчик читается в той же сессии: второе соединение из пула на
+        каждое событие исчерпало бы пул при параллельных записях.
+        """
+        # Подписчики могут быть в других процессах, поэтому событие
+        # публикуется всегда; локальная шина сама пропускает пользователей без подключений
+        bus = get_notification_bus()
+        event["unread_count"] = NotificationRepository._read_unread_count(db, user_id)
+        bus.publish(user_id, event)
+    
     @staticmethod
     def mark_as_read(notification_id: int, user_id: int) -> bool:
         db = SessionLocal()
         try:
-            notification = db.query(Notification).filter(
-                and_(Notification.id == notification_id, Notification.user_id == user_id)
-            ).first()
-            
-            if notification:
-                notification.is_read = True
+            # Условный UPDATE: счетчик уменьшается, только если уведомление
+            # действительно было непрочитанным
+            updated = db.query(Notification).filter(
+                and_(Notification.id == notification_id, Notification.user_id == user_id, Notification.is_read == False)
+            ).update({"is_read": True}, synchronize_session=False)
+            if updated:
+                NotificationRepository._adjust_unread_count(db, user_id, -updated)
                 db.commit()
+                NotificationRepository._publish(db, user_id, {"type": "read", "notification_id": notification_id})
                 return True
-            return False
+            
+            return db.query(Notification.id).filter(
+                and_(Notification.id == notification_id, Notification.user_id == user_id)
+            ).first() is not None
         except Exception as e:
             db.rollback()
             raise e
@@ -316,10 +625,13 @@ class NotificationRepository:
     def mark_all_as_read(user_id: int) -> bool:
         db = SessionLocal()
         try:
-            db.query(Notification).filter(
+            updated = db.query(Notification).filter(
                 and_(Notification.user_id == user_id, Notification.is_read == False)
-            ).update({"is_read": True})
+            ).update({"is_read": True}, synchronize_session=False)
+            NotificationRepository._adjust_unread_count(db, user_id, -updated)
             db.commit()
+            if updated:
+                NotificationRepository._publish(db, user_id, {"type": "read_all"})
             return True
         except Exception as e:
             db.rollback()
@@ -327,20 +639,40 @@ class NotificationRepository:
         finally:
             db.close()
     
+    @staticmethod
+    def _add_notification(db: Session, user_id: int, title: str, message: str, notification_type: str,
+                          scheduled_time: Optional[datetime] = None) -> Notification:
+        """Уведомление в транзакции вызывающего (после commit - _publish_created)"""
+        notification = Notification(
+            user_id=user_id,
+            title=title,
+            message=message,
+            notification_type=notification_type,
+            scheduled_time=scheduled_time
+        )
+        db.add(notification)
+        db.flush()
+        NotificationRepository._adjust_unread_count(db, user_id, 1)
+        return notification
+    
+    @staticmethod
+    def _publish_created(db: Session, notifications: List[Notification]):
+        for notification in notifications:
+            db.refresh(notification)
+            NotificationRepository._publish(db, notification.user_id, {
+                "type": "notification",
+                "notification": NotificationRepository.notification_to_dict(notification)
+            })
+    
     @staticmethod
     def create_notification(user_id: int, title: str, message: str, notification_type: str, scheduled_time: Optional[datetime] = None) -> Notification:
         db = SessionLocal()
         try:
-            notification = Notification(
-                user_id=user_id,
-                title=title,
-                message=message,
-                notification_type=notification_type,
-                scheduled_time=scheduled_time
+            notification = NotificationRepository._add_notification(
+                db, user_id, title, message, notification_type, scheduled_time
             )
-            db.add(notification)
             db.commit()
-            db.refresh(notification)
+            NotificationRepository._publish_created(db, [notification])
             return notification
         except Exception as e:
             db.rollback()
@@ -384,18 +716,244 @@ class NotificationSettingsRepository:
 
 class BookingRepository:
     @staticmethod
-    def create_booking(user_id: int, lesson_id: int, booking_date: datetime) -> Booking:
+    def _get_occurrence_id(db: Session, lesson_id: int, starts_at: datetime) -> int:
+        """ID занятия урока (строка создается, если фоновая задача еще не создала занятие)"""
+        query = db.query(LessonOccurrence.id).filter(
+            LessonOccurrence.lesson_id == lesson_id,
+            LessonOccurrence.starts_at == starts_at
+        )
+        occurrence_id = query.scalar()
+        if occurrence_id is None:
+            try:
+                occurrence = LessonOccurrence(lesson_id=lesson_id, starts_at=starts_at, booked_count=0)
+                db.add(occurrence)
+                db.commit()
+                occurrence_id = occurrence.id
+            except IntegrityError:
+                # Занятие одновременно создал другой запрос
+                db.rollback()
+                occurrence_id = query.scalar()
+        return occurrence_id
+    
+    @staticmethod
+    def create_booking(user_id: int, lesson_id: int, booking_date: datetime,
+                       idempotency_key: Optional[str] = None) -> Tuple[str, Optional[Booking]]:
+        """Запись на занятие урока, начинающееся в booking_date
+        
+        Возвращает (статус, запись): 'created' - новая запись, 'replayed' - повтор
+        запроса с тем же idempotency_key, 'duplicate' - пользователь уже записан
+        на это занятие, 'full' - мест нет (запись None), 'key_conflict' -
+        idempotency_key уже использован для другого занятия (запись None).
+        Занятие дальше горизонта записи - OccurrenceError.
+        Место занимается одним условным UPDATE счетчика занятия, поэтому
+        параллельные запросы не превышают max_students, а строка счетчика
+        заблокирована только до commit.
+        """
         db = SessionLocal()
         try:
+            def find_existing() -> Tuple[Optional[str], Optional[Booking]]:
+                """Уже существующая запись: сначала по ключу идемпотентности, затем по занятию"""
+                if idempotency_key:
+                    booking = db.query(Booking).filter(
+                        Booking.user_id == user_id, Booking.idempotency_key == idempotency_key
+                    ).first()
+                    if booking is not None:
+                        if booking.lesson_id == lesson_id and booking.booking_date == booking_date:
+                            return 'replayed', booking
+                        return 'key_conflict', None
+                booking = db.query(Booking).filter(
+                    Booking.user_id == user_id, Booking.lesson_id == lesson_id, Booking.booking_date == booking_date
+                ).first()
+                return ('duplicate' if booking else None), booking
+            
+            status, booking = find_existing()
+            rebooking = status == 'duplicate' and booking.status == 'cancelled'
+            if status and not rebooking:
+                return status, booking
+            
+            check_horizon(booking_date)
+            occurrence_id = BookingRepository._get_occurrence_id(db, lesson_id, booking_date)
+            if not BookingRepository._take_seat(db, occurrence_id, lesson_id):
+                db.rollback()
+                return 'full', None
+            
+            if rebooking:
+                # Повторная запись после отмены: та же строка снова подтверждена
+                if not BookingRepository._confirm_cancelled(db, booking.id, occurrence_id):
+                    db.rollback()
+                    return find_existing()
+                db.commit()
+                db.refresh(booking)
+                return 'created', booking
+            
             booking = Booking(
                 user_id=user_id,
                 lesson_id=lesson_id,
-                booking_date=booking_date
+                occurrence_id=occurrence_id,
+                booking_date=booking_date,
+                idempotency_key=idempotency_key
             )
             db.add(booking)
-            db.commit()
+            try:
+                db.commit()
+            except IntegrityError:
+                # Параллельный запрос того же пользователя успел раньше;
+                # откат возвращает и занятое место
+                db.rollback()
+                status, booking = find_existing()
+                if status is None:
+                    raise
+                return status, booking
             db.refresh(booking)
-            return booking
+            return 'created', booking
+        except Exception as e:
+            db.rollback()
+            raise e
+        finally:
+            db.close()
+    
+    @staticmethod
+    def _take_seat(db: Session, occurrence_id: int, lesson_id: int) -> bool:
+        """Занять место на занятии, если оно есть (условный UPDATE счетчика)"""
+        capacity = db.query(func.coalesce(Lesson.max_students, 0)).filter(Lesson.id == lesson_id).scalar_subquery()
+        return db.query(LessonOccurrence).filter(
+            LessonOccurrence.id == occurrence_id,
+            LessonOccurrence.booked_count < capacity
+        ).update({LessonOccurrence.booked_count: LessonOccurrence.booked_count + 1}, synchronize_session=False) > 0
+    
+    @staticmethod
+    def _release_seat(db: Session, occurrence_id: int):
+        db.query(LessonOccurrence).filter(
+            LessonOccurrence.id == occurrence_id, LessonOccurrence.booked_count > 0
+        ).update({LessonOccurrence.booked_count: LessonOccurrence.booked_count - 1}, synchronize_session=False)
+    
+    @staticmethod
+    def _confirm_cancelled(db: Session, booking_id: int, occurrence_id: int) -> bool:
+        return db.query(Booking).filter(Booking.id == booking_id, Booking.status == 'cancelled').update(
+            {Booking.status: 'confirmed', Booking.occurrence_id: occurrence_id}, synchronize_session=False
+        ) > 0
+    
+    @staticmethod
+    def _admit_booking(db: Session, user_id: int, occurrence_id: int, lesson_id: int, starts_at: datetime) -> bool:
+        """Запись для уже занятого места; False - пользователь уже записан"""
+        booking = db.query(Booking.id, Booking.status).filter(
+            Booking.user_id == user_id,
+            Booking.lesson_id == lesson_id,
+            Booking.booking_date == starts_at
+        ).first()
+        if booking:
+            return booking.status == 'cancelled' and BookingRepository._confirm_cancelled(db, booking.id, occurrence_id)
+        db.add(Booking(user_id=user_id, lesson_id=lesson_id, occurrence_id=occurrence_id, booking_date=starts_at))
+        db.flush()
+        return True
+    
+    @staticmethod
+    def _promote_waitlist(db: Session, occurrence_id: int) -> List[Notification]:
+        """Перевод ожидающих на свободные места занятия (в транзакции вызывающего)"""
+        occurrence = db.query(LessonOccurrence.lesson_id, LessonOccurrence.starts_at, Lesson.title).join(
+            Lesson, Lesson.id == LessonOccurrence.lesson_id
+        ).filter(LessonOccurrence.id == occurrence_id).first()
+        if occurrence is None or occurrence.starts_at <= datetime.now():
+            return []
+        
+        promoted = WaitlistRepository._promote(
+            db, 'lesson', occurrence_id,
+            take_seat=lambda: BookingRepository._take_seat(db, occurrence_id, occurrence.lesson_id),
+            release_seat=lambda: BookingRepository._release_seat(db, occurrence_id),
+            admit=lambda user_id: BookingRepository._admit_booking(
+                db, user_id, occurrence_id, occurrence.lesson_id, occurrence.starts_at
+            )
+        )
+        return [
+            NotificationRepository._add_notification(
+                db, user_id, "Место на занятии",
+                f"На занятии «{occurrence.title}» {occurrence.starts_at:%d.%m в %H:%M} освободилось место - "
+                f"вы записаны из листа ожидания",
+                'waitlist_promotion'
+            )
+            for user_id in promoted
+        ]
+    
+    @staticmethod
+    def join_waitlist(user_id: int, lesson_id: int, starts_at: datetime,
+                      idempotency_key: Optional[str] = None) -> Optional[int]:
+        """Постановка в лист ожидания занятия
+        
+        Возвращает место в очереди или None, если место успело освободиться
+        и пользователь сразу записан. Такой записи присваивается
+        idempotency_key запроса, чтобы его повтор получил 'replayed'.
+        """
+        db = SessionLocal()
+        try:
+            occurrence_id = BookingRepository._get_occurrence_id(db, lesson_id, starts_at)
+        finally:
+            db.close()
+        WaitlistRepository.enqueue('lesson', occurrence_id, user_id)
+        BookingRepository.promote_waitlist(occurrence_id)
+        position = WaitlistRepository.get_position('lesson', occurrence_id, user_id)
+        if position is None and idempotency_key:
+            BookingRepository._claim_idempotency_key(user_id, occurrence_id, idempotency_key)
+        return position
+    
+    @staticmethod
+    def _claim_idempotency_key(user_id: int, occurrence_id: int, idempotency_key: str):
+        """Ключ запроса для записи, созданной из листа ожидания (если у нее ключа нет)"""
+        db = SessionLocal()
+        try:
+            db.query(Booking).filter(
+                Booking.user_id == user_id,
+                Booking.occurrence_id == occurrence_id,
+                Booking.status == 'confirmed',
+                Booking.idempotency_key.is_(None)
+            ).update({Booking.idempotency_key: idempotency_key}, synchronize_session=False)
+            db.commit()
+        except IntegrityError:
+            # Ключ уже занят другой записью пользователя - повтор получит key_conflict
+            db.rollback()
+        except Exception as e:
+            db.rollback()
+            raise e
+        finally:
+            db.close()
+    
+    @staticmethod
+    def promote_waitlist(occurrence_id: int) -> List[int]:
+        db = SessionLocal()
+        try:
+            notifications = BookingRepository._promote_waitlist(db, occurrence_id)
+            db.commit()
+            NotificationRepository._publish_created(db, notifications)
+            return [notification.user_id for notification in notifications]
+        except Exception as e:
+            db.rollback()
+            raise e
+        finally:
+            db.close()
+    
+    @staticmethod
+    def cancel_booking(user_id: int, booking_id: int) -> bool:
+        """Отмена записи; освободившееся место в той же транзакции получает первый в очереди"""
+        db = SessionLocal()
+        try:
+            booking = db.query(Booking.occurrence_id).filter(
+                Booking.id == booking_id, Booking.user_id == user_id
+            ).first()
+            if booking is None:
+                return False
+            cancelled = db.query(Booking).filter(Booking.id == booking_id, Booking.status == 'confirmed').update(
+                {Booking.status: 'cancelled'}, synchronize_session=False
+            )
+            if not cancelled:
+                db.rollback()
+                return False
+            
+            notifications = []
+            if booking.occurrence_id is not None:
+                BookingRepository._release_seat(db, booking.occurrence_id)
+                notifications = BookingRepository._promote_waitlist(db, booking.occurrence_id)
+            db.commit()
+            NotificationRepository._publish_created(db, notifications)
+            return True
         except Exception as e:
             db.rollback()
             raise e
@@ -412,4 +970,463 @@ class BookingRepository:
                 db.refresh(booking)
             return bookings
         finally:
-            db.close() 
\ No newline at end of file
+            db.close() 
+
+class LessonOccurrenceRepository:
+    @staticmethod
+    def ensure_horizon(weeks: int = OCCURRENCE_HORIZON_WEEKS, lesson_id: Optional[int] = None) -> int:
+        """Создание занятий активных уроков на weeks недель вперед
+        
+        Уже созданные занятия читаются одним запросом по индексу
+        (lesson_id, starts_at), добавляются только недостающие.
+        Возвращает число созданных занятий.
+        """
+        now = datetime.now()
+        end = now + timedelta(weeks=weeks)
+        db = SessionLocal()
+        try:
+            lessons = db.query(Lesson.id, Lesson.day_of_week, Lesson.start_time).filter(Lesson.is_active == True)
+            existing = db.query(LessonOccurrence.lesson_id, LessonOccurrence.starts_at).filter(
+                LessonOccurrence.starts_at >= now,
+                LessonOccurrence.starts_at < end
+            )
+            if lesson_id is not None:
+                lessons = lessons.filter(Lesson.id == lesson_id)
+                existing = existing.filter(LessonOccurrence.lesson_id == lesson_id)
+            existing_keys = {(row.lesson_id, row.starts_at) for row in existing}
+            
+            missing = []
+            for lesson in lessons:
+                try:
+                    starts = occurrence_starts(lesson.day_of_week, lesson.start_time, now, end)
+                except (OccurrenceError, ValueError) as e:
+                    logger.warning(f"Урок {lesson.id}: не удалось построить занятия: {e}")
+                    continue
+                missing.extend((lesson.id, starts_at) for starts_at in starts if (lesson.id, starts_at) not in existing_keys)
+            
+            if not missing:
+                return 0
+            db.add_all(LessonOccurrence(lesson_id=key[0], starts_at=key[1], booked_count=0) for key in missing)
+            try:
+                db.commit()
+                return len(missing)
+            except IntegrityError:
+                # Часть занятий одновременно создала запись на них - добавляем по одному
+                db.rollback()
+            
+            created = 0
+            for missing_lesson_id, starts_at in missing:
+                db.add(LessonOccurrence(lesson_id=missing_lesson_id, starts_at=starts_at, booked_count=0))
+                try:
+                    db.commit()
+                    created += 1
+                except IntegrityError:
+                    db.rollback()
+            return created
+        finally:
+            db.close()
+    
+    @staticmethod
+    def get_upcoming(lesson_id: int, weeks: int = OCCURRENCE_HORIZON_WEEKS) -> List[Dict[str, Any]]:
+        """Ближайшие занятия урока со свободными местами
+        
+        Только чтение: занятия создает фоновая задача (ensure_horizon), а
+        еще не созданные занятия по расписанию отдаются с id = None.
+        """
+        now = datetime.now()
+        end = now + timedelta(weeks=weeks)
+        db = SessionLocal()
+        try:
+            lesson = db.query(Lesson.day_of_week, Lesson.start_time, Lesson.max_students).filter(
+                Lesson.id == lesson_id
+            ).first()
+            if lesson is None:
+                return []
+            
+            occurrences = {
+                occurrence.starts_at: occurrence
+                for occurrence in db.query(LessonOccurrence).filter(
+                    LessonOccurrence.lesson_id == lesson_id,
+                    LessonOccurrence.starts_at >= now,
+                    LessonOccurrence.starts_at < end
+                )
+            }
+            try:
+                scheduled = occurrence_starts(lesson.day_of_week, lesson.start_time, now, end)
+            except (OccurrenceError, ValueError) as e:
+                logger.warning(f"Урок {lesson_id}: не удалось построить занятия: {e}")
+                scheduled = []
+            
+            result = []
+            for starts_at in sorted(set(occurrences) | set(scheduled)):
+                occurrence = occurrences.get(starts_at)
+                booked_count = occurrence.booked_count if occurrence else 0
+                result.append({
+                    "id": occurrence.id if occurrence else None,
+                    "lesson_id": lesson_id,
+                    "starts_at": starts_at.isoformat(),
+                    "booked_count": booked_count,
+                    "max_students": lesson.max_students,
+                    "seats_left": max(0, (lesson.max_students or 0) - booked_count)
+                })
+            return result
+        finally:
+            db.close()
+    
+    @staticmethod
+    def get_roster(lesson_id: int, occurrence_id: int) -> Optional[List[Dict[str, Any]]]:
+        """Список записавшихся на занятие (по индексу (occurrence_id, status))
+        
+        None, если у урока нет такого занятия.
+        """
+        db = SessionLocal()
+        try:
+            occurrence = db.get(LessonOccurrence, occurrence_id)
+            if occurrence is None or occurrence.lesson_id != lesson_id:
+                return None
+            
+            rows = db.query(Booking.id, User.id, User.telegram_id, User.first_name, User.last_name, User.username).join(
+                User, User.id == Booking.user_id
+            ).filter(
+                Booking.occurrence_id == occurrence_id,
+                Booking.status == 'confirmed'
+            ).order_by(Booking.id).all()
+            
+            return [
+                {
+                    "booking_id": booking_id,
+                    "user_id": user_id,
+                    "telegram_id": telegram_id,
+                    "name": " ".join(part for part in (first_name, last_name) if part) or username
+                }
+                for booking_id, user_id, telegram_id, first_name, last_name, username in rows
+            ]
+        finally:
+            db.close()
+    
+    @staticmethod
+    def claim_due_reminders(lead: timedelta, window: timedelta, advance: bool = False) -> List[Dict[str, Any]]:
+        """Занятия, до которых осталось lead (± window), с получателями напоминания
+        
+        Занятие забирается условным UPDATE отметки об отправке, поэтому
+        напоминание уходит один раз, даже если проверка выполняется чаще
+        ширины окна или в нескольких процессах. Получатели - записавшиеся,
+        не отключившие напоминания о занятиях.
+        """
+        sent_at = LessonOccurrence.advance_reminder_sent_at if advance else LessonOccurrence.reminder_sent_at
+        now = datetime.now()
+        db = SessionLocal()
+        try:
+            due = db.query(LessonOccurrence.id, LessonOccurrence.starts_at, Lesson.title, Lesson.location).join(
+                Lesson, Lesson.id == LessonOccurrence.lesson_id
+            ).filter(
+                LessonOccurrence.starts_at >= now + lead - window,
+                LessonOccurrence.starts_at <= now + lead + window,
+                LessonOccurrence.booked_count > 0,
+                sent_at == None
+            ).all()
+            
+            claimed = []
+            for occurrence in due:
+                taken = db.query(LessonOccurrence).filter(
+                    LessonOccurrence.id == occurrence.id, sent_at == None
+                ).update({sent_at: now}, synchronize_session=False)
+                if not taken:
+                    continue
+                recipients = db.query(User.id, User.telegram_id).join(
+                    Booking, Booking.user_id == User.id
+                ).outerjoin(
+                    NotificationSettings, NotificationSettings.user_id == User.id
+                ).filter(
+                    Booking.occurrence_id == occurrence.id,
+                    Booking.status == 'confirmed',
+                    or_(NotificationSettings.lesson_reminders == None, NotificationSettings.lesson_reminders == True)
+                ).all()
+                claimed.append({
+                    "occurrence_id": occurrence.id,
+                    "title": occurrence.title,
+                    "location": occurrence.location,
+                    "starts_at": occurrence.starts_at,
+                    "recipients": [{"user_id": user_id, "telegram_id": telegram_id} for user_id, telegram_id in recipients]
+                })
+            db.commit()
+            return claimed
+        except Exception as e:
+            db.rollback()
+            raise e
+        finally:
+            db.close()
+
+class WaitlistRepository:
+    """Листы ожидания клубов ('club', clubs.id) и занятий ('lesson', lesson_occurrences.id)"""
+    
+    @staticmethod
+    def _queue(db: Session, resource_type: str, resource_id: int):
+        return db.query(WaitlistEntry).filter(
+            WaitlistEntry.resource_type == resource_type,
+            WaitlistEntry.resource_id == resource_id
+        )
+    
+    @staticmethod
+    def _promote(db: Session, resource_type: str, resource_id: int, take_seat: Callable[[], bool],
+                 release_seat: Callable[[], None], admit: Callable[[int], bool]) -> List[int]:
+        """Перевод первых в очереди на свободные места (в транзакции вызывающего)
+        
+        take_seat занимает место условным UPDATE, admit оформляет участие и
+        возвращает False, если пользователь уже участвует. Следующий в очереди
+        находится по индексу (resource_type, resource_id, id) за O(log n).
+        Возвращает ID переведенных пользователей.
+        """
+        promoted = []
+        while True:
+            entry = WaitlistRepository._queue(db, resource_type, resource_id).with_entities(
+                WaitlistEntry.id, WaitlistEntry.user_id
+            ).order_by(WaitlistEntry.id).first()
+            if entry is None or not take_seat():
+                return promoted
+            # Запись очереди мог уже забрать параллельный перевод
+            removed = db.query(WaitlistEntry).filter(WaitlistEntry.id == entry.id).delete(synchronize_session=False)
+            if removed and admit(entry.user_id):
+                promoted.append(entry.user_id)
+            else:
+                release_seat()
+    
+    @staticmethod
+    def enqueue(resource_type: str, resource_id: int, user_id: int) -> int:
+        """Постановка в очередь (повторная ничего не меняет); возвращает место в очереди"""
+        db = SessionLocal()
+        try:
+            db.add(WaitlistEntry(resource_type=resource_type, resource_id=resource_id, user_id=user_id))
+            try:
+                db.commit()
+            except IntegrityError:
+                db.rollback()
+            return WaitlistRepository._position(db, resource_type, resource_id, user_id)
+        finally:
+            db.close()
+    
+    @staticmethod
+    def _position(db: Session, resource_type: str, resource_id: int, user_id: int) -> Optional[int]:
+        queue = WaitlistRepository._queue(db, resource_type, resource_id)
+        entry_id = queue.filter(WaitlistEntry.user_id == user_id).with_entities(WaitlistEntry.id).scalar()
+        if entry_id is None:
+            return None
+        return queue.filter(WaitlistEntry.id <= entry_id).count()
+    
+    @staticmethod
+    def get_position(resource_type: str, resource_id: int, user_id: int) -> Optional[int]:
+        """Место пользователя в очереди (None - не в очереди)"""
+        db = SessionLocal()
+        try:
+            return WaitlistRepository._position(db, resource_type, resource_id, user_id)
+        finally:
+            db.close()
+    
+    @staticmethod
+    def remove(resource_type: str, resource_id: int, user_id: int) -> bool:
+        db = SessionLocal()
+        try:
+            removed = WaitlistRepository._queue(db, resource_type, resource_id).filter(
+                WaitlistEntry.user_id == user_id
+            ).delete(synchronize_session=False)
+            db.commit()
+            return removed > 0
+        except Exception as e:
+            db.rollback()
+            raise e
+        finally:
+            db.close()
+
+class CRMSyncRunRepository:
+    @staticmethod
+    def create_run(run: Dict[str, Any]) -> CRMSyncRun:
+        db = SessionLocal()
+        try:
+            sync_run = CRMSyncRun(**{**run, 'phases': json.dumps(run.get('phases', {}), ensure_ascii=False)})
+            db.add(sync_run)
+            db.commit()
+            db.refresh(sync_run)
+            return sync_run
+        except Exception as e:
+            db.rollback()
+            raise e
+        finally:
+            db.close()
+    
+    @staticmethod
+    def get_recent_runs(limit: int = 50, crm_type: Optional[str] = None) -> List[Dict[str, Any]]:
+        db = SessionLocal()
+        try:
+            query = db.query(CRMSyncRun)
+            if crm_type:
+                query = query.filter(CRMSyncRun.crm_type == crm_type)
+            runs = query.order_by(CRMSyncRun.started_at.desc()).limit(limit).all()
+            
+            return [
+                {
+                    'id': run.id,
+                    'crm_type': run.crm_type,
+                    'trigger': run.trigger,
+                    'status': run.status,
+                    'started_at': run.started_at.isoformat(),
+                    'finished_at': run.finished_at.isoformat(),
+                    'duration': run.duration,
+                    'records_fetched': run.records_fetched,
+                    'records_changed': run.records_changed,
+                    'records_failed': run.records_failed,
+                    'http_requests': run.http_requests,
+                    'http_retries': run.http_retries,
+                    'bytes_received': run.bytes_received,
+                    'phases': json.loads(run.phases) if run.phases else {},
+                    'error': run.error
+                }
+                for run in runs
+            ]
+        finally:
+            db.close()
+
+
+class JobLeaseRepository:
+    @staticmethod
+    def acquire(name: str, holder: str, ttl: float) -> bool:
+        """Захват или продление аренды фоновой задачи
+        
+        Условный UPDATE выполняется атомарно: аренду получает только ее
+        текущий владелец или любой процесс после истечения срока.
+        """
+        db = SessionLocal()
+        try:
+            now = datetime.now()
+            expires_at = now + timedelta(seconds=ttl)
+            
+            # Продление своей аренды
+            renewed = db.query(JobLease).filter(
+                JobLease.name == name,
+                JobLease.holder == holder,
+                JobLease.expires_at >= now
+            ).update({'heartbeat_at': now, 'expires_at': expires_at}, synchronize_session=False)
+            if renewed:
+                db.commit()
+                return True
+            
+            # Перехват истекшей аренды
+            taken = db.query(JobLease).filter(
+                JobLease.name == name,
+                JobLease.expires_at < now
+            ).update({
+                'holder': holder,
+                'generation': JobLease.generation + 1,
+                'acquired_at': now,
+                'heartbeat_at': now,
+                'expires_at': expires_at
+            }, synchronize_session=False)
+            if taken:
+                db.commit()
+                return True
+            
+            if db.query(JobLease).filter(JobLease.name == name).first() is not None:
+                return False
+            
+            # Аренды еще нет - создаем; при гонке побеждает первый INSERT
+            db.add(JobLease(name=name, holder=holder, acquired_at=now, heartbeat_at=now, expires_at=expires_at))
+            db.commit()
+            return True
+        except IntegrityError:
+            db.rollback()
+            return False
+        except Exception as e:
+            db.rollback()
+            raise e
+        finally:
+            db.close()
+    
+    @staticmethod
+    def release(name: str, holder: str) -> bool:
+        db = SessionLocal()
+        try:
+            released = db.query(JobLease).filter(
+                JobLease.name == name,
+                JobLease.holder == holder
+            ).update({'expires_at': datetime.now()}, synchronize_session=False)
+            db.commit()
+            return bool(released)
+        except Exception as e:
+            db.rollback()
+            raise e
+        finally:
+            db.close()
+    
+    @staticmethod
+    def get_all() -> List[Dict[str, Any]]:
+        db = SessionLocal()
+        try:
+            now = datetime.now()
+            return [
+                {
+                    'name': lease.name,
+                    'holder': lease.holder,
+                    'generation': lease.generation,
+                    'acquired_at': lease.acquired_at.isoformat(),
+                    'heartbeat_at': lease.heartbeat_at.isoformat(),
+                    'expires_at': lease.expires_at.isoformat(),
+                    'active': lease.expires_at >= now
+                }
+                for lease in db.query(JobLease).order_by(JobLease.name).all()
+            ]
+        finally:
+            db.close()
+
+
+class BotStateRepository:
+    @staticmethod
+    def get(key: str) -> Optional[Tuple[Optional[str], Dict[str, Any]]]:
+        """Состояние и данные FSM по ключу или None, если записи нет"""
+        db = SessionLocal()
+        try:
+            row = db.query(BotState).filter(BotState.key == key).first()
+            if row is None:
+                return None
+            return row.state, json.loads(row.data) if row.data else {}
+        finally:
+            db.close()
+    
+    @staticmethod
+    def save(key: str, state: Optional[str], data: Dict[str, Any]) -> None:
+        """Сохранение состояния и данных FSM; пустая запись удаляется"""
+        db = SessionLocal()
+        try:
+            if state is None and not data:
+                db.query(BotState).filter(BotState.key == key).delete(synchronize_session=False)
+                db.commit()
+                return
+            
+            payload = json.dumps(data, ensure_ascii=False) if data else None
+            updated = db.query(BotState).filter(BotState.key == key).update(
+                {'state': state, 'data': payload}, synchronize_session=False
+            )
+            if not updated:
+                db.add(BotState(key=key, state=state, data=payload))
+            db.commit()
+        except IntegrityError:
+            # Запись одновременно создана другим экземпляром бота - обновляем ее
+            db.rollback()
+            db.query(BotState).filter(BotState.key == key).update(
+                {'state': state, 'data': payload}, synchronize_session=False
+            )
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            raise e
+        finally:
+            db.close()
+
+
+class DataVersionRepository:
+    @staticmethod
+    def get_all() -> Dict[str, int]:
+        """Текущие версии ресурсов (увеличиваются при изменении данных)"""
+        db = SessionLocal()
+        try:
+            return {row.name: row.version for row in db.query(DataVersion).all()}
+        finally:
+            db.close()
@@ -0,0 +1,69 @@
+"""
+Версии ресурсов для инвалидации кэшей
+При любом изменении занятий (и других отслеживаемых моделей) через
+SessionLocal версия ресурса увеличивается в той же транзакции
+"""
+
+import itertools
+from typing import Callable, Iterable, List
+
+from sqlalchemy import event, func
+
+from .database import SessionLocal, upsert
+from .models import Club, DataVersion, Lesson, Teacher, Test
+
+# Модель -> ресурс, версия которого меняется при ее изменении
+VERSIONED_MODELS = {
+    Lesson: 'lessons',
+    Teacher: 'lessons',  # имя преподавателя входит в расписание
+    Club: 'clubs',  # вступление и выход меняют только счетчик мест и версию не увеличивают
+    Test: 'tests'
+}
+
+# Обработчики, вызываемые после commit с именами измененных ресурсов
+_commit_listeners: List[Callable[[Iterable[str]], None]] = []
+
+def on_versions_committed(listener: Callable[[Iterable[str]], None]):
+    """Подписка на изменение версий в этом процессе (сразу после commit)"""
+    _commit_listeners.append(listener)
+
+def bump_version(connection, resource: str):
+    """Увеличение версии ресурса одним upsert (первое увеличение создает строку)"""
+    table = DataVersion.__table__
+    statement = upsert(connection, table).values(name=resource, version=1, updated_at=func.now())
+    connection.execute(statement.on_conflict_do_update(
+        index_elements=[table.c.name],
+        set_={table.c.version: table.c.version + 1, table.c.updated_at: func.now()}
+    ))
+
+def bump_session_version(session, resource: str):
+    """Увеличение версии ресурса при изменении массовым UPDATE (минуя flush)"""
+    bump_version(session.connection(), resource)
+    session.info.setdefault('bumped_resources', set()).add(resource)
+
+@event.listens_for(SessionLocal, 'before_flush')
+def collect_changed_resources(session, flush_context, instances):
+    changed = session.info.setdefault('changed_resources', set())
+    for obj in itertools.chain(session.new, session.dirty, session.deleted):
+        resource = VERSIONED_MODELS.get(type(obj))
+        if resource and (obj not in session.dirty or session.is_modified(obj)):
+            changed.add(resource)
+
+@event.listens_for(SessionLocal, 'after_flush')
+def bump_changed_resources(session, flush_context):
+    changed = session.info.pop('changed_resources', None)
+    for resource in sorted(changed or ()):
+        bump_version(session.connection(), resource)
+    if changed:
+        session.info.setdefault('bumped_resources', set()).update(changed)
+
+@event.listens_for(SessionLocal, 'after_commit')
+def notify_committed_resources(session):
+    bumped = session.info.pop('bumped_resources', None)
+    if bumped:
+        for listener in _commit_listeners:
+            listener(bumped)
+
+@event.listens_for(SessionLocal, 'after_rollback')
+def forget_rolled_back_resources(session):
+    session.info.pop('bumped_resources', None)
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Тестирование очереди обновлений бота с разделами по чатам
+Проверяет сохранение порядка сообщений в чате и повторную доставку
+неподтвержденных обновлений
+"""
+
+import asyncio
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime
+
+from aiogram import Bot, Dispatcher, types
+
+from bot.sharding import enqueue_update, run_worker, supervise_workers, worker_partitions
+from bot.update_queue import MemoryUpdateQueue, SQLiteUpdateQueue
+
+CHATS = 20
+MESSAGES_PER_CHAT = 15
+
+def make_update(update_id: int, chat_id: int, text: str) -> types.Update:
+    return types.Update(
+        update_id=update_id,
+        message=types.Message(
+            message_id=update_id,
+            date=datetime.now(),
+            chat=types.Chat(id=chat_id, type='private'),
+            from_user=types.User(id=chat_id, is_bot=False, first_name='Тест'),
+            text=text
+        )
+    )
+
+class BotShardingTester:
+    """Тестер шардированной обработки обновлений"""
+    
+    def __init__(self):
+        self.test_results = []
+        self.bot = Bot(token='42:TEST')
+    
+    def log_test(self, test_name: str, success: bool, message: str = ""):
+        """Логирование результата теста"""
+        status = "✅ ПРОЙДЕН" if success else "❌ ПРОВАЛЕН"
+        print(f"{status} {test_name}")
+        if message:
+            print(f"   {message}")
+        
+        self.test_results.append({
+            "test": test_name,
+            "success": success,
+            "message": message
+        })
+    
+    async def process_all(self, queue, workers: int) -> dict:
+        """Обработка всех сообщений несколькими обработчиками"""
+        received = {}
+        dp = Dispatcher()
+        
+        @dp.message()
+        async def handler(message: types.Message):
+            # Случайная задержка перемешала бы порядок без разделов
+            await asyncio.sleep(random.uniform(0, 0.002))
+            received.setdefault(message.chat.id, []).append(int(message.text))
+        
+        update_id = 0
+        for number in range(MESSAGES_PER_CHAT):
+            for chat_id in range(1, CHATS + 1):
+                update_id += 1
+                await enqueue_update(queue, make_update(update_id, chat_id, str(number)))
+        
+        tasks = [
+            asyncio.create_task(run_worker(dp, self.bot, queue, worker_partitions(index, workers, queue.partitions)))
+            for index in range(workers)
+        ]
+        total = CHATS * MESSAGES_PER_CHAT
+        # Последнее сообщение подтверждается после обработчика: ждем и подтверждения
+        for _ in range(500):
+            if sum(len(messages) for messages in received.values()) >= total and not sum(queue.get_stats()['pending']):
+                break
+            await asyncio.sleep(0.02)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return received
+    
+    def is_ordered(self, received: dict) -> bool:
+        expected = list(range(MESSAGES_PER_CHAT))
+        return len(received) == CHATS and all(messages == expected for messages in received.values())
+    
+    async def test_memory_queue_ordering(self) -> bool:
+        """Порядок сообщений в каждом чате сохраняется (очередь в памяти)"""
+        return self.is_ordered(await self.process_all(MemoryUpdateQueue(partitions=8), workers=4))
+    
+    async def test_sqlite_queue_ordering(self) -> bool:
+        """Порядок сообщений в каждом чате сохраняется (очередь SQLite)"""
+        queue = SQLiteUpdateQueue(os.path.join(tempfile.mkdtemp(), 'updates.db'), partitions=8)
+        received = await self.process_all(queue, workers=4)
+        return self.is_ordered(received) and sum(queue.get_stats()['pending']) == 0
+    
+    async def test_sqlite_redelivery(self) -> bool:
+        """Неподтвержденное обновление доставляется повторно"""
+        path = os.path.join(tempfile.mkdtemp(), 'updates.db')
+        queue = SQLiteUpdateQueue(path, partitions=2)
+        await enqueue_update(queue, make_update(1, 7, 'привет'))
+        
+        first = await queue.fetch(1, timeout=0.1)
+        # Обработчик "упал" без подтверждения - новый экземпляр очереди видит обновление
+        second = await SQLiteUpdateQueue(path, partitions=2).fetch(1, timeout=0.1)
+        await queue.ack(1, [item_id for item_id, _ in second])
+        third = await queue.fetch(1, timeout=0.1)
+        return len(first) == 1 and first == second and third == []
+    
+    async def test_idle_backoff(self) -> bool:
+        """Пустой раздел опрашивается все реже, новое обновление забирается сразу"""
+        queue = SQLiteUpdateQueue(os.path.join(tempfile.mkdtemp(), 'updates.db'), partitions=2,
+                                  poll_interval=0.01, max_poll_interval=0.2)
+        polls = []
+        fetch = queue._fetch
+        
+        def counting_fetch(partition, limit):
+            polls.append(partition)
+            return fetch(partition, limit)
+        
+        queue._fetch = counting_fetch
+        idle = await queue.fetch(1, timeout=1.0)
+        idle_polls = len(polls)
+        
+        await enqueue_update(queue, make_update(1, 7, 'привет'))
+        items = await queue.fetch(1, timeout=1.0)
+        await queue.ack(1, [item_id for item_id, _ in items])
+        # Без паузы было бы около 100 опросов за секунду
+        return idle == [] and idle_polls <= 12 and len(items) == 1 and 1 not in queue._idle_delay
+    
+    async def test_worker_supervisor(self) -> bool:
+        """Упавший обработчик перезапускается для тех же разделов"""
+        class FakeProcess:
+            def __init__(self, alive: bool):
+                self.alive = alive
+                self.exitcode = None if alive else 1
+            
+            def is_alive(self) -> bool:
+                return self.alive
+        
+        started = []
+        
+        def start_worker(index: int) -> FakeProcess:
+            started.append(index)
+            return FakeProcess(alive=True)
+        
+        processes = {0: FakeProcess(alive=True), 1: FakeProcess(alive=False)}
+        supervisor = asyncio.create_task(supervise_workers(processes, start_worker, 2, 8, interval=0.05))
+        await asyncio.sleep(0.2)
+        supervisor.cancel()
+        await asyncio.gather(supervisor, return_exceptions=True)
+        return started == [1] and all(process.is_alive() for process in processes.values())
+    
+    async def run_all_tests(self):
+        """Запуск всех тестов"""
+        print("🧪 ТЕСТИРОВАНИЕ ШАРДИРОВАННОЙ ОБРАБОТКИ ОБНОВЛЕНИЙ")
+        print("=" * 50)
+        
+        tests = [
+            ("Порядок в памяти", self.test_memory_queue_ordering),
+            ("Порядок в SQLite", self.test_sqlite_queue_ordering),
+            ("Повторная доставка", self.test_sqlite_redelivery),
+            ("Пауза опроса пустого раздела", self.test_idle_backoff),
+            ("Перезапуск обработчика", self.test_worker_supervisor)
+        ]
+        for test_name, test in tests:
+            try:
+                self.log_test(test_name, await test(), test.__doc__)
+            except Exception as e:
+                self.log_test(test_name, False, f"Исключение: {e}")
+        await self.bot.session.close()
+        
+        passed_tests = sum(1 for result in self.test_results if result["success"])
+        total_tests = len(self.test_results)
+        print(f"\nПройдено: {passed_tests} из {total_tests}")
+        return passed_tests == total_tests
+
+async def main():
+    """Главная функция тестирования"""
+    tester = BotShardingTester()
+    success = await tester.run_all_tests()
+    sys.exit(0 if success else 1)
+
+if __name__ == "__main__":
+    asyncio.run(main())
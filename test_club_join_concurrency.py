@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Нагрузочная проверка вступления в клубы
+Много параллельных запросов к /clubs/{club_id}/join во временной БД:
+число участников не должно превысить max_participants, остальные
+попадают в лист ожидания
+"""
+
+import os
+import sys
+import tempfile
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+# Временная БД, чтобы не трогать рабочую
+os.environ['DATABASE_URL'] = f"sqlite:///{tempfile.mkdtemp()}/club_join_test.db"
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from backend.routes_db import router
+from db.database import SessionLocal
+from db.init_db import init_db
+from db.models import Club, ClubMembership, WaitlistEntry
+from db.repositories import ClubRepository, NotificationRepository, UserRepository
+
+USERS = 60
+REQUESTS_PER_USER = 3
+THREADS = 32
+
+class ClubJoinTester:
+    """Тестер параллельного вступления в клубы"""
+
+    def __init__(self):
+        self.test_results = []
+        app = FastAPI()
+        app.include_router(router)
+        self.client = TestClient(app)
+
+    def log_test(self, test_name: str, success: bool, message: str = ""):
+        """Логирование результата теста"""
+        status = "✅ ПРОЙДЕН" if success else "❌ ПРОВАЛЕН"
+        print(f"{status} {test_name}")
+        if message:
+            print(f"   {message}")
+
+        self.test_results.append({
+            "test": test_name,
+            "success": success,
+            "message": message
+        })
+
+    def create_club(self, max_participants: int) -> int:
+        db = SessionLocal()
+        try:
+            club = Club(name=f"Клуб на {max_participants}", max_participants=max_participants,
+                        day_of_week="Friday", start_time="19:00")
+            db.add(club)
+            db.commit()
+            return club.id
+        finally:
+            db.close()
+
+    def club_state(self, club_id: int) -> tuple:
+        """(счетчик участников, число активных записей участия, длина листа ожидания)"""
+        db = SessionLocal()
+        try:
+            counter = db.query(Club.participants_count).filter(Club.id == club_id).scalar()
+            members = db.query(ClubMembership).filter(
+                ClubMembership.club_id == club_id,
+                ClubMembership.is_active == True
+            ).count()
+            waiting = db.query(WaitlistEntry).filter(
+                WaitlistEntry.resource_type == 'club',
+                WaitlistEntry.resource_id == club_id
+            ).count()
+            return counter, members, waiting
+        finally:
+            db.close()
+
+    def join_all(self, club_id: int) -> Counter:
+        """Каждый пользователь несколько раз параллельно пытается вступить"""
+        def join(telegram_id: str) -> int:
+            return self.client.post(f'/clubs/{club_id}/join', params={'user_id': telegram_id}).status_code
+
+        requests = [f"club_user_{i}" for i in range(USERS)] * REQUESTS_PER_USER
+        with ThreadPoolExecutor(max_workers=THREADS) as executor:
+            return Counter(executor.map(join, requests))
+
+    def test_capacity_not_exceeded(self) -> bool:
+        """Участников не больше max_participants, остальные - в листе ожидания"""
+        club_id = self.create_club(max_participants=15)
+        statuses = self.join_all(club_id)
+        counter, members, waiting = self.club_state(club_id)
+        print(f"   ответы: {dict(statuses)}, участников: {members}, счетчик: {counter}, ожидают: {waiting}")
+        return (statuses[200] == 15 and members == 15 and counter == 15
+                and waiting == USERS - 15 and set(statuses) <= {200, 202, 409})
+
+    def test_everyone_fits(self) -> bool:
+        """Если мест хватает, каждый вступает ровно один раз"""
+        club_id = self.create_club(max_participants=USERS)
+        statuses = self.join_all(club_id)
+        counter, members, waiting = self.club_state(club_id)
+        print(f"   ответы: {dict(statuses)}, участников: {members}, счетчик: {counter}, ожидают: {waiting}")
+        return statuses[200] >= USERS and members == USERS and counter == USERS and waiting == 0
+
+    def test_waitlist_promotion(self) -> bool:
+        """Освободившиеся места получают первые в листе ожидания с уведомлением"""
+        club_id = self.create_club(max_participants=5)
+        users = [UserRepository.get_by_telegram_id(f"club_user_{i}") for i in range(8)]
+        for user in users:
+            if ClubRepository.join_club(user.id, club_id) == 'full':
+                ClubRepository.join_waitlist(user.id, club_id)
+
+        ClubRepository.leave_club(users[0].id, club_id)
+        ClubRepository.set_capacity(club_id, 6)
+        counter, members, waiting = self.club_state(club_id)
+        promoted = [ClubRepository.is_member(user.id, club_id) for user in users[5:]]
+        notified = [
+            any(n.notification_type == 'waitlist_promotion' for n in NotificationRepository.get_user_notifications(user.id))
+            for user in users[5:]
+        ]
+        print(f"   участников: {members}, счетчик: {counter}, ожидают: {waiting}, приняты: {promoted}")
+        return counter == members == 6 and waiting == 1 and promoted == [True, True, False] and notified == promoted
+
+    def run_all_tests(self):
+        """Запуск всех тестов"""
+        print("🧪 ТЕСТИРОВАНИЕ ПАРАЛЛЕЛЬНОГО ВСТУПЛЕНИЯ В КЛУБЫ")
+        print("=" * 50)
+
+        init_db()
+        for i in range(USERS):
+            UserRepository.create_user(f"club_user_{i}")
+
+        tests = [
+            ("Лимит участников", self.test_capacity_not_exceeded),
+            ("Без повторного вступления", self.test_everyone_fits),
+            ("Лист ожидания", self.test_waitlist_promotion)
+        ]
+        for test_name, test in tests:
+            try:
+                self.log_test(test_name, test(), test.__doc__)
+            except Exception as e:
+                self.log_test(test_name, False, f"Исключение: {e}")
+
+        passed_tests = sum(1 for result in self.test_results if result["success"])
+        total_tests = len(self.test_results)
+        print(f"\nПройдено: {passed_tests} из {total_tests}")
+        return passed_tests == total_tests
+
+def main():
+    """Главная функция тестирования"""
+    tester = ClubJoinTester()
+    success = tester.run_all_tests()
+    sys.exit(0 if success else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Тестирование устойчивости HTTP-клиента CRM/LMS
+Поднимает локальный фейковый Moodle и проверяет повторы, Retry-After,
+выключатель, ограничение частоты запросов и потоковый разбор ответов
+"""
+
+import asyncio
+import json
+import sys
+import time
+from typing import List
+
+from aiohttp import web
+
+from backend.crm_integration import MoodleIntegration
+from backend.crm_http import CRMRequestError, CircuitOpenError, _host_states
+
+class FakeLMS:
+    """Фейковый Moodle, отвечающий по заранее заданному сценарию"""
+
+    def __init__(self):
+        self.responses: List[web.Response] = []
+        self.default_status = 200
+        self.body = None
+        self.delay = 0
+        self.hits = 0
+        self.runner = None
+        self.port = None
+
+    def script(self, *statuses, headers=None):
+        """Задать последовательность статусов ответов"""
+        self.responses = [
+            web.json_response([], status=status, headers=headers if status != 200 else None)
+            for status in statuses
+        ]
+
+    async def handler(self, request: web.Request) -> web.Response:
+        self.hits += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.body is not None:
+            return web.Response(body=self.body, content_type='application/json')
+        if self.responses:
+            response = self.responses.pop(0)
+            if response.status == 200:
+                return web.json_response([{'id': 1, 'username': 'student', 'firstname': 'Иван', 'lastname': 'Петров'}])
+            return response
+        return web.json_response([], status=self.default_status)
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/webservice/rest/server.php', self.handler)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+class CRMResilienceTester:
+    """Тестер устойчивого клиента CRM/LMS"""
+
+    def __init__(self):
+        self.lms = FakeLMS()
+        self.test_results = []
+
+    def log_test(self, test_name: str, success: bool, message: str = ""):
+        """Логирование результата теста"""
+        status = "✅ ПРОЙДЕН" if success else "❌ ПРОВАЛЕН"
+        print(f"{status} {test_name}")
+        if message:
+            print(f"   {message}")
+
+        self.test_results.append({
+            "test": test_name,
+            "success": success,
+            "message": message
+        })
+
+    def make_integration(self, **overrides) -> MoodleIntegration:
+        # Сбрасываем общее состояние хоста между тестами
+        _host_states.clear()
+        self.lms.hits = 0
+        config = {
+            'base_url': f'http://127.0.0.1:{self.lms.port}',
+            'webservice_token': 'test',
+            'course_id': 1,
+            'timeout': 5,
+            'max_retries': 3,
+            'backoff_base': 0.01,
+            'backoff_max': 2,
+            'failure_threshold': 3,
+            'reset_timeout': 60,
+            'rate_limit': 100,
+            'rate_burst': 100
+        }
+        config.update(overrides)
+        return MoodleIntegration(config)
+
+    async def test_retry_on_server_error(self) -> bool:
+        """Повтор при 503 и успешный ответ"""
+        self.lms.script(503, 503, 200)
+        async with self.make_integration() as crm:
+            students = await crm.get_students()
+            state = crm.get_http_state()
+        return len(students) == 1 and self.lms.hits == 3 and state['retries'] == 2
+
+    async def test_retry_after(self) -> bool:
+        """Соблюдение заголовка Retry-After при 429"""
+        self.lms.script(429, 200, headers={'Retry-After': '1'})
+        started = time.monotonic()
+        async with self.make_integration() as crm:
+            students = await crm.get_students()
+        return len(students) == 1 and time.monotonic() - started >= 1
+
+    async def test_errors_are_raised(self) -> bool:
+        """Ошибка CRM/LMS не превращается в пустой список"""
+        self.lms.script(500, 500, 500, 500)
+        async with self.make_integration(failure_threshold=10) as crm:
+            try:
+                await crm.get_students()
+            except CRMRequestError as e:
+                return e.status == 500
+        return False
+
+    async def test_circuit_breaker(self) -> bool:
+        """Выключатель размыкается и перестает обращаться к хосту"""
+        self.lms.script(500, 500, 500)
+        async with self.make_integration(max_retries=5, failure_threshold=3) as crm:
+            try:
+                await crm.get_students()
+            except CircuitOpenError:
+                pass
+            hits_after_open = self.lms.hits
+            try:
+                await crm.get_students()
+            except CircuitOpenError:
+                state = crm.get_http_state()
+                return hits_after_open == 3 and self.lms.hits == 3 and state['circuit']['state'] == 'open'
+        return False
+
+    async def test_cancelled_trial(self) -> bool:
+        """Отмененный пробный запрос не блокирует хост навсегда"""
+        self.lms.script(500)
+        async with self.make_integration(max_retries=0, failure_threshold=1, reset_timeout=0.2) as crm:
+            try:
+                await crm.get_students()
+            except CRMRequestError:
+                pass
+            await asyncio.sleep(0.3)
+
+            self.lms.delay = 1
+            trial = asyncio.create_task(crm.get_students())
+            await asyncio.sleep(0.2)
+            trial.cancel()
+            try:
+                await trial
+            except asyncio.CancelledError:
+                pass
+            finally:
+                self.lms.delay = 0
+
+            self.lms.script(200)
+            students = await crm.get_students()
+        return len(students) == 1
+
+    async def test_long_retry_after(self) -> bool:
+        """Retry-After дольше backoff_max размыкает выключатель до указанного времени"""
+        self.lms.script(503, headers={'Retry-After': '120'})
+        async with self.make_integration(backoff_max=2) as crm:
+            try:
+                await crm.get_students()
+            except CircuitOpenError as e:
+                state = crm.get_http_state()
+                return (e.retry_after > 100 and self.lms.hits == 1
+                        and state['circuit']['state'] == 'open' and state['circuit']['retry_after'] > 100)
+        return False
+
+    async def test_rate_limit(self) -> bool:
+        """Ограничение частоты запросов к хосту"""
+        self.lms.script(*([200] * 10))
+        started = time.monotonic()
+        async with self.make_integration(rate_limit=10, rate_burst=1) as crm:
+            await asyncio.gather(*[crm.get_students() for _ in range(10)])
+        # 10 запросов при 10 req/s и burst=1 занимают не меньше ~0.9 с
+        return time.monotonic() - started >= 0.85
+
+    async def test_streaming_large_response(self) -> bool:
+        """Потоковый разбор большого списка студентов"""
+        users = [
+            {'id': i, 'username': f'student{i}', 'firstname': 'Иван', 'lastname': 'Петров', 'email': f's{i}@example.com'}
+            for i in range(20000)
+        ]
+        self.lms.body = json.dumps(users, ensure_ascii=False).encode('utf-8')
+        try:
+            async with self.make_integration() as crm:
+                count = 0
+                last_id = None
+                async for student in crm.iter_students():
+                    count += 1
+                    last_id = student['id']
+        finally:
+            self.lms.body = None
+        return count == len(users) and last_id == '19999'
+
+    async def test_bulk_progress(self) -> bool:
+        """Прогресс всего курса одним запросом"""
+        usergrades = [
+            {'userid': i, 'gradeitems': [
+                {'itemtype': 'mod', 'graderaw': 80.0},
+                {'itemtype': 'mod', 'graderaw': None},
+                {'itemtype': 'course', 'graderaw': 40.0}
+            ]}
+            for i in range(1000)
+        ]
+        self.lms.body = json.dumps({'usergrades': usergrades, 'warnings': []}).encode('utf-8')
+        try:
+            async with self.make_integration() as crm:
+                progress = [entry async for entry in crm.iter_bulk_progress()]
+        finally:
+            self.lms.body = None
+        return (
+            len(progress) == 1000 and self.lms.hits == 1
+            and all(entry['completion_percentage'] == 50 for entry in progress)
+        )
+
+    async def test_progress_definition(self) -> bool:
+        """Прогресс студента по вебхуку считается так же, как в пакетной загрузке"""
+        usergrades = [{'userid': 7, 'gradeitems': [
+            {'itemtype': 'mod', 'graderaw': 80.0},
+            {'itemtype': 'mod', 'graderaw': None},
+            {'itemtype': 'course', 'graderaw': 40.0}
+        ]}]
+        self.lms.body = json.dumps({'usergrades': usergrades, 'warnings': []}).encode('utf-8')
+        try:
+            async with self.make_integration() as crm:
+                bulk = [entry async for entry in crm.iter_bulk_progress()]
+                single = await crm.get_student_progress('7')
+        finally:
+            self.lms.body = None
+        return bulk == [single] and single['completion_percentage'] == 50
+
+    async def test_moodle_exception(self) -> bool:
+        """Ошибка веб-сервиса Moodle (ответ 200 с exception) не разбирается как список"""
+        self.lms.body = json.dumps({
+            'exception': 'webservice_access_exception', 'errorcode': 'accessexception', 'message': 'Access control exception'
+        }).encode('utf-8')
+        try:
+            async with self.make_integration() as crm:
+                await crm.get_students_by_ids(['1', '2'])
+        except CRMRequestError as e:
+            return 'accessexception' in str(e)
+        finally:
+            self.lms.body = None
+        return False
+
+    async def run_all_tests(self):
+        """Запуск всех тестов"""
+        print("🧪 ТЕСТИРОВАНИЕ УСТОЙЧИВОСТИ CRM/LMS КЛИЕНТА")
+        print("=" * 50)
+
+        await self.lms.start()
+        try:
+            tests = [
+                ("Повтор при ошибке сервера", self.test_retry_on_server_error),
+                ("Retry-After при 429", self.test_retry_after),
+                ("Ошибки не скрываются", self.test_errors_are_raised),
+                ("Выключатель", self.test_circuit_breaker),
+                ("Отмена пробного запроса", self.test_cancelled_trial),
+                ("Долгий Retry-After", self.test_long_retry_after),
+                ("Ограничение частоты", self.test_rate_limit),
+                ("Потоковый разбор", self.test_streaming_large_response),
+                ("Пакетный прогресс", self.test_bulk_progress),
+                ("Единый расчет прогресса", self.test_progress_definition),
+                ("Ошибка веб-сервиса Moodle", self.test_moodle_exception)
+            ]
+            for test_name, test in tests:
+                try:
+                    self.log_test(test_name, await test(), test.__doc__)
+                except Exception as e:
+                    self.log_test(test_name, False, f"Исключение: {e}")
+        finally:
+            await self.lms.stop()
+
+        passed_tests = sum(1 for result in self.test_results if result["success"])
+        total_tests = len(self.test_results)
+        print(f"\nПройдено: {passed_tests} из {total_tests}")
+        return passed_tests == total_tests
+
+async def main():
+    """Главная функция тестирования"""
+    tester = CRMResilienceTester()
+    success = await tester.run_all_tests()
+    sys.exit(0 if success else 1)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Тестирование выбора лидера для фоновых задач
+Несколько участников конкурируют за одну аренду во временной БД
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+# Временная БД, чтобы не трогать рабочую
+os.environ['DATABASE_URL'] = f"sqlite:///{tempfile.mkdtemp()}/leader_test.db"
+
+from db.init_db import init_db
+from db.leader import LeaderElection
+from db.repositories import JobLeaseRepository
+
+class LeaderElectionTester:
+    """Тестер выбора лидера"""
+
+    def __init__(self):
+        self.test_results = []
+
+    def log_test(self, test_name: str, success: bool, message: str = ""):
+        """Логирование результата теста"""
+        status = "✅ ПРОЙДЕН" if success else "❌ ПРОВАЛЕН"
+        print(f"{status} {test_name}")
+        if message:
+            print(f"   {message}")
+
+        self.test_results.append({
+            "test": test_name,
+            "success": success,
+            "message": message
+        })
+
+    def make_job(self, running: list):
+        """Задача, отмечающая, сколько ее копий выполняется одновременно"""
+        async def job():
+            running.append(1)
+            try:
+                await asyncio.sleep(3600)
+            finally:
+                running.pop()
+        return job
+
+    async def test_single_leader(self) -> bool:
+        """Из нескольких участников задачу выполняет ровно один"""
+        running = []
+        electors = [LeaderElection('single', ttl=1.5, renew_interval=0.2) for _ in range(5)]
+        for elector in electors:
+            elector.start(self.make_job(running))
+
+        max_running = 0
+        for _ in range(10):
+            await asyncio.sleep(0.1)
+            max_running = max(max_running, len(running))
+        leaders = sum(1 for elector in electors if elector.is_leader)
+
+        for elector in electors:
+            await elector.stop()
+        return max_running == 1 and leaders == 1 and not running
+
+    async def test_failover_on_stop(self) -> bool:
+        """После остановки лидера задачу подхватывает другой участник"""
+        running = []
+        first = LeaderElection('failover', ttl=1.5, renew_interval=0.2)
+        second = LeaderElection('failover', ttl=1.5, renew_interval=0.2)
+        first.start(self.make_job(running))
+        await asyncio.sleep(0.2)
+        second.start(self.make_job(running))
+        await asyncio.sleep(0.3)
+        was_first = first.is_leader and not second.is_leader
+
+        await first.stop()
+        await asyncio.sleep(0.5)
+        took_over = second.is_leader and len(running) == 1
+
+        await second.stop()
+        return was_first and took_over
+
+    async def test_job_restart(self) -> bool:
+        """Упавшая задача перезапускается, лидер остается в выборах"""
+        starts = []
+
+        async def job():
+            starts.append(1)
+            if len(starts) < 3:
+                raise RuntimeError("сбой задачи")
+            await asyncio.sleep(3600)
+
+        elector = LeaderElection('restart', ttl=1.5, renew_interval=0.1)
+        elector.start(job)
+        await asyncio.sleep(0.6)
+        alive = elector.running and elector.is_leader
+        await elector.stop()
+        return alive and len(starts) == 3 and elector.job_restarts == 2
+
+    async def test_expired_lease_takeover(self) -> bool:
+        """Аренда упавшего процесса перехватывается только после истечения"""
+        assert JobLeaseRepository.acquire('crashed', 'dead-process', ttl=1)
+        blocked = not JobLeaseRepository.acquire('crashed', 'new-process', ttl=1)
+        time.sleep(1.1)
+        taken = JobLeaseRepository.acquire('crashed', 'new-process', ttl=1)
+
+        lease = next(lease for lease in JobLeaseRepository.get_all() if lease['name'] == 'crashed')
+        return blocked and taken and lease['holder'] == 'new-process' and lease['generation'] == 2
+
+    async def run_all_tests(self):
+        """Запуск всех тестов"""
+        print("🧪 ТЕСТИРОВАНИЕ ВЫБОРА ЛИДЕРА")
+        print("=" * 50)
+
+        init_db()
+        tests = [
+            ("Единственный лидер", self.test_single_leader),
+            ("Передача лидерства", self.test_failover_on_stop),
+            ("Перезапуск задачи", self.test_job_restart),
+            ("Перехват истекшей аренды", self.test_expired_lease_takeover)
+        ]
+        for test_name, test in tests:
+            try:
+                self.log_test(test_name, await test(), test.__doc__)
+            except Exception as e:
+                self.log_test(test_name, False, f"Исключение: {e}")
+
+        passed_tests = sum(1 for result in self.test_results if result["success"])
+        total_tests = len(self.test_results)
+        print(f"\nПройдено: {passed_tests} из {total_tests}")
+        return passed_tests == total_tests
+
+async def main():
+    """Главная функция тестирования"""
+    tester = LeaderElectionTester()
+    success = await tester.run_all_tests()
+    sys.exit(0 if success else 1)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Проверка записи на урок POST /book во временной БД: лист ожидания,
+место, освободившееся во время постановки в очередь, и повтор запроса
+с тем же Idempotency-Key
+"""
+
+import os
+import sys
+import tempfile
+
+# Временная БД, чтобы не трогать рабочую
+os.environ['DATABASE_URL'] = f"sqlite:///{tempfile.mkdtemp()}/lesson_booking_test.db"
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from backend.auth import create_telegram_token
+from backend.routes_secure import router
+from db.database import SessionLocal
+from db.init_db import init_db
+from db.models import Lesson
+from db.repositories import BookingRepository, UserRepository
+
+class LessonBookingTester:
+    """Тестер записи на урок"""
+
+    def __init__(self):
+        self.test_results = []
+        app = FastAPI()
+        app.include_router(router, prefix="/api/v1")
+        self.client = TestClient(app)
+
+    def log_test(self, test_name: str, success: bool, message: str = ""):
+        """Логирование результата теста"""
+        status = "✅ ПРОЙДЕН" if success else "❌ ПРОВАЛЕН"
+        print(f"{status} {test_name}")
+        if message:
+            print(f"   {message}")
+
+        self.test_results.append({
+            "test": test_name,
+            "success": success,
+            "message": message
+        })
+
+    def create_lesson(self, is_active: bool = True) -> int:
+        db = SessionLocal()
+        try:
+            lesson = Lesson(title="Грамматика", level="beginner", max_students=1,
+                            day_of_week="Thursday", start_time="19:00", is_active=is_active)
+            db.add(lesson)
+            db.commit()
+            return lesson.id
+        finally:
+            db.close()
+
+    def create_user(self, telegram_id: str) -> int:
+        UserRepository.create_user(telegram_id)
+        return UserRepository.get_by_telegram_id(telegram_id).id
+
+    def book(self, telegram_id: str, lesson_id: int, idempotency_key: str = None):
+        headers = {'Authorization': f"Bearer {create_telegram_token(telegram_id)}"}
+        if idempotency_key:
+            headers['Idempotency-Key'] = idempotency_key
+        return self.client.post('/api/v1/book', json={'lesson_id': lesson_id}, headers=headers)
+
+    def test_waitlist_when_full(self) -> bool:
+        """Мест нет - пользователь в листе ожидания (202)"""
+        lesson_id = self.create_lesson()
+        self.create_user("booking_first")
+        self.create_user("booking_waiting")
+        first = self.book("booking_first", lesson_id)
+        waiting = self.book("booking_waiting", lesson_id)
+        print(f"   статусы: {first.status_code}, {waiting.status_code}")
+        return first.status_code == 200 and waiting.status_code == 202 and waiting.json()['position'] == 1
+
+    def test_seat_freed_while_joining_waitlist(self) -> bool:
+        """Место освободилось во время постановки в очередь - повтор с ключом возвращает ту же запись"""
+        lesson_id = self.create_lesson()
+        holder_id = self.create_user("booking_holder")
+        self.create_user("booking_racer")
+        holder_booking_id = self.book("booking_holder", lesson_id).json()['booking_id']
+
+        join_waitlist = BookingRepository.join_waitlist
+
+        def cancel_then_join(*args, **kwargs):
+            BookingRepository.cancel_booking(holder_id, holder_booking_id)
+            return join_waitlist(*args, **kwargs)
+
+        BookingRepository.join_waitlist = staticmethod(cancel_then_join)
+        try:
+            booked = self.book("booking_racer", lesson_id, "racer-key")
+        finally:
+            BookingRepository.join_waitlist = staticmethod(join_waitlist)
+        replayed = self.book("booking_racer", lesson_id, "racer-key")
+
+        print(f"   статусы: {booked.status_code}, повтор: {replayed.status_code}")
+        return (booked.status_code == 200 and replayed.status_code == 200
+                and booked.json()['booking_id'] == replayed.json()['booking_id'])
+
+    def test_key_reused_for_other_lesson(self) -> bool:
+        """Ключ, использованный для другого урока, - 422"""
+        first_lesson_id = self.create_lesson()
+        second_lesson_id = self.create_lesson()
+        self.create_user("booking_key_user")
+        first = self.book("booking_key_user", first_lesson_id, "shared-key")
+        second = self.book("booking_key_user", second_lesson_id, "shared-key")
+        print(f"   статусы: {first.status_code}, {second.status_code}")
+        return first.status_code == 200 and second.status_code == 422
+
+    def test_inactive_lesson(self) -> bool:
+        """Урок, который больше не проводится, - 400"""
+        lesson_id = self.create_lesson(is_active=False)
+        self.create_user("booking_inactive")
+        return self.book("booking_inactive", lesson_id).status_code == 400
+
+    def run_all_tests(self):
+        """Запуск всех тестов"""
+        print("🧪 ТЕСТИРОВАНИЕ ЗАПИСИ НА УРОК")
+        print("=" * 50)
+
+        init_db()
+
+        tests = [
+            ("Лист ожидания", self.test_waitlist_when_full),
+            ("Место освободилось при постановке в очередь", self.test_seat_freed_while_joining_waitlist),
+            ("Ключ для другого урока", self.test_key_reused_for_other_lesson),
+            ("Неактивный урок", self.test_inactive_lesson)
+        ]
+        for test_name, test in tests:
+            try:
+                self.log_test(test_name, test(), test.__doc__)
+            except Exception as e:
+                self.log_test(test_name, False, f"Исключение: {e}")
+
+        passed_tests = sum(1 for result in self.test_results if result["success"])
+        total_tests = len(self.test_results)
+        print(f"\nПройдено: {passed_tests} из {total_tests}")
+        return passed_tests == total_tests
+
+def main():
+    """Главная функция тестирования"""
+    tester = LessonBookingTester()
+    success = tester.run_all_tests()
+    sys.exit(0 if success else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Проверка списка записавшихся на занятие
+GET /lessons/{lesson_id}/occurrences/{occurrence_id}/roster во временной
+БД: список видят только преподаватели и администраторы
+"""
+
+import os
+import sys
+import tempfile
+
+# Временная БД, чтобы не трогать рабочую
+os.environ['DATABASE_URL'] = f"sqlite:///{tempfile.mkdtemp()}/lesson_roster_test.db"
+os.environ['STAFF_TELEGRAM_IDS'] = "roster_teacher"
+
+from datetime import datetime
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from backend.auth import create_telegram_token
+from backend.routes_secure import router
+from db.database import SessionLocal
+from db.init_db import init_db
+from db.models import Lesson
+from db.repositories import BookingRepository, LessonOccurrenceRepository, UserRepository
+
+class LessonRosterTester:
+    """Тестер списка записавшихся на занятие"""
+
+    def __init__(self):
+        self.test_results = []
+        app = FastAPI()
+        app.include_router(router, prefix="/api/v1")
+        self.client = TestClient(app)
+
+    def log_test(self, test_name: str, success: bool, message: str = ""):
+        """Логирование результата теста"""
+        status = "✅ ПРОЙДЕН" if success else "❌ ПРОВАЛЕН"
+        print(f"{status} {test_name}")
+        if message:
+            print(f"   {message}")
+
+        self.test_results.append({
+            "test": test_name,
+            "success": success,
+            "message": message
+        })
+
+    def create_lesson(self) -> int:
+        db = SessionLocal()
+        try:
+            lesson = Lesson(title="Разговорный английский", level="beginner", max_students=5,
+                            day_of_week="Wednesday", start_time="18:00")
+            db.add(lesson)
+            db.commit()
+            return lesson.id
+        finally:
+            db.close()
+
+    def get_roster(self, telegram_id: str, lesson_id: int, occurrence_id: int):
+        return self.client.get(
+            f'/api/v1/lessons/{lesson_id}/occurrences/{occurrence_id}/roster',
+            headers={'Authorization': f"Bearer {create_telegram_token(telegram_id)}"}
+        )
+
+    def setup_occurrence(self) -> tuple:
+        """Урок, его ближайшее занятие и три записи на него"""
+        lesson_id = self.create_lesson()
+        LessonOccurrenceRepository.ensure_horizon(lesson_id=lesson_id)
+        occurrence = LessonOccurrenceRepository.get_upcoming(lesson_id, 1)[0]
+        starts_at = datetime.fromisoformat(occurrence['starts_at'])
+        for i in range(3):
+            user = UserRepository.get_by_telegram_id(f"roster_student_{i}")
+            BookingRepository.create_booking(user.id, lesson_id, starts_at)
+        return lesson_id, occurrence['id']
+
+    def test_staff_sees_roster(self) -> bool:
+        """Преподаватель получает записавшихся в порядке записи"""
+        response = self.get_roster("roster_teacher", self.lesson_id, self.occurrence_id)
+        data = response.json()
+        print(f"   статус: {response.status_code}, записавшихся: {data.get('total')}")
+        return (response.status_code == 200 and data['total'] == 3
+                and [entry['telegram_id'] for entry in data['roster']] == [f"roster_student_{i}" for i in range(3)])
+
+    def test_student_forbidden(self) -> bool:
+        """Студент не видит список записавшихся"""
+        return self.get_roster("roster_student_0", self.lesson_id, self.occurrence_id).status_code == 403
+
+    def test_unauthorized(self) -> bool:
+        """Без токена список не выдается"""
+        response = self.client.get(f'/api/v1/lessons/{self.lesson_id}/occurrences/{self.occurrence_id}/roster')
+        return response.status_code in (401, 403)
+
+    def test_foreign_occurrence(self) -> bool:
+        """Занятие другого урока - 404"""
+        other_lesson_id = self.create_lesson()
+        return self.get_roster("roster_teacher", other_lesson_id, self.occurrence_id).status_code == 404
+
+    def run_all_tests(self):
+        """Запуск всех тестов"""
+        print("🧪 ТЕСТИРОВАНИЕ СПИСКА ЗАПИСАВШИХСЯ НА ЗАНЯТИЕ")
+        print("=" * 50)
+
+        init_db()
+        UserRepository.create_user("roster_teacher")
+        for i in range(3):
+            UserRepository.create_user(f"roster_student_{i}")
+        self.lesson_id, self.occurrence_id = self.setup_occurrence()
+
+        tests = [
+            ("Список для преподавателя", self.test_staff_sees_roster),
+            ("Запрет для студента", self.test_student_forbidden),
+            ("Без авторизации", self.test_unauthorized),
+            ("Чужое занятие", self.test_foreign_occurrence)
+        ]
+        for test_name, test in tests:
+            try:
+                self.log_test(test_name, test(), test.__doc__)
+            except Exception as e:
+                self.log_test(test_name, False, f"Исключение: {e}")
+
+        passed_tests = sum(1 for result in self.test_results if result["success"])
+        total_tests = len(self.test_results)
+        print(f"\nПройдено: {passed_tests} из {total_tests}")
+        return passed_tests == total_tests
+
+def main():
+    """Главная функция тестирования"""
+    tester = LessonRosterTester()
+    success = tester.run_all_tests()
+    sys.exit(0 if success else 1)
+
+if __name__ == "__main__":
+    main()
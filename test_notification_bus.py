@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Проверка публикации событий уведомлений
+Шина без локальных подписчиков (как у межпроцессной реализации) должна
+получать события, а поток уведомлений - выдаваться только по токену
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+
+# Временная БД, чтобы не трогать рабочую
+os.environ['DATABASE_URL'] = f"sqlite:///{tempfile.mkdtemp()}/notification_bus_test.db"
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from backend.routes_secure import router
+from db.init_db import init_db
+from db.notification_bus import (
+    LocalNotificationBus, NotificationBus, get_notification_bus, set_notification_bus
+)
+from db.repositories import NotificationRepository, UserRepository
+
+class RecordingBus(NotificationBus):
+    """Шина, пересылающая события в другие процессы: своих подписчиков нет"""
+
+    def __init__(self):
+        self.events = []
+
+    def has_subscribers(self, user_id: int) -> bool:
+        return False
+
+    def publish(self, user_id: int, event):
+        self.events.append((user_id, event))
+
+class NotificationBusTester:
+    """Тестер публикации событий уведомлений"""
+
+    def __init__(self):
+        self.test_results = []
+        app = FastAPI()
+        app.include_router(router, prefix="/api/v1")
+        self.client = TestClient(app)
+
+    def log_test(self, test_name: str, success: bool, message: str = ""):
+        """Логирование результата теста"""
+        status = "✅ ПРОЙДЕН" if success else "❌ ПРОВАЛЕН"
+        print(f"{status} {test_name}")
+        if message:
+            print(f"   {message}")
+
+        self.test_results.append({
+            "test": test_name,
+            "success": success,
+            "message": message
+        })
+
+    def create_user(self, telegram_id: str) -> int:
+        UserRepository.create_user(telegram_id)
+        return UserRepository.get_by_telegram_id(telegram_id).id
+
+    def test_publish_without_local_subscribers(self) -> bool:
+        """Событие уходит в шину, даже если в этом процессе нет подписчиков"""
+        user_id = self.create_user("bus_user_remote")
+        bus = RecordingBus()
+        previous = get_notification_bus()
+        set_notification_bus(bus)
+        try:
+            notification = NotificationRepository.create_notification(user_id, "Тест", "Проверка шины", "test")
+            NotificationRepository.mark_as_read(notification.id, user_id)
+        finally:
+            set_notification_bus(previous)
+
+        types = [event["type"] for _, event in bus.events]
+        print(f"   события: {types}, счетчики: {[event['unread_count'] for _, event in bus.events]}")
+        return types == ["notification", "read"] and [event["unread_count"] for _, event in bus.events] == [1, 0]
+
+    def test_local_bus_skips_idle_users(self) -> bool:
+        """Локальная шина не считает события пользователей без подключений"""
+        async def publish() -> int:
+            bus = LocalNotificationBus()
+            bus.publish(1, {"type": "notification"})
+            subscription = bus.subscribe(2)
+            bus.publish(2, {"type": "notification"})
+            bus.unsubscribe(subscription)
+            return bus.get_stats()["published"]
+
+        return asyncio.run(publish()) == 1
+
+    def test_stream_requires_token(self) -> bool:
+        """Поток уведомлений без токена или с неверным токеном не выдается"""
+        missing = self.client.get('/api/v1/notifications/stream')
+        invalid = self.client.get('/api/v1/notifications/stream', params={"token": "invalid"})
+        legacy = self.client.get('/api/v1/notifications/stream', params={"user_id": "bus_user_remote"})
+        print(f"   без токена: {missing.status_code}, неверный: {invalid.status_code}, по user_id: {legacy.status_code}")
+        return missing.status_code == 422 and invalid.status_code == 401 and legacy.status_code == 422
+
+    def run_all_tests(self):
+        """Запуск всех тестов"""
+        print("🧪 ТЕСТИРОВАНИЕ ПУБЛИКАЦИИ СОБЫТИЙ УВЕДОМЛЕНИЙ")
+        print("=" * 50)
+
+        init_db()
+
+        tests = [
+            ("Публикация без локальных подписчиков", self.test_publish_without_local_subscribers),
+            ("Локальная шина", self.test_local_bus_skips_idle_users),
+            ("Поток только по токену", self.test_stream_requires_token)
+        ]
+        for test_name, test in tests:
+            try:
+                self.log_test(test_name, test(), test.__doc__)
+            except Exception as e:
+                self.log_test(test_name, False, f"Исключение: {e}")
+
+        passed_tests = sum(1 for result in self.test_results if result["success"])
+        total_tests = len(self.test_results)
+        print(f"\nПройдено: {passed_tests} из {total_tests}")
+        return passed_tests == total_tests
+
+def main():
+    """Главная функция тестирования"""
+    tester = NotificationBusTester()
+    success = tester.run_all_tests()
+    sys.exit(0 if success else 1)
+
+if __name__ == "__main__":
+    main()
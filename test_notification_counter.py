@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Проверка счетчика непрочитанных уведомлений
+Создание уведомлений вперемешку с первым чтением счетчика во временной
+БД: счетчик должен совпадать с подсчетом по таблице уведомлений
+"""
+
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+# Временная БД, чтобы не трогать рабочую
+os.environ['DATABASE_URL'] = f"sqlite:///{tempfile.mkdtemp()}/notification_counter_test.db"
+
+from db.database import SessionLocal
+from db.init_db import init_db
+from db.models import Notification, NotificationCounter
+from db.repositories import NotificationRepository, UserRepository
+
+USERS = 10
+NOTIFICATIONS_PER_USER = 20
+THREADS = 16
+
+class NotificationCounterTester:
+    """Тестер счетчика непрочитанных уведомлений"""
+
+    def __init__(self):
+        self.test_results = []
+
+    def log_test(self, test_name: str, success: bool, message: str = ""):
+        """Логирование результата теста"""
+        status = "✅ ПРОЙДЕН" if success else "❌ ПРОВАЛЕН"
+        print(f"{status} {test_name}")
+        if message:
+            print(f"   {message}")
+
+        self.test_results.append({
+            "test": test_name,
+            "success": success,
+            "message": message
+        })
+
+    def create_user(self, telegram_id: str) -> int:
+        UserRepository.create_user(telegram_id)
+        return UserRepository.get_by_telegram_id(telegram_id).id
+
+    def counter_state(self, user_id: int) -> tuple:
+        """(значение счетчика, число непрочитанных по таблице)"""
+        db = SessionLocal()
+        try:
+            counter = db.get(NotificationCounter, user_id)
+            unread = db.query(Notification).filter(
+                Notification.user_id == user_id,
+                Notification.is_read == False
+            ).count()
+            return (counter.unread_count if counter else None), unread
+        finally:
+            db.close()
+
+    def notify(self, user_id: int):
+        NotificationRepository.create_notification(user_id, "Тест", "Проверка счетчика", "test")
+
+    def test_create_between_count_and_insert(self) -> bool:
+        """Уведомление, созданное до появления счетчика, учитывается при первом чтении"""
+        user_id = self.create_user("counter_user_interleaved")
+        self.notify(user_id)
+
+        # Первое чтение уже посчитало уведомления, но счетчик еще не создан
+        db = SessionLocal()
+        try:
+            stale_count = db.query(Notification).filter(Notification.user_id == user_id).count()
+        finally:
+            db.close()
+        self.notify(user_id)
+
+        unread = NotificationRepository.get_unread_count(user_id)
+        counter, actual = self.counter_state(user_id)
+        print(f"   прочитано до создания: {stale_count}, счетчик: {counter}, по таблице: {actual}")
+        return unread == counter == actual == 2
+
+    def test_parallel_first_reads(self) -> bool:
+        """Параллельные создания и первые чтения не теряют изменений"""
+        user_ids = [self.create_user(f"counter_user_{i}") for i in range(USERS)]
+
+        def work(task: tuple):
+            action, user_id = task
+            if action == 'read':
+                NotificationRepository.get_unread_count(user_id)
+            else:
+                self.notify(user_id)
+
+        tasks = []
+        for _ in range(NOTIFICATIONS_PER_USER):
+            for user_id in user_ids:
+                tasks += [('notify', user_id), ('read', user_id)]
+        with ThreadPoolExecutor(max_workers=THREADS) as executor:
+            list(executor.map(work, tasks))
+
+        states = [self.counter_state(user_id) for user_id in user_ids]
+        print(f"   (счетчик, по таблице): {states[:3]} ...")
+        return all(counter == actual == NOTIFICATIONS_PER_USER for counter, actual in states)
+
+    def test_read_without_counter(self) -> bool:
+        """Прочтение без созданного счетчика не уводит его ниже нуля"""
+        user_id = self.create_user("counter_user_read")
+        self.notify(user_id)
+        self.notify(user_id)
+        db = SessionLocal()
+        try:
+            db.query(NotificationCounter).filter(NotificationCounter.user_id == user_id).delete()
+            db.commit()
+        finally:
+            db.close()
+
+        NotificationRepository.mark_all_as_read(user_id)
+        counter, actual = self.counter_state(user_id)
+        print(f"   счетчик: {counter}, по таблице: {actual}")
+        return counter == actual == 0
+
+    def run_all_tests(self):
+        """Запуск всех тестов"""
+        print("🧪 ТЕСТИРОВАНИЕ СЧЕТЧИКА НЕПРОЧИТАННЫХ УВЕДОМЛЕНИЙ")
+        print("=" * 50)
+
+        init_db()
+
+        tests = [
+            ("Создание до первого чтения", self.test_create_between_count_and_insert),
+            ("Параллельные первые чтения", self.test_parallel_first_reads),
+            ("Прочтение без счетчика", self.test_read_without_counter)
+        ]
+        for test_name, test in tests:
+            try:
+                self.log_test(test_name, test(), test.__doc__)
+            except Exception as e:
+                self.log_test(test_name, False, f"Исключение: {e}")
+
+        passed_tests = sum(1 for result in self.test_results if result["success"])
+        total_tests = len(self.test_results)
+        print(f"\nПройдено: {passed_tests} из {total_tests}")
+        return passed_tests == total_tests
+
+def main():
+    """Главная функция тестирования"""
+    tester = NotificationCounterTester()
+    success = tester.run_all_tests()
+    sys.exit(0 if success else 1)
+
+if __name__ == "__main__":
+    main()
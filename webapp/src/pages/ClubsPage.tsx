@@ -33,6 +33,10 @@ const ClubsPage: React.FC = () => {
         setJoinStatus(prev => ({ ...prev, [selectedClub.id]: true }));
         alert(`Вы успешно присоединились к клубу "${selectedClub.name}"!`);
         setSelectedClub(null);
+      } else if (response.waitlisted) {
+        hapticFeedback('light');
+        alert(response.message);
+        setSelectedClub(null);
       } else {
         hapticFeedback('heavy');
         alert(response.error || 'Ошибка при присоединении к клубу');
@@ -22,9 +22,15 @@ interface NotificationSettings {
   timezone: string;
 }
 
+// Уведомлений за один запрос; следующие страницы подгружаются по курсору
+const PAGE_SIZE = 20;
+
 const NotificationsPage: React.FC = () => {
   const { user } = useTelegramApp();
   const [notifications, setNotifications] = useState<Notification[]>([]);
+  const [unreadCount, setUnreadCount] = useState(0);
+  const [hasMore, setHasMore] = useState(false);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [settings, setSettings] = useState<NotificationSettings | null>(null);
   const [loading, setLoading] = useState(true);
   const [showSettings, setShowSettings] = useState(false);
@@ -33,8 +39,10 @@ const NotificationsPage: React.FC = () => {
     if (!user?.id) return;
     
     try {
-      const response = await apiService.getNotifications(user.id.toString());
+      const response = await apiService.getNotifications(user.id.toString(), { limit: PAGE_SIZE });
       setNotifications(response.notifications || []);
+      setUnreadCount(response.unread_count || 0);
+      setHasMore(Boolean(response.has_more));
     } catch (error) {
       console.error('Ошибка загрузки уведомлений:', error);
     } finally {
@@ -42,6 +50,26 @@ const NotificationsPage: React.FC = () => {
     }
   }, [user?.id]);
 
+  // Следующая страница: уведомления старше последнего загруженного
+  const loadMore = async () => {
+    if (!user?.id || loadingMore || notifications.length === 0) return;
+    
+    setLoadingMore(true);
+    try {
+      const response = await apiService.getNotifications(user.id.toString(), {
+        beforeId: notifications[notifications.length - 1].id,
+        limit: PAGE_SIZE
+      });
+      setNotifications(prev => [...prev, ...(response.notifications || [])]);
+      setUnreadCount(response.unread_count || 0);
+      setHasMore(Boolean(response.has_more));
+    } catch (error) {
+      console.error('Ошибка загрузки уведомлений:', error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const loadSettings = useCallback(async () => {
     if (!user?.id) return;
     
@@ -60,6 +88,52 @@ const NotificationsPage: React.FC = () => {
     }
   }, [user?.id, loadNotifications, loadSettings]);
 
+  // Новые уведомления и счетчик приходят по открытому соединению
+  useEffect(() => {
+    if (!user?.id) return;
+    
+    const userId = user.id.toString();
+    let source: EventSource | null = null;
+    let cancelled = false;
+    const updateUnreadCount = (event: MessageEvent) => {
+      setUnreadCount(JSON.parse(event.data).unread_count);
+    };
+    
+    // Поток доступен только по токену: сначала получаем его, затем подключаемся
+    const subscribe = async () => {
+      const { access_token } = await apiService.login(userId);
+      if (cancelled) return;
+      
+      const stream = apiService.subscribeToNotifications(access_token);
+      source = stream;
+      stream.addEventListener('unread_count', updateUnreadCount);
+      stream.addEventListener('notification', (event) => {
+        const data = JSON.parse((event as MessageEvent).data);
+        setNotifications(prev =>
+          prev.some(n => n.id === data.notification.id) ? prev : [data.notification, ...prev]
+        );
+        setUnreadCount(data.unread_count);
+      });
+      stream.addEventListener('read', (event) => {
+        const data = JSON.parse((event as MessageEvent).data);
+        setNotifications(prev =>
+          prev.map(n => n.id === data.notification_id ? { ...n, is_read: true } : n)
+        );
+        setUnreadCount(data.unread_count);
+      });
+      stream.addEventListener('read_all', (event) => {
+        setNotifications(prev => prev.map(n => ({ ...n, is_read: true })));
+        updateUnreadCount(event as MessageEvent);
+      });
+    };
+    
+    subscribe().catch(error => console.error('Ошибка подключения к потоку уведомлений:', error));
+    return () => {
+      cancelled = true;
+      source?.close();
+    };
+  }, [user?.id]);
+
   const markAsRead = async (notificationId: number) => {
     if (!user?.id) return;
     
@@ -68,6 +142,7 @@ const NotificationsPage: React.FC = () => {
       setNotifications(prev => 
         prev.map(n => n.id === notificationId ? { ...n, is_read: true } : n)
       );
+      setUnreadCount(prev => Math.max(prev - 1, 0));
     } catch (error) {
       console.error('Ошибка отметки уведомления:', error);
     }
@@ -79,6 +154,7 @@ const NotificationsPage: React.FC = () => {
     try {
       await apiService.markAllNotificationsRead(user.id.toString());
       setNotifications(prev => prev.map(n => ({ ...n, is_read: true })));
+      setUnreadCount(0);
     } catch (error) {
       console.error('Ошибка отметки всех уведомлений:', error);
     }
@@ -133,8 +209,6 @@ const NotificationsPage: React.FC = () => {
     );
   }
 
-  const unreadCount = notifications.filter(n => !n.is_read).length;
-
   return (
     <div className="notifications-page">
       <div className="header">
@@ -266,6 +340,15 @@ const NotificationsPage: React.FC = () => {
                   </div>
                 ))
               )}
+              {hasMore && (
+                <button 
+                  className="action-button"
+                  onClick={loadMore}
+                  disabled={loadingMore}
+                >
+                  {loadingMore ? 'Загрузка...' : 'Показать еще'}
+                </button>
+              )}
             </div>
           </>
         )}
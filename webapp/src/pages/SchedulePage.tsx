@@ -41,6 +41,10 @@ const SchedulePage: React.FC = () => {
         hapticFeedback('medium');
         alert('Урок забронирован успешно!');
         setSelectedLesson(null);
+      } else if (response.waitlisted) {
+        hapticFeedback('light');
+        alert(response.message);
+        setSelectedLesson(null);
       } else {
         hapticFeedback('heavy');
         alert('Ошибка при бронировании');
@@ -91,11 +91,33 @@ export const apiService = {
   },
 
   // Уведомления
-  async getNotifications(userId: string): Promise<any> {
-    const response = await api.get(`/notifications?user_id=${userId}`);
+  async getNotifications(
+    userId: string,
+    options: { beforeId?: number; afterId?: number; type?: string; unreadOnly?: boolean; limit?: number } = {}
+  ): Promise<any> {
+    const params = new URLSearchParams();
+    params.append('user_id', userId);
+    if (options.beforeId) params.append('before_id', options.beforeId.toString());
+    if (options.afterId) params.append('after_id', options.afterId.toString());
+    if (options.type) params.append('notification_type', options.type);
+    if (options.unreadOnly) params.append('unread_only', 'true');
+    if (options.limit) params.append('limit', options.limit.toString());
+    
+    const response = await api.get(`/notifications?${params.toString()}`);
     return response.data;
   },
 
+  // Токен доступа (EventSource не передает заголовки, поэтому поток получает его в параметре)
+  async login(telegramId: string): Promise<{ access_token: string }> {
+    const response = await api.post('/auth/login', { telegram_id: telegramId });
+    return response.data;
+  },
+
+  // Поток новых уведомлений (Server-Sent Events) вместо периодических запросов
+  subscribeToNotifications(token: string): EventSource {
+    return new EventSource(`${API_BASE_URL}/notifications/stream?token=${encodeURIComponent(token)}`);
+  },
+
   async getNotificationSettings(userId: string): Promise<any> {
     const response = await api.get(`/notifications/settings?user_id=${userId}`);
     return response.data;
@@ -168,8 +168,10 @@ export interface LessonsResponse {
 export interface BookingResponse {
   success: boolean;
   message: string;
-  lesson: ScheduleItem;
-  booking_id: string;
+  lesson?: ScheduleItem;
+  booking_id?: string;
+  waitlisted?: boolean;
+  position?: number;
 }
 
 export interface TestSubmitResponse {